@@ -20,7 +20,7 @@ Example::
     # create a ssh connection
     ssh=mc.SshConn(name="ssh1", host="192.168.2.123", user="tester", pw="test")
     # send a command
-    print serial.cmd("ls -al")
+    print(serial.cmd("ls -al"))
     [...]
     # send a command
     ssh.cmd("ls -al")
@@ -29,19 +29,37 @@ Example::
 
 import io
 import os
+import copy
 import sys
 import re
 import logging
 import time
 import json
-
-import pexpect
-from pexpect import pxssh
-from pexpect import spawn
-from pexpect import fdpexpect
-import pyte
+import hashlib
+import zlib
+import gzip
+import shlex
+import base64
+import binascii
+import atexit
+import threading
+import collections
 
 import monk_tf.general_purpose as gp
+import monk_tf.metrics as mm
+
+# loaded when the first session starts or the first output is parsed
+pexpect = gp.lazy_import("pexpect")
+pxssh = gp.lazy_import("pexpect.pxssh")
+fdpexpect = gp.lazy_import("pexpect.fdpexpect")
+pyte = gp.lazy_import("pyte")
+msp = gp.lazy_import("monk_tf.spawns")
+
+def __getattr__(name):
+    # the classes that extend pexpect moved to monk_tf.spawns
+    if name in ("pxsshWorkaround", "ReplaySpawn"):
+        return getattr(msp, name)
+    raise AttributeError("module '{}' has no attribute '{}'".format(__name__, name))
 
 ############
 #
@@ -85,6 +103,12 @@ class TimeoutException(AConnectionException):
     """
     pass
 
+class NotSentException(AConnectionException):
+    """ is raised if a connection broke before a command was sent completely;
+        the command didn't run
+    """
+    pass
+
 class CmdFailedException(AConnectionException):
     """ is raised in an eval_cmd() request if the returncode was != 0. The returncode can be parsed from the Exception's message.
     """
@@ -95,6 +119,22 @@ class RetriesExceededException(AConnectionException):
     """
     pass
 
+class CantCloneException(AConnectionException):
+    """ is raised if a connection type can't open a second session
+    """
+    pass
+
+class ReplayMismatchException(AConnectionException):
+    """ is raised if a replayed connection sends something else than the
+        recorded one did
+    """
+    pass
+
+class TransferFailedException(AConnectionException):
+    """ is raised if a text didn't arrive completely on the target device
+    """
+    pass
+
 #############
 #
 # Connections
@@ -114,8 +154,43 @@ class ConnectionBase(gp.MonkObject):
 
 
 
+    # commands that reboot the target device and therefore outdate the cache
+    REBOOT_CMDS = re.compile(r"^\s*(reboot|shutdown\s+-r|init\s+6)\b")
+
+    # the continuation prompt that acknowledges each line of a here-document
+    PS2 = "> "
+
+    # single commands that change the state of the shell session
+    STATE_CMDS = re.compile(
+        r"^\s*(cd|export|unset|alias|unalias|source|\.|stty|umask|ulimit|set)(\s[^;&|\n]*)?$")
+
+    # appended to a relative cd, so its output tells the absolute path;
+    # the quotes keep the echo of the command from matching CWD_LINE
+    CWD_ECHO = ' && echo "<cw""d>$PWD</cwd>"'
+    CWD_LINE = re.compile(rb"<cwd>(.*?)</cwd>\r?\n?")
+
+    # where run_script() keeps the uploaded scripts on the target
+    SCRIPT_CACHE_DIR = "/tmp/monk-cache"
+
+    # the exit status instead of the script's if it isn't uploaded yet
+    SCRIPT_CACHE_MISS_RC = 199
+
+    # how many bytes put_text() sends at once to keep a bwlimit, if the
+    # connection has no chunk_size
+    PACED_BATCH_SIZE = 4096
+
+    # how many compiled pattern lists each connection keeps
+    PATTERN_CACHE_SIZE = 128
+
+    # the return code line that cmd() appends to the output
+    RETCODE_LINE = re.compile(r"\n?<retcode>(\d+)</retcode>.*$")
+
     def __init__(self, name, target, user, pw,
-            default_timeout=None, first_prompt_timeout=None):
+            default_timeout=None, first_prompt_timeout=None,
+            cache_patterns=None, cache_ttl=300, cache_size=64,
+            chunk_size=None, chunk_delay=0,
+            retry_delay=0.1, retry_delay_max=3, replay_state=True,
+            record=None, replay=None, replay_speed=0):
         """
         :param name: the name of this connection and its corresponding logger
 
@@ -130,6 +205,38 @@ class ConnectionBase(gp.MonkObject):
         :param first_prompt_timeout: how long a relogin is tried until the
                                      connection is considered dead.
 
+        :param cache_patterns: regular expressions for commands that are
+                               idempotent; their results are cached, see
+                               :py:meth:`cmd`
+
+        :param cache_ttl: how many seconds a cached result stays valid
+
+        :param cache_size: how many results are cached at most
+
+        :param chunk_size: longer lines are sent in pieces of this many bytes;
+                           None sends everything at once
+
+        :param chunk_delay: seconds to wait after each piece, so the target
+                            can empty its input buffer
+
+        :param retry_delay: seconds before the first retry of a connect or
+                            prompt; the pause doubles with every retry
+
+        :param retry_delay_max: the longest pause between two retries
+
+        :param replay_state: whether commands that change the shell's state,
+                             like cd or export, are recorded and repeated
+                             after a reconnect, see :py:attr:`shell_state`
+
+        :param record: a file where everything that is sent and received is
+                       recorded, see :py:class:`Recording`
+
+        :param replay: a recorded file; the connection plays it instead of
+                       talking to a :term:`target device`
+
+        :param replay_speed: 1 replays with the recorded timing, 0 (default)
+                             as fast as possible
+
         """
         super(ConnectionBase, self).__init__(
                 name=name,
@@ -140,6 +247,28 @@ class ConnectionBase(gp.MonkObject):
         self.pw = pw
         self.default_timeout = default_timeout or 30
         self.first_prompt_timeout = int(first_prompt_timeout) if first_prompt_timeout else 120
+        self.metrics = mm.Metrics()
+        self.last_timing = {}
+        self._connect_time = 0.0
+        # wait_for_prompt() may end before first_prompt_timeout
+        self._prompt_deadline = None
+        self._current_test = None
+        if isinstance(cache_patterns, str):
+            cache_patterns = [cache_patterns]
+        self.cache_patterns = [re.compile(p) for p in cache_patterns or []]
+        self.cache = CmdCache(size=int(cache_size), ttl=float(cache_ttl))
+        self._can_compress = None
+        self._connected_before = False
+        self.chunk_size = int(chunk_size) if chunk_size else None
+        self.chunk_delay = float(chunk_delay or 0)
+        self.retry_delay = float(retry_delay)
+        self.retry_delay_max = float(retry_delay_max)
+        # fixture files only know strings
+        self.replay_state = str(replay_state).lower() not in ("false", "no", "0")
+        self.shell_state = collections.OrderedDict()
+        self.recording = Recording(record, self) if record else None
+        self._replay = Replay(replay, replay_speed) if replay else None
+        self._patterns = {}
 
 
     @property
@@ -152,13 +281,146 @@ class ConnectionBase(gp.MonkObject):
             return self._exp
         except AttributeError as e:
             self.log("have no pexpect object yet")
-            self._exp = self._get_exp()
+            start = time.time()
+            if self._replay:
+                self._exp = msp.ReplaySpawn(self._replay, timeout=self.default_timeout)
+            else:
+                self._exp = self._get_exp()
+                if self.recording:
+                    self.recording.new_session(self._exp)
+            # a new session may come with a new prompt
+            self._patterns.clear()
             self._exp.sendline("stty -echo")
-            self._exp.expect(self.prompt)
+            self._exp.expect_list(self.compile_patterns(self.prompt))
+            reconnect = self._connected_before
+            if reconnect and self.replay_state and self.shell_state:
+                self._replay_shell_state()
+            duration = time.time() - start
+            self._connect_time += duration
+            self._observe("connect", duration)
+            self._count("connects")
+            if reconnect:
+                self._observe("reconnect", duration)
+                self._count("reconnects")
+            self._connected_before = True
             return self._exp
 
+    def _replay_shell_state(self):
+        """ repeat the recorded :py:attr:`shell_state` in a fresh session
+        """
+        # braces keep cd and export in the current shell
+        script = "{{ {}; }} >/dev/null 2>&1".format(
+                "; ".join(self.shell_state.values()))
+        self.log("replay shell state: {}".format(script))
+        self._exp.sendline(script)
+        self._exp.expect_list(self.compile_patterns(self.prompt))
+        self._count("state_replays")
+
+    def _record_shell_state(self, msg, cwd=None):
+        """ remember a successful command that changed the shell's state
+
+        Later commands of the same kind replace earlier ones, e.g. only the
+        last cd and the last export of each variable are kept. A cd is
+        recorded with the absolute path it led to and an export that uses
+        the variable's old value is kept in addition to the earlier ones.
+        A sourced file is recorded with the cd it was found after, because
+        the last cd is replayed after it.
+
+        :param msg: the command
+        :param cwd: the absolute path a relative cd led to
+        """
+        words = msg.split()
+        if words[0] == "cd":
+            key = "cd"
+            if cwd is not None:
+                msg = "cd {}".format(shlex.quote(cwd))
+        elif words[0] in ("source", ".") and "cd" in self.shell_state:
+            key = msg
+            msg = "{} && {}".format(self.shell_state["cd"], msg)
+        elif words[0] == "umask":
+            key = words[0]
+        elif words[0] in ("export", "unset", "alias", "unalias") and len(words) > 1:
+            name = words[1].split("=")[0]
+            key = " ".join([words[0], name])
+            if re.search(r"\$\{?" + re.escape(name) + r"\b", msg):
+                # builds on what was set before, which must stay
+                key = (key, len(self.shell_state))
+            else:
+                for k in [k for k in self.shell_state if isinstance(k, tuple) and k[0] == key]:
+                    del self.shell_state[k]
+        else:
+            key = msg
+        self.shell_state.pop(key, None)
+        self.shell_state[key] = msg
+        self.log("shell state: {}".format(list(self.shell_state.values())))
+
+    def _is_relative_cd(self, msg):
+        """ :return: whether msg is a cd that doesn't name an absolute path
+        """
+        words = msg.split()
+        return bool(self.STATE_CMDS.match(msg)) and words[0] == "cd" and (
+                len(words) != 2 or not words[1].startswith("/"))
+
+    def _split_cwd(self, raw):
+        """ take the line of :py:attr:`CWD_ECHO` out of the output
+
+        :return: the output without it and the path or None
+        """
+        if isinstance(raw, str):
+            raw = raw.encode("utf-8")
+        match = self.CWD_LINE.search(raw or b"")
+        if not match:
+            return raw, None
+        cwd = match.group(1).decode("utf-8", "replace")
+        return raw[:match.start()] + raw[match.end():], cwd
+
+    def reset_shell_state(self):
+        """ forget the recorded :py:attr:`shell_state`
+        """
+        self.shell_state.clear()
+
+    def _observe(self, phase, value):
+        """ add a measurement to this connection's :py:attr:`metrics`
+        """
+        self.metrics.observe(phase, value, test=self._current_test)
+
+    def _count(self, name, n=1):
+        """ increase a counter in this connection's :py:attr:`metrics`
+        """
+        self.metrics.count(name, n, test=self._current_test)
+
+    def compile_patterns(self, patterns):
+        """ compile patterns for :pexpect:meth:`spawn.expect_list`
+
+        pexpect compiles the patterns again in every expect() call. This
+        method does it only once per connection and keeps the result, so
+        patterns that are expected often, like the prompt, or expected in a
+        loop can be prepared in advance::
+
+            compiled = conn.compile_patterns([conn.prompt, "login: "])
+            index = conn.exp.expect_list(compiled, timeout=10)
+
+        :param patterns: a string, a compiled regex, EOF, TIMEOUT or a list
+                         of them, like the argument of expect()
+
+        :return: the list of compiled patterns
+        """
+        key = tuple(patterns) if isinstance(patterns, list) else (patterns,)
+        try:
+            return self._patterns[key]
+        except KeyError:
+            pass
+        compiled = msp.PATTERN_COMPILER.compile_pattern_list(list(key))
+        if len(self._patterns) >= self.PATTERN_CACHE_SIZE:
+            self.log("pattern cache is full, start over")
+            self._patterns.clear()
+        self._patterns[key] = compiled
+        self._count("patterns_compiled")
+        return compiled
+
     def _expect(self, pattern, timeout=-1, searchwindowsize=-1):
-        """ a wrapper for :pexpect:meth:`spawn.expect`
+        """ a wrapper for :pexpect:meth:`spawn.expect_list` with patterns
+            from :py:meth:`compile_patterns`
         """
         self.log("expect({},{},{})".format(
             str(pattern),
@@ -166,7 +428,8 @@ class ConnectionBase(gp.MonkObject):
             searchwindowsize,
         ))
         try:
-            out = self.exp.expect(pattern, timeout, searchwindowsize)
+            out = self.exp.expect_list(self.compile_patterns(pattern),
+                    timeout, searchwindowsize)
             self.log("_EXP OUTPUT: '{}'".format(out))
             self.log("expect succeeded.")
         except Exception as e:
@@ -188,10 +451,15 @@ class ConnectionBase(gp.MonkObject):
 
     def _sendline(self, s=""):
         """ a wrapper for :pexpect:meth:`spawn.sendline`
+
+        Lines that are longer than :py:attr:`chunk_size` are sent in pieces.
         """
         self.log("sendline('{}' to {})".format(s, self.target))
         try:
-            self.exp.sendline(s)
+            if self.chunk_size and len(s) >= self.chunk_size:
+                self._send_chunked(s + "\n")
+            else:
+                self.exp.sendline(s)
             self.log("sendline succeeded.")
         except Exception as e:
             self.log("sendline failed.(has pexpect? {})".format(
@@ -199,6 +467,29 @@ class ConnectionBase(gp.MonkObject):
             ))
             raise e
 
+    def _retry_sleep(self, attempt, end_time=None):
+        """ wait before the next try; the pauses grow exponentially from
+            :py:attr:`retry_delay` up to :py:attr:`retry_delay_max`
+        """
+        delay = min(self.retry_delay * 2 ** attempt, self.retry_delay_max)
+        if end_time is not None:
+            delay = max(min(delay, end_time - time.time()), 0)
+        self.log("sleep {:.2f}s before retry".format(delay))
+        time.sleep(delay)
+
+    def _send_chunked(self, s):
+        """ send in pieces of :py:attr:`chunk_size` bytes with
+            :py:attr:`chunk_delay` seconds in between
+        """
+        data = s.encode("utf-8") if isinstance(s, str) else s
+        size = self.chunk_size or len(data) or 1
+        self.log("send {} bytes in chunks of {}".format(len(data), size))
+        for i in range(0, len(data), size):
+            self.exp.send(data[i:i+size])
+            self._count("chunks")
+            if self.chunk_delay and not self._replay:
+                time.sleep(self.chunk_delay)
+
     def expect_prompt(self, timeout=None):
         """ enter + look in the output for what is currently set as self.prompt
         """
@@ -206,6 +497,12 @@ class ConnectionBase(gp.MonkObject):
         self._sendline("")
         self._expect(self.prompt, timeout=timeout or self.default_timeout)
 
+    def _connect_end(self):
+        """ :return: until when _get_exp() may try to connect
+        """
+        end_time = time.time() + self.first_prompt_timeout
+        return min(end_time, self._prompt_deadline or end_time)
+
     def wait_for_prompt(self, timeout=-1):
         """ this method continuously retries to get a working connection
 
@@ -217,22 +514,31 @@ class ConnectionBase(gp.MonkObject):
             timeout,
         ))
         end_time = time.time() + timeout
-        while time.time() <= end_time:
-            self.log("try prompt")
-            try:
-                self.expect_prompt(timeout)
-                self.log("ready")
-                self._exp.after = b''
-                return
-            except (pexpect.EOF, pexpect.TIMEOUT) as e:
-                self.log("could not retreive prompt")
-                self.close()
-                self.log("sleep before retry")
-                time.sleep(3)
+        attempt = 0
+        self._prompt_deadline = end_time
+        try:
+            while time.time() <= end_time:
+                self.log("try prompt")
+                try:
+                    # a single try must not use up the whole time
+                    self.expect_prompt(max(min(self.default_timeout,
+                        end_time - time.time()), 1))
+                    self.log("ready")
+                    self._exp.after = b''
+                    return
+                except (pexpect.EOF, pexpect.TIMEOUT) as e:
+                    self.log("could not retreive prompt")
+                    self._count("prompt_retries")
+                    self.close()
+                    self._retry_sleep(attempt, end_time)
+                    attempt += 1
+        finally:
+            self._prompt_deadline = None
         raise TimeoutException(
                 "was not able to find a prompt after {} seconds".format(timeout))
 
-    def cmd(self, msg, timeout=None, expect=None, do_retcode=True):
+    def cmd(self, msg, timeout=None, expect=None, do_retcode=True, cache=None,
+            compress=False, prompt_timeout=None):
         """ send a shell command and retreive its output.
 
         :param msg: the shell command
@@ -243,37 +549,136 @@ class ConnectionBase(gp.MonkObject):
 
         :param do_retcode: boolean which says whether or not a returncode
                            should be retreived.
+
+        :param cache: True marks the command as idempotent, so its result may
+                      be taken from and stored in :py:attr:`cache`; False
+                      never uses the cache; None (default) uses it if the
+                      command matches one of the ``cache_patterns``
+
+        :param compress: let the target compress the output with gzip and
+                         base64 before it is sent; useful for big outputs on
+                         slow links. If the target lacks the tools or an
+                         expect is given, the command runs uncompressed.
+                         If the compressed output can't be decoded, the
+                         command is sent once more without compression.
+
+        :param prompt_timeout: how long to wait for a prompt before the
+                               command is sent; ``first_prompt_timeout`` by
+                               default
         """
         self.log("START cmd({})".format(json.dumps({
             "msg" : msg,
             "expect" : str(expect),
             "timeout" : timeout or self.default_timeout,
             "do_retcode" : do_retcode,
+            "cache" : cache,
+            "compress" : compress,
+            "prompt_timeout" : prompt_timeout,
         }, indent=4)))
-        self.wait_for_prompt(self.first_prompt_timeout)
-        prepped_msg = self._prep_cmdmessage(msg, do_retcode)
-        self._sendline(prepped_msg)
+        if self.REBOOT_CMDS.match(msg):
+            self.log("command reboots the device, clear cache")
+            self.cache.clear()
+        cache_key = (msg, do_retcode) if self._is_cacheable(msg, expect, cache) else None
+        if cache_key:
+            result = self.cache.get(cache_key)
+            if result is not None:
+                self.log("cache hit")
+                self._count("cache_hits")
+                # nothing was sent, so there is no round trip to report
+                self.last_timing = collections.OrderedDict()
+                return result
+            self._count("cache_misses")
+        compress = compress and expect is None and self.can_compress()
+        # the path of a relative cd comes in the same round trip
+        sent_msg = msg + self.CWD_ECHO if self._is_relative_cd(msg) else msg
+        self._current_test = gp.find_testname()
+        timing = self.last_timing = collections.OrderedDict()
+        connect_before = self._connect_time
+        start = time.time()
+        self.wait_for_prompt(prompt_timeout or self.first_prompt_timeout)
+        prompted = time.time()
+        timing["connect"] = self._connect_time - connect_before
+        timing["prompt"] = prompted - start - timing["connect"]
+        if compress:
+            prepped_msg = self._prep_cmdcompressed(sent_msg, do_retcode)
+        else:
+            prepped_msg = self._prep_cmdmessage(sent_msg, do_retcode)
+        try:
+            self._sendline(prepped_msg)
+        except (pexpect.EOF, OSError) as e:
+            self._count("eofs")
+            self.close()
+            raise NotSentException("connection broke while sending '{}': {}".format(
+                msg, e)) from e
+        self._count("bytes_out", len(prepped_msg) + 1)
         try:
             self._expect(expect or self.prompt, timeout=timeout or self.default_timeout)
         except (pexpect.EOF, pexpect.TIMEOUT) as e:
             self.log("caught EOF/TIMEOUT on last expect; closing connections")
+            timing["remote"] = time.time() - prompted
+            self._record_timing(timing, start)
+            self._count("eofs" if isinstance(e, pexpect.EOF) else "timeouts")
             self.close()
             raise e
-        rc, out = self._prep_cmdoutput(
-                out=self.exp.before.decode(),
-                cmd_expect=prepped_msg,
-                do_retcode=do_retcode,
-        )
-        self.logger.info("SUCCESSFULLY SENT CMD: cmd('{}') rc='{}' result='{}' expect-match='{}'".format(
-            str(msg),
-            str(rc),
-            str(out),
-            str(self.exp.after).replace("b'","").replace("'",""),
-        ))
+        received = time.time()
+        timing["remote"] = received - prompted
+        self._count("bytes_in", len(self.exp.before or "") + (
+            len(self.exp.after) if isinstance(self.exp.after, (bytes, str)) else 0))
+        if compress:
+            try:
+                raw = self._decompress(self.exp.before)
+            except OutputParseException as e:
+                self._logger.warning("{}; run '{}' again uncompressed".format(e, msg))
+                self._count("compress_failures")
+                return self.cmd(msg, timeout=timeout, do_retcode=do_retcode,
+                        cache=cache, compress=False, prompt_timeout=prompt_timeout)
+        else:
+            raw = self.exp.before
+        cwd = None
+        if sent_msg is not msg:
+            raw, cwd = self._split_cwd(raw)
+        result = CmdResult(self, raw, prepped_msg, do_retcode, timing)
+        self._record_timing(timing, start)
+        self._count("cmds")
+        if self.recording:
+            self.recording.flush()
+        if self.logger.isEnabledFor(logging.INFO):
+            # only here the output needs to be parsed right away
+            self.logger.info("SUCCESSFULLY SENT CMD: cmd('{}') rc='{}' result='{}' expect-match='{}'".format(
+                str(msg),
+                str(result.rc),
+                str(result.out),
+                str(self.exp.after).replace("b'","").replace("'",""),
+            ))
         if self.exp.after in (pexpect.TIMEOUT, pexpect.EOF):
             self.log("connection is down, let's close it")
             self.close()
-        return rc, out
+        else:
+            if cache_key and result.rc in (0, None):
+                self.cache.put(cache_key, result)
+            if self.STATE_CMDS.match(msg) and result.rc in (0, None):
+                self._record_shell_state(msg.strip(), cwd)
+        return result
+
+    def _is_cacheable(self, msg, expect, cache):
+        """ decide whether a cmd() may use the cache
+        """
+        if cache is False or expect is not None:
+            return False
+        return bool(cache) or any(p.match(msg) for p in self.cache_patterns)
+
+    def _record_timing(self, timing, start):
+        """ finish the timing breakdown of a cmd() and add it to the metrics
+
+        The output is parsed later, see :py:class:`CmdResult`, so the "parse"
+        phase is added when that happens and is not part of the total.
+        """
+        timing["total"] = time.time() - start
+        for phase, duration in timing.items():
+            # connecting is already observed when it happens
+            if phase != "connect":
+                self._observe(phase, duration)
+        self.log("timing:{}".format(json.dumps(timing)))
 
     def _prep_cmdmessage(self, msg, do_retcode=True):
         """ prepares a command message before it is delivered to pexpect
@@ -301,6 +706,50 @@ class ConnectionBase(gp.MonkObject):
         ))
         return out
 
+    def can_compress(self):
+        """ find out once whether the target has gzip and base64
+        """
+        if self._can_compress is None:
+            rc, out = self.cmd("command -v gzip && command -v base64",
+                    cache=False, compress=False)
+            self._can_compress = rc == 0
+            self.log("target can compress: {}".format(self._can_compress))
+        return self._can_compress
+
+    def _prep_cmdcompressed(self, msg, do_retcode=True):
+        """ like :py:meth:`_prep_cmdmessage`, but the output including the
+            returncode is piped through gzip and base64.
+
+        The base64 lines follow a ``<gzip>`` marker, because with a command
+        of several lines the shell puts continuation prompts in front of
+        the first one.
+        """
+        get_retcode = '\necho "<retcode>$?</retcode>"' if do_retcode else ""
+        # newlines instead of ";" keep a command that ends with "&" valid;
+        # the quotes keep the echo of the command from matching the marker
+        prepped = '{{\n{}{}\n}} 2>&1 | {{ echo "<gz""ip>"; gzip -c | base64; }}'.format(
+                self._prep_cmdmessage(msg, do_retcode=False),
+                get_retcode,
+        )
+        self.log("prepped compressed:'{}'".format(prepped))
+        return prepped
+
+    def _decompress(self, received):
+        """ turn the base64 lines of a compressed cmd() back into its output
+        """
+        if isinstance(received, str):
+            received = received.encode("utf-8")
+        head, marker, received = received.rpartition(b"<gzip>")
+        if not marker:
+            raise OutputParseException("no compressed output found")
+        # anything else, like a prompt, is no base64
+        encoded = b"".join(line.strip() for line in received.splitlines()
+                if re.match(rb"^[A-Za-z0-9+/=]+\r?$", line.strip()))
+        try:
+            return zlib.decompress(base64.b64decode(encoded), 16 + zlib.MAX_WBITS)
+        except (binascii.Error, zlib.error) as e:
+            raise OutputParseException("failed to decompress output: {}".format(e))
+
     def _prep_cmdoutput(self, out, cmd_expect, do_retcode=True):
         """ prepare the pexpect output for returning to the user
 
@@ -330,7 +779,7 @@ class ConnectionBase(gp.MonkObject):
         prepped_out = str(capture)
         if do_retcode:
             try:
-                match = re.search("\n?<retcode>(\d+)</retcode>.*$", prepped_out)
+                match = self.RETCODE_LINE.search(prepped_out)
                 self.log("found retcode string '{}'".format(
                     match.group(0),
                 ))
@@ -401,10 +850,211 @@ class ConnectionBase(gp.MonkObject):
             "sleep" : str(sleep),
         }, indent=4))
 
+    def put_text(self, text, path, timeout=None, bwlimit=None):
+        """ write a text to a file on the target via a here-document
+
+        The lines are sent in batches of up to :py:attr:`chunk_size` bytes
+        and every batch waits until the shell acknowledged each of its lines
+        with its continuation prompt, so the target's input buffer can't
+        overrun. Afterwards the file size is checked.
+
+        Tabs might trigger a completion in shells with a line editor.
+
+        :param text: the content of the file
+        :param path: where the file is written on the target
+        :param timeout: how long to wait for each acknowledgement
+        :param bwlimit: the maximal bandwidth in Kbit/s; the batches are
+                        sent with pauses that keep the transfer below it
+        """
+        self.log("put_text({} bytes, {})".format(len(text), path))
+        timeout = timeout or self.default_timeout
+        lines = text.split("\n")
+        if text.endswith("\n"):
+            lines.pop()
+        delimiter = "MONK_EOF"
+        while delimiter in lines:
+            delimiter += "_"
+        self.wait_for_prompt(self.first_prompt_timeout)
+        try:
+            self._sendline("cat > {} <<'{}'".format(shlex.quote(path), delimiter))
+            self.exp.expect_exact(self.PS2, timeout=timeout)
+            batch = []
+            limit = self.chunk_size or (self.PACED_BATCH_SIZE if bwlimit else float("inf"))
+            start, sent = time.time(), 0
+            for line in lines:
+                if batch and len("\n".join(batch + [line])) >= limit:
+                    sent += self._put_batch(batch, timeout)
+                    self._pace(start, sent, bwlimit)
+                    batch = []
+                batch.append(line)
+            if batch:
+                sent += self._put_batch(batch, timeout)
+                self._pace(start, sent, bwlimit)
+            self._sendline(delimiter)
+            self._expect(self.prompt, timeout=timeout)
+            self._exp.after = b''
+        except (pexpect.EOF, pexpect.TIMEOUT) as e:
+            self.log("transfer broke off with {}, closing connection".format(
+                e.__class__.__name__))
+            self.close()
+            raise TransferFailedException("writing '{}' failed: {}".format(
+                path, str(e).split("\n")[0]))
+        size = len(("\n".join(lines) + "\n").encode("utf-8")) if lines else 0
+        rc, out = self.cmd("wc -c < {}".format(shlex.quote(path)), cache=False)
+        if rc != 0 or out.strip() != str(size):
+            raise TransferFailedException("'{}' has '{}' bytes instead of {}".format(
+                path, out.strip(), size))
+
+    def put_file(self, src_path, trgt_path, timeout=None, bwlimit=None):
+        """ copy a local file to the target through the shell session
+
+        The file is sent base64 encoded with :py:meth:`put_text`, so this
+        works with every connection, but it is slow. The target needs the
+        ``base64`` tool.
+
+        :param src_path: the path to the file on the host machine
+        :param trgt_path: the path of the file on the target machine
+        :param timeout: how long to wait for each acknowledgement
+        :param bwlimit: the maximal bandwidth in Kbit/s, see :py:meth:`put_text`
+        """
+        self.log("put_file({},{})".format(src_path, trgt_path))
+        with open(src_path, "rb") as f:
+            text = base64.encodebytes(f.read()).decode("ascii")
+        encoded = trgt_path + ".b64"
+        self.put_text(text, encoded, timeout=timeout, bwlimit=bwlimit)
+        rc, out = self.cmd("base64 -d < {0} > {1}; rc=$?; rm -f {0}; (exit $rc)".format(
+            shlex.quote(encoded), shlex.quote(trgt_path)), cache=False)
+        if rc != 0:
+            raise TransferFailedException("decoding '{}' failed: {}".format(
+                trgt_path, out))
+
+    def _put_batch(self, lines, timeout):
+        """ send some lines of a here-document and wait for their
+            acknowledgements
+        """
+        data = "\n".join(lines) + "\n"
+        self._send_chunked(data)
+        self._count("bytes_out", len(data))
+        self.exp.expect_exact(self.PS2 * len(lines), timeout=timeout)
+        return len(data)
+
+    def _pace(self, start, sent, bwlimit):
+        """ wait until sending ``sent`` bytes since ``start`` is within
+            ``bwlimit`` Kbit/s
+        """
+        if not bwlimit or self._replay:
+            return
+        ahead = sent * 8 / (float(bwlimit) * 1000) - (time.time() - start)
+        if ahead > 0:
+            time.sleep(ahead)
+
+    def cmd_script(self, script, args="", path=None, keep=False, timeout=None,
+            do_retcode=True):
+        """ upload a shell script with :py:meth:`put_text` and execute it
+
+        The script runs with the interpreter from its ``#!`` line, or with
+        ``sh`` if it has none. It isn't executed by its path, because
+        ``/tmp`` is often mounted ``noexec`` on target devices.
+
+        :param script: the content of the script
+        :param args: arguments for the script, already quoted for the shell
+        :param path: where to put the script; by default a name in /tmp
+                     derived from its content
+        :param keep: whether the script stays on the target afterwards
+        :param timeout: how long the script may run
+
+        :return: the same as :py:meth:`cmd`
+        """
+        path = path or "/tmp/monk-{}.sh".format(
+                hashlib.sha1(script.encode("utf-8")).hexdigest()[:12])
+        self.log("cmd_script({},{})".format(path, args))
+        self.put_text(script, path)
+        msg = "{} {} {}".format(self._interpreter(script), shlex.quote(path),
+                args).strip()
+        if not keep:
+            # keep the script's returncode for the retcode echo
+            msg += "; rc=$?; rm -f {}; (exit $rc)".format(shlex.quote(path))
+        return self.cmd(msg, timeout=timeout, do_retcode=do_retcode, cache=False)
+
+    def run_script(self, script, args="", timeout=None, do_retcode=True):
+        """ execute a script that is cached on the target
+
+        The script is stored under its hash in :py:attr:`SCRIPT_CACHE_DIR`.
+        Usually only a short command line is sent that runs it from there;
+        the script itself is uploaded only if it isn't on the target yet,
+        e.g. after a reboot. A missing script is reported by the exit status
+        :py:attr:`SCRIPT_CACHE_MISS_RC`; if the script itself exits with
+        it, or ``do_retcode`` is False, a ``test -f`` decides. Like in
+        :py:meth:`cmd_script` the ``#!`` line chooses the interpreter.
+
+        :param script: the content of the script
+        :param args: a string that is already quoted for the shell or a list
+                     of arguments
+        :param timeout: how long the script may run
+
+        :return: the same as :py:meth:`cmd`
+        """
+        if not isinstance(args, str):
+            args = " ".join(shlex.quote(str(a)) for a in args)
+        path = "{}/{}".format(self.SCRIPT_CACHE_DIR,
+                hashlib.sha1(script.encode("utf-8")).hexdigest())
+        self.log("run_script({},{})".format(path, args))
+        msg = "if [ -f {0} ]; then {3} {0} {1}; else (exit {2}); fi".format(
+                path, args, self.SCRIPT_CACHE_MISS_RC, self._interpreter(script))
+        result = self.cmd(msg, timeout=timeout, do_retcode=do_retcode, cache=False)
+        missing = result.rc in (self.SCRIPT_CACHE_MISS_RC, None)
+        if not missing or self.cmd("test -f {}".format(path), cache=False).rc == 0:
+            self._count("script_cache_hits")
+            return result
+        self.log("script not on target yet, upload it")
+        self._count("script_cache_misses")
+        self.cmd("mkdir -p {}".format(self.SCRIPT_CACHE_DIR), cache=False)
+        # a broken upload must not end up in the cache
+        self.put_text(script, path + ".part")
+        self.cmd("mv {0}.part {0}".format(path), cache=False)
+        return self.cmd(msg, timeout=timeout, do_retcode=do_retcode, cache=False)
+
+    def _interpreter(self, script):
+        """ :return: the command line of the script's ``#!`` line or ``sh``
+        """
+        first = script.split("\n", 1)[0]
+        if first.startswith("#!") and first[2:].strip():
+            return first[2:].strip()
+        return "sh"
+
+    def clone(self, name=None):
+        """ create another connection with the same configuration
+
+        The clone opens its own session when it is used first. It has its
+        own cache, but adds to the same :py:attr:`metrics`.
+
+        :param name: the name of the clone
+        """
+        self.log("clone({})".format(name))
+        if self._replay:
+            raise CantCloneException("a replay has only the recorded sessions")
+        new = copy.copy(self)
+        # the sessions of a clone are not part of the recording
+        new.recording = None
+        new.__dict__.pop("_exp", None)
+        new.name = name
+        new.cache = CmdCache(size=self.cache.size, ttl=self.cache.ttl)
+        new.last_timing = {}
+        new.shell_state = collections.OrderedDict()
+        new._patterns = {}
+        new._connected_before = False
+        new._connect_time = 0.0
+        new._can_compress = None
+        return new
+
     def close(self):
         """ close the connection and get rid of the inner objects
         """
         self.log("close connection")
+        self.cache.clear()
+        self._can_compress = None
+        if self.recording:
+            self.recording.flush()
         try:
             if hasattr(self, "_exp") and self._exp:
                 self._exp.close()
@@ -415,24 +1065,31 @@ class ConnectionBase(gp.MonkObject):
             pass
 
     def __del__(self):
-        """ will make sure to close and log it's destruction
+        """ will make sure the session is closed
         """
-        self.log("getting deleted")
-        try:
+        # most connections are closed already or were never used
+        if getattr(self, "_exp", None) is not None:
             self.close()
-        finally:
-            self.log("bye.")
+        if getattr(self, "recording", None):
+            self.recording.close()
 
 
 class SerialConn(ConnectionBase):
     """ implements a serial connection.
     """
 
+    # the pause after a chunk, in multiples of the time the chunk needs on
+    # the line; leaves the target time to empty its UART buffer
+    CHUNK_DELAY_MARGIN = 2
+
     def __init__(self, name, port, user, pw,
             prompt="\r?\n?[^\n]*#",
             default_timeout=None,
             first_prompt_timeout=None,
             speed=115200,
+            chunk_size=None,
+            chunk_delay=None,
+            **kwargs
         ):
         """
         :param name: the name of the connection
@@ -440,6 +1097,15 @@ class SerialConn(ConnectionBase):
         :param user: the user name for the login
         :param pw: the password for the login
         :param prompt: the default prompt to check for
+        :param speed: the baud rate of the line
+        :param chunk_size: long lines are sent in pieces of this many bytes,
+                           e.g. 64 for a target that loses input; by default
+                           lines are sent at once
+        :param chunk_delay: the pause after each piece; by default
+                            :py:attr:`CHUNK_DELAY_MARGIN` times the time a
+                            piece needs on the line
+
+        Further keyword arguments are handed to :py:class:`ConnectionBase`.
         """
         self.speed = speed
         super(SerialConn, self).__init__(
@@ -449,6 +1115,10 @@ class SerialConn(ConnectionBase):
                 pw = pw,
                 default_timeout=default_timeout,
                 first_prompt_timeout=first_prompt_timeout,
+                chunk_size=chunk_size,
+                chunk_delay=chunk_delay if chunk_delay is not None
+                    else self.CHUNK_DELAY_MARGIN * 10.0 * int(chunk_size or 0) / int(speed),
+                **kwargs
         )
         self.speed = speed
         self._prompt = prompt
@@ -458,6 +1128,11 @@ class SerialConn(ConnectionBase):
         self.log("I got called correctly")
         return self._prompt
 
+    @prompt.setter
+    def prompt(self, new):
+        self._prompt = new
+        self._patterns.clear()
+
     @property
     def port(self):
         return self.target
@@ -468,16 +1143,20 @@ class SerialConn(ConnectionBase):
 
     def _get_exp(self):
         self.log("create fdspawn object")
-        end_time = time.time() + self.first_prompt_timeout
+        end_time = self._connect_end()
+        attempt = 0
         while time.time() < end_time:
             self.log("try creating fdspawn object")
             try:
                 spawn = fdpexpect.fdspawn(os.open(self.port, os.O_RDWR|os.O_NONBLOCK|os.O_NOCTTY))
                 self.log("sendline")
-                spawn.sendline()
+                # pexpect's default of 30s per expect may be too long
+                timeout = max(min(30, end_time - time.time()), 1)
+                spawn.sendline("")
                 #PWR: self.log("expect prompt or login string")
                 self.log("expect prompt '{}' or login string".format(self.prompt))
-                result = spawn.expect(["(?i)"+self.prompt, "(?i)login: ", "(?i)User:"])
+                result = spawn.expect_list(self.compile_patterns(
+                    ["(?i)"+self.prompt, "(?i)login: ", "(?i)User:"]), timeout=timeout)
                 self.log("got ({}) with capture: '{}'".format(
                     result,
                     str(spawn.after),
@@ -488,36 +1167,27 @@ class SerialConn(ConnectionBase):
                     self.log("because not logged in yet, do that")
                     spawn.sendline(self.user)
                     self.log("expect password")
-                    spawn.expect(["(?i)password: ", "Password:"])
+                    spawn.expect_list(self.compile_patterns(
+                        ["(?i)password: ", "Password:"]), timeout=timeout)
                     self.log("send pw")
                     spawn.sendline(self.pw)
                     self.log("expect prompt")
-                    spawn.expect("(?i)"+self.prompt)
+                    spawn.expect_list(self.compile_patterns("(?i)"+self.prompt),
+                            timeout=timeout)
                 return spawn
             except (pexpect.EOF, pexpect.TIMEOUT) as e:
                 self.log("wait a little before retry creating pxssh object")
-                time.sleep(3)
+                self._count("connect_retries")
+                self._retry_sleep(attempt, end_time)
+                attempt += 1
         raise CantCreateConnException("tried to reach {} for '{}' seconds".format(
             self.target, self.first_prompt_timeout))
 
     def _login(self, user=None, pw=None):
         self.logger.debug("serial._login({},{})".format(user, pw))
 
-class pxsshWorkaround(pxssh.pxssh):
-    """ just to add that echo=False """
-
-    def __init__(self, timeout=30, maxread=2000,
-        searchwindowsize=None,logfile=None, cwd=None, env=None, echo=True):
-        spawn.__init__(self, None, timeout=timeout, maxread=maxread,
-                searchwindowsize=searchwindowsize, logfile=logfile, cwd=cwd,
-                env=env, echo=echo)
-        self.name = '<pxssh>'
-        self.UNIQUE_PROMPT = "\[PEXPECT\][\$\#] "
-        self.PROMPT = self.UNIQUE_PROMPT
-        self.PROMPT_SET_SH = "PS1='[PEXPECT]\$ '"
-        self.PROMPT_SET_CSH = "set prompt='[PEXPECT]\$ '"
-        self.SSH_OPTS = ("-o'RSAAuthentication=no'"
-                + " -o 'PubkeyAuthentication=no'")
+    def clone(self, name=None):
+        raise CantCloneException("a serial line has only one session")
 
 class SshConn(ConnectionBase):
     """ implements an ssh connection.
@@ -529,12 +1199,15 @@ class SshConn(ConnectionBase):
             force_password=True,
             first_prompt_timeout=None,
             login_timeout=10,
+            **kwargs
         ):
         """
         :param host: the URL to the device
         :param user: the user name for the login
         :param pw: the password for the login
         :param prompt: the default prompt to check for
+
+        Further keyword arguments are handed to :py:class:`ConnectionBase`.
         """
         super(SshConn, self).__init__(
                 name=name,
@@ -543,6 +1216,7 @@ class SshConn(ConnectionBase):
                 pw=pw,
                 default_timeout=default_timeout,
                 first_prompt_timeout=first_prompt_timeout,
+                **kwargs
         )
         self.force_password = force_password
         self.login_timeout = int(login_timeout)
@@ -562,18 +1236,20 @@ class SshConn(ConnectionBase):
         self.log("retreive ssh PROMPT")
         return self.exp.PROMPT
 
-    def cp(self, src_path, trgt_path, retry=5, sleep=5, timeout=10):
+    def cp(self, src_path, trgt_path, retry=5, sleep=5, timeout=10, bwlimit=None):
         """ send files via scp to target device
 
         :param src_path: the path to the file on the host machine
         :param trgt_path: the path of the file on the target machine
+        :param bwlimit: the maximal bandwidth in Kbit/s
         """
         self.log("send file from {} to {} on the target device".format(
             src_path,
             trgt_path,
         ))
         for i in range(1, retry+1):
-            spawn = pexpect.spawnu("scp {} {}@{}:{}".format(
+            spawn = pexpect.spawnu("scp {}{} {}@{}:{}".format(
+                "-l {} ".format(int(bwlimit)) if bwlimit else "",
                 src_path,
                 self.user,
                 self.target,
@@ -593,14 +1269,17 @@ class SshConn(ConnectionBase):
                     spawn.status,
                     i,
                 ))
+        raise TransferFailedException("scp of '{}' failed {} times".format(
+            src_path, retry))
 
     def _get_exp(self):
         self.log("create pxssh object")
-        end_time = time.time() + self.first_prompt_timeout
+        end_time = self._connect_end()
+        attempt = 0
         while time.time() < end_time:
             self.log("try creating pxssh object")
             try:
-                s = pxsshWorkaround(echo=False)
+                s = msp.pxsshWorkaround(echo=False)
                 s.force_password = self.force_password
                 s.login(
                     server=self.host,
@@ -611,7 +1290,9 @@ class SshConn(ConnectionBase):
                 return s
             except (pxssh.ExceptionPxssh, pexpect.EOF, pexpect.TIMEOUT) as e:
                 self.log("wait a little before retry creating pxssh object")
-                time.sleep(3)
+                self._count("connect_retries")
+                self._retry_sleep(attempt, end_time)
+                attempt += 1
         raise CantCreateConnException("tried to reach {} for '{}' seconds".format(
             self.target, self.first_prompt_timeout))
 
@@ -631,6 +1312,156 @@ class SshConn(ConnectionBase):
             del self._exp
         super(SshConn, self).close()
 
+class CmdResult(object):
+    """ the result of :py:meth:`ConnectionBase.cmd`
+
+    It behaves like the tuple ``(returncode, output)``, so
+    ``rc, out = conn.cmd(...)`` still works. Internally it only keeps the
+    received bytes. The returncode is searched directly in these bytes, while
+    decoding and cleaning up the output with :py:mod:`pyte` only happens when
+    the output is accessed the first time. Callers that only check the
+    returncode don't pay for the output processing.
+
+    Binary output can be read with :py:attr:`raw`; only :py:attr:`out` fails
+    with :py:exc:`OutputParseException` on bytes that are no utf-8.
+    """
+
+    __slots__ = ("raw", "_conn", "_cmd_expect", "_do_retcode", "_timing",
+            "_rc", "_out")
+
+    _UNSET = object()
+    _RETCODE = re.compile(rb"<retcode>(\d+)</retcode>[^\n]*$")
+
+    def __init__(self, conn, raw, cmd_expect=None, do_retcode=True, timing=None):
+        """
+        :param conn: the connection that parses the output
+        :param raw: the received output, usually pexpect's before
+        :param cmd_expect: the command that was sent
+        :param do_retcode: if there's a retcode to find or not
+        :param timing: the timing breakdown to add the parse duration to
+        """
+        self.raw = raw.encode("utf-8") if isinstance(raw, str) else (raw or b"")
+        self._conn = conn
+        self._cmd_expect = cmd_expect
+        self._do_retcode = do_retcode
+        self._timing = timing
+        self._rc = self._UNSET
+        self._out = self._UNSET
+
+    @property
+    def rc(self):
+        """ the returncode, or None if none was requested
+        """
+        if self._rc is self._UNSET:
+            if not self._do_retcode or not self.raw:
+                self._rc = None
+            else:
+                match = self._RETCODE.search(self.raw)
+                if not match:
+                    # let the full parser raise with a helpful message
+                    self._parse()
+                else:
+                    self._rc = int(match.group(1))
+        return self._rc
+
+    @property
+    def out(self):
+        """ the decoded and cleaned up output without the returncode
+        """
+        if self._out is self._UNSET:
+            self._parse()
+        return self._out
+
+    @property
+    def lines(self):
+        return self.out.splitlines()
+
+    def _parse(self):
+        start = time.time()
+        try:
+            decoded = self.raw.decode("utf-8")
+        except UnicodeError as e:
+            raise OutputParseException(
+                "failed to parse output to utf8, use raw for binary output. Error: " + str(e))
+        rc, self._out = self._conn._prep_cmdoutput(
+                out=decoded,
+                cmd_expect=self._cmd_expect,
+                do_retcode=self._do_retcode,
+        )
+        if self._rc is self._UNSET:
+            self._rc = rc
+        duration = time.time() - start
+        if self._timing is not None:
+            self._timing["parse"] = duration
+        self._conn._observe("parse", duration)
+
+    def __iter__(self):
+        yield self.rc
+        yield self.out
+
+    def __len__(self):
+        return 2
+
+    def __getitem__(self, index):
+        if index in (0, -2):
+            return self.rc
+        if index in (1, -1):
+            return self.out
+        return tuple(self)[index]
+
+    def __eq__(self, other):
+        try:
+            return tuple(self) == tuple(other)
+        except TypeError:
+            return NotImplemented
+
+    def __ne__(self, other):
+        result = self.__eq__(other)
+        return result if result is NotImplemented else not result
+
+    __hash__ = None
+
+    def __repr__(self):
+        return repr(tuple(self))
+
+class CmdCache(object):
+    """ a helper class
+
+    that stores the results of idempotent commands for
+    :py:class:`ConnectionBase`. The oldest entries are dropped when the cache
+    is full (LRU), each entry expires after ``ttl`` seconds.
+    """
+
+    def __init__(self, size=64, ttl=300):
+        self.size = size
+        self.ttl = ttl
+        self._data = collections.OrderedDict()
+
+    def get(self, key):
+        """ :return: the cached value or None if there is none
+        """
+        try:
+            expires, value = self._data[key]
+        except KeyError:
+            return None
+        if expires < time.time():
+            del self._data[key]
+            return None
+        self._data.move_to_end(key)
+        return value
+
+    def put(self, key, value):
+        self._data[key] = (time.time() + self.ttl, value)
+        self._data.move_to_end(key)
+        while len(self._data) > self.size:
+            self._data.popitem(last=False)
+
+    def clear(self):
+        self._data.clear()
+
+    def __len__(self):
+        return len(self._data)
+
 class Capture(object):
     """ a helper class
 
@@ -653,3 +1484,131 @@ class Capture(object):
     def __str__(self):
         self.handle.seek(0)
         return self.handle.read()
+
+#################
+#
+# Record & Replay
+#
+#################
+
+class Recording(object):
+    """ writes everything a connection sends and receives to a file
+
+    The file has one JSON list per line. The first line describes the
+    connection, every further line is an event ``[seconds, kind, data]``
+    where kind is "c" for a new session, "o" for sent and "i" for received
+    data. Files ending with ``.gz`` are compressed.
+    """
+
+    def __init__(self, path, conn):
+        self.path = path
+        opener = gzip.open if path.endswith(".gz") else open
+        self._file = opener(path, "wt", encoding="utf-8")
+        self._start = time.time()
+        self._lock = threading.Lock()
+        self._write([1, conn.__class__.__name__, str(conn.name)])
+        atexit.register(self.close)
+
+    def new_session(self, spawn):
+        """ mark a new session and attach to its pexpect object
+        """
+        # pxssh has its own prompt, the replay needs to know it
+        self.event("c", getattr(spawn, "PROMPT", ""))
+        spawn.logfile_send = _RecordingLog(self, "o")
+        spawn.logfile_read = _RecordingLog(self, "i")
+
+    def event(self, kind, data):
+        if isinstance(data, bytes):
+            # latin-1 turns every byte into exactly one character
+            data = data.decode("latin-1")
+        self._write([round(time.time() - self._start, 4), kind, data])
+
+    def _write(self, row):
+        with self._lock:
+            if not self._file.closed:
+                self._file.write(json.dumps(row) + "\n")
+
+    def flush(self):
+        with self._lock:
+            if not self._file.closed:
+                self._file.flush()
+
+    def close(self):
+        """ finish the file; a connection records until it is deleted
+        """
+        with self._lock:
+            self._file.close()
+
+class _RecordingLog(object):
+    """ the file like object pexpect writes its logs to
+    """
+
+    def __init__(self, recording, kind):
+        self.recording = recording
+        self.kind = kind
+
+    def write(self, data):
+        self.recording.event(self.kind, data)
+
+    def flush(self):
+        pass
+
+class Replay(object):
+    """ reads a file written by :py:class:`Recording`
+    """
+
+    def __init__(self, path, speed=0):
+        """
+        :param path: the recorded file
+        :param speed: 1 replays with the recorded timing, 2 twice as fast
+                      and so on; 0 doesn't wait at all
+        """
+        self.path = path
+        self.speed = float(speed)
+        opener = gzip.open if path.endswith(".gz") else open
+        rows = []
+        with opener(path, "rt", encoding="utf-8") as f:
+            try:
+                for line in f:
+                    if line.strip():
+                        rows.append(json.loads(line))
+            except EOFError:
+                # a compressed recording that was never closed
+                pass
+        self.header = rows[0]
+        self.events = [(t, kind, data.encode("latin-1")) for t, kind, data in rows[1:]]
+        self.pos = 0
+
+    def next_session(self):
+        """ go to the start of the next recorded session
+
+        :return: the prompt of the session if the recorded connection had its
+                 own one
+        """
+        while self.pos < len(self.events):
+            t, kind, data = self.events[self.pos]
+            self.pos += 1
+            if kind == "c":
+                self._last_time = t
+                return data.decode("latin-1")
+        raise pexpect.EOF("no more sessions in '{}'".format(self.path))
+
+    def peek(self):
+        """ :return: the next event of the current session or None
+        """
+        if self.pos < len(self.events) and self.events[self.pos][1] != "c":
+            return self.events[self.pos]
+        return None
+
+    def pop(self):
+        event = self.events[self.pos]
+        self.pos += 1
+        # only the device's answers take time, our own code takes its time anyway
+        if self.speed and event[1] == "i":
+            time.sleep(max(event[0] - self._last_time, 0) / self.speed)
+        self._last_time = event[0]
+        return event
+
+    def skip_session(self):
+        while self.peek():
+            self.pos += 1
@@ -25,24 +25,37 @@ Example:
     import monk_tf.conn as mc
     # create a device with a ssh connection and a serial connection
     d=md.Device(
-        mc.SshConn('192.168.2.100', 'tester', 'secret'),
-        mc.SerialConn('/dev/ttyUSB2', 'root', 'muchmoresecret'),
+        conns={
+            "ssh1" : mc.SshConn('ssh1', '192.168.2.100', 'tester', 'secret'),
+            "serial1" : mc.SerialConn('serial1', '/dev/ttyUSB2', 'root', 'muchmoresecret'),
+        },
+        use_conns=["ssh1", "serial1"],
     )
     # send a command (the same way as with connections)
     return_code, output = d.cmd('ls -al')
-    print output
+    print(output)
     [...]
 """
 
+import os
+import re
 import logging
 import time
 import json
-
-import pexpect
+import queue
+import shlex
+import hashlib
+import tempfile
+import threading
+import contextlib
+import collections
 
 import monk_tf.general_purpose as gp
 import monk_tf.conn
 import monk_tf.conn as mc
+import monk_tf.metrics as mm
+
+pexpect = gp.lazy_import("pexpect")
 
 logger = logging.getLogger(__name__)
 
@@ -57,6 +70,11 @@ class ADeviceException(gp.MonkException):
     """
     pass
 
+class CantHandleException(ADeviceException):
+    """ is raised when no connection of a device could handle a command.
+    """
+    pass
+
 class UpdateFailedException(ADeviceException):
     """ is raised if an update didn't get finished or was rolled back.
     """
@@ -67,6 +85,26 @@ class WrongNameException(ADeviceException):
     """
     pass
 
+class RebootFailedException(ADeviceException):
+    """ is raised when a device didn't come back after a reboot in time.
+    """
+    pass
+
+class UnknownPolicyException(ADeviceException):
+    """ is raised when a device is configured with an unknown conn_policy.
+    """
+    pass
+
+class TailTimeoutException(ADeviceException):
+    """ is raised when an expected log line didn't show up in time.
+    """
+    pass
+
+class ConnBusyException(ADeviceException):
+    """ is raised when a connection is needed that follows a log file.
+    """
+    pass
+
 
 ##############################
 #
@@ -78,13 +116,49 @@ class Device(gp.MonkObject):
     """ is the API abstraction of a :term:`target device`.
     """
 
+    # how cmd() picks a connection, see __init__
+    CONN_POLICIES = ("pin", "failover", "prefer")
+
+    # errors after which cmd() tries the next connection; they all happen
+    # before the command is sent, a command must never run twice
+    FAILOVER_ERRORS = (
+        mc.CantCreateConnException,
+        mc.TimeoutException,
+        mc.NotSentException,
+    )
+
     def __init__(self, *args, **kwargs):
         """
-        :param conns: list of connections. The following works as well::
+        :param conns: dict of name:connection
 
-            ``Device(OneConnection(...), AnotherConnection(...),...)``
+        :param use_conns: the names of the connections cmd() uses
 
         :param name: Device name for logging purposes.
+
+        :param conn_policy: how :py:meth:`cmd` chooses its connection.
+                            "pin" always uses the first connection in
+                            ``use_conns``. "failover" (default) uses the
+                            first healthy one and switches to the next if a
+                            connection fails before the command is sent; a
+                            command that was sent is never repeated.
+                            "prefer" works like "failover",
+                            but takes the healthy connection with the lowest
+                            measured latency.
+
+        :param conn_cooldown: seconds a failed connection counts as unhealthy
+
+        :param probe_timeout: with "failover" or "prefer", how many seconds a
+                              connection may take to show a prompt before
+                              the next one is tried; the last connection
+                              gets its whole ``first_prompt_timeout``
+
+        :param pool_size: how many sessions of the pooled connection may run
+                          commands at the same time, see :py:meth:`lease`
+
+        :param pool_conn: the name of the pooled connection, by default the
+                          first one in ``use_conns``; it must be able to
+                          :py:meth:`~monk_tf.conn.ConnectionBase.clone`
+                          itself, e.g. an ssh connection
         """
         super(Device, self).__init__(
                 name=kwargs.pop("name",None),
@@ -94,14 +168,74 @@ class Device(gp.MonkObject):
         self.use_conns = [use_conns] if isinstance(use_conns, str) else [cname.strip() for cname in use_conns if cname]
         self.conns = kwargs.pop("conns", {})
         self.fallback_conn = kwargs.pop("fallback_conn", self.conns["serial1"] if "serial1" in self.conns else None)
+        if isinstance(self.fallback_conn, str):
+            # from a fixture file we only get the name
+            self.fallback_conn = self.conns[self.fallback_conn]
+        self.conn_policy = kwargs.pop("conn_policy", "failover")
+        if self.conn_policy not in self.CONN_POLICIES:
+            raise UnknownPolicyException("'{}' is none of {}".format(
+                self.conn_policy, self.CONN_POLICIES))
+        self.conn_cooldown = float(kwargs.pop("conn_cooldown", 30))
+        self.probe_timeout = float(kwargs.pop("probe_timeout", 10))
+        self.health = {}
+        self.pool_size = int(kwargs.pop("pool_size", 1))
+        self.pool_conn = kwargs.pop("pool_conn", None)
+        # the most recently used session is the one that is most likely alive
+        self._pool = queue.LifoQueue()
+        self._pool_members = []
+        self._pool_lock = threading.Lock()
+        self._conn_locks = {}
+        # the leases of each thread, name:connection
+        self._held = threading.local()
         self.prompt = PromptReplacement()
+        self._facts = None
+        self._tails = []
+        # connections that a tail uses, because they can't be cloned
+        self._tailing = set()
 
     @property
     def firstconn(self):
         return self.conns.get(self.use_conns[0])
 
+    @property
+    def metrics(self):
+        """ the combined :py:class:`~monk_tf.metrics.Metrics` of all connections
+
+        Query a single connection with ``dev.conns[name].metrics``.
+        """
+        return mm.Metrics.combine(c.metrics for c in self.conns.values())
+
+    @property
+    def facts(self):
+        """ the inventory of the :term:`target device`
+
+        Collected with a single command on first access and kept until the
+        device reboots or :py:meth:`refresh_facts` is called. See
+        :py:data:`FACTS` for the available keys. Example::
+
+            if dev.facts["mem_total"] < 512 * 1024**2:
+                raise nose.SkipTest("not enough memory")
+        """
+        if self._facts is None:
+            self.refresh_facts()
+        return self._facts
+
+    def refresh_facts(self):
+        """ collect :py:attr:`facts` again
+
+        :return: the new facts
+        """
+        self.log("refresh_facts()")
+        # one line, because a shell shows a prompt after each line
+        script = "; ".join('echo "<fact:{0}>"; {1} 2>/dev/null; echo "</fact:{0}>"'.format(
+            name, shell) for name, shell, _ in FACTS)
+        rc, out = self.cmd(script, do_retcode=False)
+        self._facts = parse_facts(out)
+        return self._facts
+
     def cmd(self, msg, expect=None, timeout=30, login_timeout=None,
-            do_retcode=True, fallback_conn=None, conn=None):
+            do_retcode=True, fallback_conn=None, conn=None, cache=None,
+            compress=False):
         """ Send a :term:`shell command` to the :term:`target device`.
 
         :param msg: the :term:`shell command`.
@@ -115,19 +249,69 @@ class Device(gp.MonkObject):
 
         :param do_retcode: should this command retreive a returncode
 
-        :param fallback_conn: use this connection to reboot 
-                     command.
+        :param fallback_conn: the connection that is tried last if all
+                              others failed; the device's
+                              :py:attr:`fallback_conn` by default
+
+        :param conn: the connection or the name of the connection that
+                     should be used for this command; this disables the
+                     failover. Otherwise the connection is chosen by the
+                     ``conn_policy``, see :py:meth:`__init__`.
+
+        :param cache: mark the command as idempotent (True) to get its result
+                      from the connection's cache, see
+                      :py:meth:`~monk_tf.conn.ConnectionBase.cmd`
 
-        :param conn: the name of the connection that should be used for this
-                     command.
+        :param compress: let the target compress the output for the transfer,
+                         see :py:meth:`~monk_tf.conn.ConnectionBase.cmd`
 
         :return: :term:`returncode`, :term:`standard output` of the shell command
         """
         self.log("cmd({},{},{},{},{})".format(
             msg, expect, timeout, login_timeout, do_retcode))
+        if mc.ConnectionBase.REBOOT_CMDS.match(msg):
+            self.log("command reboots the device, forget facts")
+            self._facts = None
         if not self.conns:
             self._logger.warning("device has no connections to use for interaction")
-        connection = conn or self.firstconn
+        kwargs = {
+            "expect" : expect,
+            "timeout" : timeout,
+            "do_retcode" : do_retcode,
+            "cache" : cache,
+            "compress" : compress,
+        }
+        if conn is not None and not isinstance(conn, str):
+            return self._cmd_via(conn, msg, **kwargs)
+        if conn is not None or self.conn_policy == "pin":
+            with self.lease(conn) as connection:
+                return self._cmd_via(connection, msg, **kwargs)
+        last_error = None
+        order = self._conn_order(fallback_conn or self.fallback_conn)
+        for i, name in enumerate(order):
+            # don't wait long for a dead connection while others are left
+            probe = self.probe_timeout if i < len(order) - 1 else None
+            try:
+                with self.lease(name) as connection:
+                    result = self._cmd_via(connection, msg,
+                            prompt_timeout=probe, **kwargs)
+                    # another thread may use the connection after the lease
+                    timing = dict(connection.last_timing or {})
+            except self.FAILOVER_ERRORS as e:
+                self._logger.warning("connection '{}' failed with {}, try next".format(
+                    name, e.__class__.__name__))
+                self.conn_health(name).failed(self.conn_cooldown)
+                self.conns[name]._count("failovers")
+                last_error = e
+                continue
+            if "prompt" in timing:
+                # the time until the prompt came back is the pure round trip
+                self.conn_health(name).succeeded(timing["prompt"])
+            return result
+        raise CantHandleException("no connection of {} could handle '{}'".format(
+            self.name, msg)) from last_error
+
+    def _cmd_via(self, connection, msg, expect, **kwargs):
         self.log("send cmd '{}' via connection '{}'".format(
             msg,
             connection,
@@ -135,10 +319,165 @@ class Device(gp.MonkObject):
         return connection.cmd(
                 msg=msg,
                 expect=PromptReplacement.replace(connection, expect),
-                timeout=timeout,
-                do_retcode=do_retcode,
+                **kwargs
         )
 
+    @contextlib.contextmanager
+    def lease(self, name=None):
+        """ use a connection exclusively, e.g. for several commands that
+            depend on each other. :py:meth:`cmd` leases a connection for each
+            command, so it can be called from several threads. Example::
+
+                with dev.lease() as c:
+                    c.cmd("cd /tmp")
+                    c.cmd("ls")
+
+        For the pooled connection (see ``pool_size``) another session is
+        opened if all are busy and the pool isn't full yet. Otherwise the
+        caller waits until a session or the connection is free again. A
+        thread that already leases the connection gets the same session
+        again, so :py:meth:`cmd` works inside of a lease.
+
+        :param name: the name of the connection; the first one by default
+        """
+        name = name or self.use_conns[0]
+        if name not in self.conns:
+            raise WrongNameException("{} has no connection '{}'".format(
+                self.name, name))
+        if name in self._tailing:
+            raise ConnBusyException("'{}' follows a log, see tail()".format(name))
+        held = self._held.__dict__
+        if name in held:
+            yield held[name]
+            return
+        with self._lease(name) as connection:
+            held[name] = connection
+            try:
+                yield connection
+            finally:
+                del held[name]
+
+    @contextlib.contextmanager
+    def _lease(self, name):
+        if self.pool_size > 1 and name == (self.pool_conn or self.use_conns[0]):
+            connection = self._lease_from_pool(name)
+            try:
+                yield connection
+            finally:
+                self._pool.put(connection)
+        else:
+            with self._pool_lock:
+                lock = self._conn_locks.setdefault(name, threading.Lock())
+            with lock:
+                yield self.conns[name]
+
+    def _lease_from_pool(self, name):
+        try:
+            return self._pool.get_nowait()
+        except queue.Empty:
+            pass
+        with self._pool_lock:
+            if len(self._pool_members) < self.pool_size:
+                if self._pool_members:
+                    connection = self.conns[name].clone("{}-{}".format(
+                        name, len(self._pool_members) + 1))
+                else:
+                    connection = self.conns[name]
+                self._pool_members.append(connection)
+                self.log("pool has {} sessions now".format(len(self._pool_members)))
+                return connection
+        return self._pool.get()
+
+    def conn_health(self, name):
+        """ :return: the :py:class:`ConnHealth` of a connection
+        """
+        if name not in self.health:
+            self.health[name] = ConnHealth()
+        return self.health[name]
+
+    def _conn_order(self, fallback_conn=None):
+        """ the names of the connections in the order cmd() tries them
+        """
+        names = [n for n in self.use_conns if n in self.conns]
+        if isinstance(fallback_conn, str):
+            fallback_conn = self.conns.get(fallback_conn)
+        for name, c in self.conns.items():
+            if c is fallback_conn and name not in names:
+                names.append(name)
+        names = [n for n in names if n not in self._tailing]
+        healthy = [n for n in names if self.conn_health(n).healthy]
+        if self.conn_policy == "prefer":
+            # connections without measurements get a chance to be measured
+            healthy.sort(key=lambda n: self.conn_health(n).latency or 0)
+        # if everything is down, try the ones that failed longest ago first
+        down = sorted((n for n in names if n not in healthy),
+                key=lambda n: self.conn_health(n).down_until)
+        return healthy + down
+
+    def _best_conn(self):
+        """ the name of the connection that cmd() would try first
+        """
+        if self.conn_policy == "pin":
+            return self.use_conns[0]
+        order = self._conn_order()
+        return order[0] if order else self.use_conns[0]
+
+    @contextlib.contextmanager
+    def _leased(self, conn=None):
+        """ like :py:meth:`lease`, but like in :py:meth:`cmd` a connection
+            object is used as it is
+        """
+        if conn is not None and not isinstance(conn, str):
+            yield conn
+            return
+        with self.lease(conn) as connection:
+            yield connection
+
+    def clear_caches(self):
+        """ forget all cached command results of all connections
+        """
+        self.log("clear_caches()")
+        for c in self.conns.values():
+            c.cache.clear()
+
+    def put_text(self, text, path, conn=None, timeout=None):
+        """ write a text to a file on the :term:`target device`, see
+            :py:meth:`~monk_tf.conn.ConnectionBase.put_text`
+
+        :param conn: the connection or its name; by default the first one
+        """
+        self.log("put_text({} bytes, {})".format(len(text), path))
+        with self._leased(conn) as connection:
+            return connection.put_text(text, path, timeout=timeout)
+
+    def cmd_script(self, script, args="", conn=None, **kwargs):
+        """ upload a shell script and execute it, see
+            :py:meth:`~monk_tf.conn.ConnectionBase.cmd_script`
+
+        :param conn: the connection or its name; by default the first one
+        """
+        self.log("cmd_script({} bytes, {})".format(len(script), args))
+        with self._leased(conn) as connection:
+            return connection.cmd_script(script, args, **kwargs)
+
+    def run_script(self, path_or_text, args="", conn=None, timeout=None):
+        """ execute a script that is uploaded to the :term:`target device`
+            only once, see :py:meth:`~monk_tf.conn.ConnectionBase.run_script`
+
+        :param path_or_text: a local script file or the script itself
+
+        :param args: the arguments for the script, either a string or a list
+
+        :param conn: the connection or its name; by default the first one
+
+        :return: :term:`returncode`, :term:`standard output` of the script
+        """
+        self.log("run_script({},{})".format(path_or_text[:80], args))
+        if "\n" not in path_or_text and os.path.isfile(path_or_text):
+            with open(path_or_text) as f:
+                path_or_text = f.read()
+        with self._leased(conn) as connection:
+            return connection.run_script(path_or_text, args, timeout=timeout)
 
     def eval_cmd(self, msg, timeout=None, expect=None, do_retcode=True):
         """ apply the same method from the first connection
@@ -149,13 +488,13 @@ class Device(gp.MonkObject):
             "expect" : str(expect),
             "do_retcode" : do_retcode,
         }))
-        connection = self.firstconn
-        return connection.eval_cmd(
-                msg=msg,
-                timeout=timeout,
-                expect=PromptReplacement.replace(connection, expect),
-                do_retcode=do_retcode
-        )
+        with self.lease() as connection:
+            return connection.eval_cmd(
+                    msg=msg,
+                    timeout=timeout,
+                    expect=PromptReplacement.replace(connection, expect),
+                    do_retcode=do_retcode
+            )
 
     def wait_for(self, msg, retries=3, sleep=5, timeout=10):
         """ apply the same method from the first connection
@@ -166,27 +505,423 @@ class Device(gp.MonkObject):
             "sleep" : sleep,
             "timeout" : timeout,
         }))
-        return self.firstconn.wait_for(msg, retries, sleep, timeout)
+        with self.lease() as connection:
+            return connection.wait_for(msg, retries, sleep, timeout)
+
+    def tail(self, path, pattern=None, callback=None, lines=0, conn=None):
+        """ follow a log file on the :term:`target device`
+
+        The file is followed with ``tail -F`` in a session of its own and
+        filtered with ``grep`` on the target, so only the matching lines are
+        transmitted and the other connections stay free. A connection that
+        can't open a second session, like a serial console, is used itself
+        instead; until the tail stops, :py:meth:`cmd` uses the other
+        connections and :py:meth:`lease` refuses it with
+        :py:class:`ConnBusyException`. Either iterate over the lines::
+
+            with dev.tail("/var/log/messages", "ERROR") as log:
+                for line in log:
+                    [...]
+
+        or get them as they arrive::
+
+            log = dev.tail("/var/log/messages", "ERROR", callback=found.append)
+            [...]
+            log.stop()
+
+        :param path: the file on the target
+        :param pattern: an extended regular expression for ``grep``; None
+                        for all lines
+        :param callback: called with each line from a background thread;
+                         the lines are kept for iteration and
+                         :py:meth:`Tail.wait_for_line` as well
+        :param lines: how many of the existing lines are looked at, too
+        :param conn: the name of the connection whose clone is used; by
+                     default the ssh connection or else the first one in
+                     ``use_conns``
+
+        :return: a running :py:class:`Tail`; it is stopped by
+                 :py:meth:`close_all` at the latest
+        """
+        self.log("tail({},{},{})".format(path, pattern, lines))
+        if conn is None:
+            ssh = self.ssh_conn
+            conn = next((n for n, c in self.conns.items() if c is ssh), self.use_conns[0])
+        if conn in self._tailing:
+            raise ConnBusyException("'{}' follows a log already".format(conn))
+        source = self.conns[conn]
+        leases = contextlib.ExitStack()
+        try:
+            channel = source.clone("{}-tail".format(source.name))
+            borrowed = False
+        except mc.CantCloneException:
+            self._logger.warning("'{}' has only one session, it is busy until the tail stops".format(conn))
+            # held until the tail stops, nobody else may write to it
+            channel = leases.enter_context(self.lease(conn))
+            self._tailing.add(conn)
+            borrowed = True
+        def stopped(tail):
+            if tail in self._tails:
+                self._tails.remove(tail)
+            self._tailing.discard(conn)
+            leases.close()
+        tail = Tail(channel, path, pattern, callback, lines, borrowed=borrowed,
+                on_stop=stopped)
+        self._tails.append(tail)
+        try:
+            return tail.start()
+        except Exception:
+            stopped(tail)
+            raise
+
+    def wait_for_line(self, path, pattern, timeout=30, lines=0):
+        """ wait until a line that matches appears in a file on the target
 
-    def cp(self, src_path, trgt_path):
-        """ send files via scp to target device
+        :param pattern: an extended regular expression
+        :param timeout: seconds until :py:class:`TailTimeoutException`
+        :param lines: how many of the existing lines count, too
+
+        :return: the first matching line
+        """
+        with self.tail(path, pattern, lines=lines) as tail:
+            # grep matched already, in its own regex dialect
+            return tail.wait_for_line(timeout=timeout)
+
+    def cp(self, src_path, trgt_path, bwlimit=None, timeout=None):
+        """ send files to target device
+
+        The file is sent via scp if the device has an ssh connection,
+        otherwise with :py:meth:`~monk_tf.conn.ConnectionBase.put_file`
+        through the first connection.
 
         :param src_path: the path to the file on the host machine
         :param trgt_path: the path of the file on the target machine
+        :param bwlimit: the maximal bandwidth in Kbit/s
+        :param timeout: how long the transfer may take
         """
         self.log("send file from {} to {} on the target device".format(
             src_path,
             trgt_path,
         ))
-        self.conns.get("ssh1").cp(src_path, trgt_path)
+        ssh = self.ssh_conn
+        if ssh:
+            ssh.cp(src_path, trgt_path, bwlimit=bwlimit, timeout=timeout or 10)
+        else:
+            with self.lease() as connection:
+                connection.put_file(src_path, trgt_path, timeout=timeout,
+                        bwlimit=bwlimit)
         self.log("sending file succeeded")
 
+    def update(self, image, method, version=None, version_cmd="cat /etc/version",
+            trgt_dir="/tmp", chunk_size=1024**2, retries=3, reboot=True,
+            timeout=900, reboots=None):
+        """ install a firmware image on the :term:`target device`
+
+        The phases are:
+
+        upload
+            the image is sent in chunks of ``chunk_size`` bytes. Each chunk
+            is checked, appended to the image on the device and removed, so
+            the device needs hardly more space than the image. A partial
+            image from a broken connection or a failed update is continued
+            if its content is right.
+        verify
+            the image's sha256 is compared
+        install
+            ``method`` installs the image; afterwards the image is removed.
+            A method that reboots the device itself is sent like the
+            command of :py:meth:`reboot`, and this phase lasts until the
+            device is back. If it fails right away, the update fails
+            without waiting for the reboot.
+        reboot
+            see :py:meth:`reboot`; skipped if the install rebooted already
+        confirm
+            the output of ``version_cmd`` must be ``version``; otherwise the
+            update probably was rolled back
+
+        :param image: the path to the image on the host machine
+
+        :param method: how the image is installed: a name from
+                       :py:data:`UPDATE_METHODS`, a shell command with
+                       ``{image}`` as placeholder for the image path on the
+                       device, or a function (device, image path)
+
+        :param version: the expected version after the update
+
+        :param version_cmd: the shell command that prints the version
+
+        :param trgt_dir: where the image is stored on the device
+
+        :param chunk_size: bytes per chunk
+
+        :param retries: how often a broken upload is continued
+
+        :param reboot: whether the device is rebooted after the installation
+
+        :param timeout: seconds for the reboot and the install command
+
+        :param reboots: whether ``method`` reboots the device itself; by
+                        default true for the methods in
+                        :py:data:`REBOOTING_UPDATE_METHODS`
+
+        :return: an OrderedDict of phase:seconds
+        """
+        self.log("update({},{},{})".format(image, method, version))
+        phases = collections.OrderedDict()
+        sha = hashlib.sha256()
+        with open(image, "rb") as f:
+            for block in iter(lambda: f.read(chunk_size), b""):
+                sha.update(block)
+        checksum = sha.hexdigest()
+        remote_dir = "{}/monk-update-{}".format(trgt_dir.rstrip("/"), checksum[:12])
+        remote_image = "{}/{}".format(remote_dir, os.path.basename(image))
+        phase = "upload"
+        try:
+            start = time.time()
+            for attempt in range(retries + 1):
+                try:
+                    self._upload_chunks(image, remote_image, chunk_size)
+                    break
+                except (pexpect.EOF, pexpect.TIMEOUT, mc.AConnectionException) as e:
+                    if attempt == retries:
+                        raise
+                    self._logger.warning("upload broke off ({}), continue".format(
+                        e.__class__.__name__))
+                    for c in self.conns.values():
+                        c.close()
+            phases[phase] = time.time() - start
+            phase = "verify"
+            start = time.time()
+            # the image stays until the install worked, for a resume
+            out = self._update_cmd("sha256sum {}".format(shlex.quote(remote_image)))
+            if out.split()[:1] != [checksum]:
+                raise UpdateFailedException("image checksum is '{}' instead of '{}'".format(
+                    out, checksum))
+            phases[phase] = time.time() - start
+            phase = "install"
+            start = time.time()
+            if reboots is None:
+                reboots = method in REBOOTING_UPDATE_METHODS
+            method = UPDATE_METHODS.get(method, method)
+            if callable(method):
+                method(self, remote_image)
+            elif reboots:
+                # the connection drops while it runs, that's no failure;
+                # but an rc shows up if it fails before the device goes down
+                self.reboot(timeout=timeout,
+                        cmd=method.format(image=shlex.quote(remote_image))
+                            + INSTALL_FAILED_ECHO,
+                        failed_expect=INSTALL_FAILED_EXPECT)
+            else:
+                self._update_cmd(method.format(image=shlex.quote(remote_image)),
+                        timeout=timeout)
+            phases[phase] = time.time() - start
+            self._update_cmd("rm -rf {}".format(shlex.quote(remote_dir)))
+            if reboot and not reboots:
+                phase = "reboot"
+                phases[phase] = self.reboot(timeout=timeout)
+            phase = "confirm"
+            start = time.time()
+            self._facts = None
+            if version is not None:
+                found = self._update_cmd(version_cmd).strip()
+                if found != str(version):
+                    raise UpdateFailedException("version is '{}' instead of '{}'".format(
+                        found, version))
+            phases[phase] = time.time() - start
+        except (pexpect.EOF, pexpect.TIMEOUT, mc.AConnectionException,
+                RebootFailedException, UpdateFailedException) as e:
+            raise UpdateFailedException("{} failed in phase {} after {}: {}: {}".format(
+                self.name,
+                phase,
+                dict(phases),
+                e.__class__.__name__,
+                (str(e).splitlines() or [""])[0],
+            ))
+        self.log("updated in {}".format(dict(phases)))
+        return phases
+
+    def _upload_chunks(self, image, remote_image, chunk_size):
+        """ append the chunks of an image that are not on the device yet
+
+        :return: the numbers of sent and skipped chunks
+        """
+        q_image = shlex.quote(remote_image)
+        q_part = shlex.quote(remote_image + ".part")
+        out = self._update_cmd("mkdir -p {0} && touch {1} && wc -c < {1} && sha256sum {1}".format(
+            shlex.quote(os.path.dirname(remote_image)), q_image))
+        size, present = int(out.split()[0]), out.split()[1]
+        sha = hashlib.sha256()
+        with open(image, "rb") as f:
+            prefix = f.read(size)
+        sha.update(prefix)
+        if len(prefix) != size or sha.hexdigest() != present:
+            self.log("partial image doesn't match, start over")
+            self._update_cmd(": > {}".format(q_image))
+            size = 0
+        sent, skipped = 0, size // chunk_size
+        with open(image, "rb") as f, tempfile.NamedTemporaryFile(prefix="monk-chunk-") as tmp:
+            f.seek(size)
+            for chunk in iter(lambda: f.read(chunk_size), b""):
+                tmp.seek(0)
+                tmp.truncate()
+                tmp.write(chunk)
+                tmp.flush()
+                self.cp(tmp.name, remote_image + ".part")
+                out = self._update_cmd("sha256sum {}".format(q_part))
+                if out.split()[:1] != [hashlib.sha256(chunk).hexdigest()]:
+                    raise mc.TransferFailedException("chunk {} arrived broken".format(
+                        sent + skipped))
+                self._update_cmd("cat {0} >> {1} && rm {0}".format(q_part, q_image))
+                sent += 1
+        self.log("sent {} chunks, {} were already there".format(sent, skipped))
+        self.firstconn._count("update_chunks_sent", sent)
+        self.firstconn._count("update_chunks_skipped", skipped)
+        return sent, skipped
+
+    def _update_cmd(self, cmd, timeout=30):
+        rc, out = self.cmd(cmd, timeout=timeout, cache=False)
+        if rc != 0:
+            raise UpdateFailedException("'{}' failed with {}: {}".format(cmd, rc, out))
+        return out
+
+    @property
+    def ssh_conn(self):
+        """ the first ssh connection, preferably from ``use_conns``, or None
+        """
+        names = self.use_conns + [n for n in self.conns if n not in self.use_conns]
+        for name in names:
+            if isinstance(self.conns.get(name), mc.SshConn):
+                return self.conns[name]
+        return None
+
+    def reboot(self, timeout=300, cmd="reboot", boot_expect="(?i)login: ",
+            conn=None, failed_expect=None):
+        """ reboot the :term:`target device` and wait until it is usable again
+
+        The reboot command is sent via ``conn`` or the connection that
+        :py:meth:`cmd` would try first, see ``conn_policy``. If
+        the device has a :py:attr:`fallback_conn` (usually the serial
+        console), the boot progress is logged from there until
+        ``boot_expect`` shows up. Without one, the device counts as rebooted
+        when its ``boot_id`` changed. Afterwards all connections are closed,
+        cached results and facts are forgotten, and the first connection
+        waits for a prompt.
+
+        :param timeout: seconds until the device must be back
+
+        :param cmd: the shell command that triggers the reboot
+
+        :param boot_expect: a regex in the console output that marks the end
+                            of the boot process
+
+        :param conn: the connection or the name of the connection used to
+                     send the reboot command
+
+        :param failed_expect: a regex in the output of ``cmd`` that means it
+                              failed; it is looked for during
+                              ``probe_timeout`` seconds after ``cmd`` was sent
+
+        :return: how many seconds the reboot took
+        """
+        self.log("reboot({},{},{})".format(timeout, cmd, boot_expect))
+        start = time.time()
+        deadline = start + timeout
+        watch = self.fallback_conn
+        watch_name = next((n for n, c in self.conns.items() if c is watch), None)
+        try:
+            with contextlib.ExitStack() as leases:
+                connection = leases.enter_context(self._leased(conn or self._best_conn()))
+                if watch_name:
+                    leases.enter_context(self.lease(watch_name))
+                if watch:
+                    # the console must be open before the device goes down
+                    watch.wait_for_prompt(deadline - time.time())
+                    boot_id = None
+                else:
+                    boot_id = self._boot_id()
+                connection.wait_for_prompt(deadline - time.time())
+                connection._sendline(cmd)
+                if failed_expect:
+                    self._check_reboot_cmd(connection, cmd, failed_expect,
+                            min(self.probe_timeout, deadline - time.time()))
+                self._facts = None
+                for c in list(self.conns.values()) + self._pool_members[1:]:
+                    if c is not watch:
+                        c.close()
+                if watch:
+                    self._watch_boot(watch, boot_expect, deadline)
+                    watch.close()
+            self._wait_until_up(boot_id, deadline)
+        except (pexpect.EOF, pexpect.TIMEOUT, mc.AConnectionException) as e:
+            raise RebootFailedException("{} not back after {:.1f}s: {}: {}".format(
+                self.name,
+                time.time() - start,
+                e.__class__.__name__,
+                # pexpect adds a long dump of its internals
+                (str(e).splitlines() or [""])[0],
+            ))
+        duration = time.time() - start
+        self.log("rebooted in {:.1f}s".format(duration))
+        return duration
+
+    def _check_reboot_cmd(self, connection, cmd, failed_expect, timeout):
+        """ raise a RebootFailedException if ``failed_expect`` shows up
+        """
+        try:
+            connection.exp.expect_list(connection.compile_patterns([failed_expect]),
+                    timeout=max(timeout, 0))
+        except (pexpect.EOF, pexpect.TIMEOUT):
+            # the device is going down or busy, as it should
+            return
+        before, failed = [t.decode("utf-8", "replace") if isinstance(t, bytes) else t
+                for t in (connection.exp.before, connection.exp.after)]
+        lines = [l.strip() for l in before.splitlines() if l.strip()]
+        raise RebootFailedException("'{}' failed, the device doesn't reboot: {}".format(
+            cmd, " | ".join(lines[-3:] + [failed])))
+
+    def _boot_id(self):
+        rc, out = self.cmd("cat /proc/sys/kernel/random/boot_id", cache=False)
+        return out.strip()
+
+    def _watch_boot(self, watch, boot_expect, deadline):
+        """ log every line of the console until the boot is finished
+        """
+        patterns = watch.compile_patterns([boot_expect, "\r?\n"])
+        while True:
+            index = watch.exp.expect_list(patterns,
+                    timeout=max(deadline - time.time(), 0))
+            line = watch.exp.before
+            self.log("boot: {}".format(
+                line.decode("utf-8", "replace") if isinstance(line, bytes) else line,
+            ))
+            if index == 0:
+                return
+
+    def _wait_until_up(self, old_boot_id, deadline):
+        """ wait for a prompt; if a boot_id is given also for a new one
+        """
+        while True:
+            with self.lease() as connection:
+                connection.wait_for_prompt(max(deadline - time.time(), 1))
+                if old_boot_id is None or self._boot_id() != old_boot_id:
+                    return
+                self.log("device didn't go down yet")
+                connection.close()
+            if time.time() > deadline:
+                raise RebootFailedException("{} never went down".format(self.name))
+            time.sleep(1)
+
     def close_all(self):
         """ loop through all connections calling :py:meth:`~monk_tf.conn.ConnectionBase.close`.
         """
         self.log("close_all()")
         for c in self.conns.values():
             c.close()
+        for c in self._pool_members[1:]:
+            c.close()
+        for tail in list(self._tails):
+            tail.stop()
 
     def __str__(self):
         return "{}({}):name={}".format(
@@ -195,12 +930,318 @@ class Device(gp.MonkObject):
                 self.name,
         )
 
+######
+#
+# Tail
+#
+######
+
+class Tail(gp.MonkObject):
+    """ the lines of a log file as they are written on the target, see
+        :py:meth:`Device.tail`
+    """
+
+    # how many unread lines are kept; older ones are dropped
+    BACKLOG = 10000
+
+    def __init__(self, channel, path, pattern=None, callback=None, lines=0,
+            borrowed=False, on_stop=None):
+        """
+        :param channel: the connection that runs tail
+
+        :param borrowed: if false, the channel is a session of its own and
+                         :py:meth:`stop` closes it; otherwise it's left at
+                         a prompt for further use
+
+        :param on_stop: called with this object when it stopped
+        """
+        super(Tail, self).__init__(
+                name=channel.name,
+                module=__name__,
+        )
+        self.channel = channel
+        self.path = path
+        self.pattern = pattern
+        self.callback = callback
+        self.lines = int(lines)
+        self.borrowed = borrowed
+        self.on_stop = on_stop
+        self._queue = queue.Queue(self.BACKLOG)
+        self._running = False
+        self._thread = None
+
+    @property
+    def command(self):
+        cmd = "tail -n {} -F {}".format(self.lines, shlex.quote(self.path))
+        if self.pattern:
+            cmd += " | grep --line-buffered -E -e {}".format(shlex.quote(self.pattern))
+        return cmd
+
+    def start(self):
+        """ log in, start following and return self
+        """
+        self.log("start({})".format(self.command))
+        self.channel.wait_for_prompt(self.channel.first_prompt_timeout)
+        # the quotes keep an echo of the command line from matching the
+        # marker, after it there are only lines from the file
+        self.channel._sendline("echo MONK''TAIL; " + self.command)
+        self.channel._expect("MONKTAIL\r?\n")
+        self._running = True
+        self._thread = threading.Thread(
+                target=self._read,
+                name="monk-tail-{}".format(self.name),
+        )
+        self._thread.daemon = True
+        self._thread.start()
+        return self
+
+    def _read(self):
+        exp = self.channel.exp
+        patterns = self.channel.compile_patterns([r"\r?\n", pexpect.EOF, pexpect.TIMEOUT])
+        try:
+            while self._running:
+                index = exp.expect_list(patterns, timeout=1)
+                if index == 1:
+                    self.log("channel closed")
+                    break
+                if index == 2:
+                    continue
+                if not self._running:
+                    # the echo of Ctrl-C and what else comes while stopping
+                    break
+                line = exp.before.decode("utf-8", "replace").rstrip("\r")
+                self.channel._count("tail_lines")
+                if self.callback:
+                    self.callback(line)
+                self._keep(line)
+        except (OSError, ValueError) as e:
+            # the channel was closed under our feet
+            self.log("reading failed: {}".format(e))
+        finally:
+            self._keep(None)
+
+    def _keep(self, line):
+        """ queue a line for the readers, but not more than BACKLOG
+        """
+        while True:
+            try:
+                self._queue.put_nowait(line)
+                return
+            except queue.Full:
+                pass
+            try:
+                self._queue.get_nowait()
+                self.channel._count("tail_lines_dropped")
+            except queue.Empty:
+                pass
+
+    def __iter__(self):
+        """ the lines until the tail stops
+        """
+        while True:
+            line = self._queue.get()
+            if line is None:
+                # for the next one who asks
+                self._queue.put(None)
+                return
+            yield line
+
+    def wait_for_line(self, pattern=None, timeout=30):
+        """ skip lines until one matches
+
+        :param pattern: a Python regular expression; None for the next line
+        :param timeout: seconds until :py:class:`TailTimeoutException`
+
+        :return: the matching line
+        """
+        self.log("wait_for_line({},{})".format(pattern, timeout))
+        regex = re.compile(pattern or "")
+        end_time = time.time() + timeout
+        while True:
+            try:
+                line = self._queue.get(timeout=max(end_time - time.time(), 0))
+            except queue.Empty:
+                break
+            if line is None:
+                self._queue.put(None)
+                break
+            if regex.search(line):
+                return line
+        raise TailTimeoutException("no line matching '{}' in {} after {}s".format(
+            pattern or self.pattern, self.path, timeout))
+
+    def stop(self):
+        """ stop following and close or give back the channel
+        """
+        if not self._running:
+            return
+        self.log("stop()")
+        self._running = False
+        try:
+            # Ctrl-C; fdspawn has no sendcontrol()
+            self.channel.exp.send("\x03")
+        except Exception as e:
+            self.log("can't interrupt tail: {}".format(e))
+        self._thread.join(2)
+        if self.borrowed:
+            try:
+                self.channel._expect(self.channel.prompt,
+                        timeout=self.channel.default_timeout)
+            except (pexpect.EOF, pexpect.TIMEOUT):
+                # the next command logs in again
+                self.channel.close()
+        else:
+            self.channel.close()
+        if self.on_stop:
+            self.on_stop(self)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exception_type, exception_val, tb):
+        self.stop()
+
 #########
 #
 # Helpers
 #
 #########
 
+def _parse_keyvalues(txt):
+    """ parse lines like ``NAME="value"`` (e.g. /etc/os-release)
+    """
+    result = {}
+    for line in txt.splitlines():
+        key, sep, value = line.partition("=")
+        if sep:
+            result[key.strip()] = value.strip().strip('"')
+    return result
+
+def _parse_meminfo(txt):
+    """ /proc/meminfo in bytes, e.g. ``{"MemTotal": 1045684224, ...}``
+    """
+    result = {}
+    for line in txt.splitlines():
+        match = re.match(r"(\S+):\s+(\d+)(\s+kB)?", line)
+        if match:
+            result[match.group(1)] = int(match.group(2)) * (1024 if match.group(3) else 1)
+    return result
+
+def _parse_mounts(txt):
+    result = []
+    for line in txt.splitlines():
+        parts = line.split()
+        if len(parts) >= 4:
+            result.append({
+                "device" : parts[0],
+                "mountpoint" : parts[1],
+                "fstype" : parts[2],
+                "options" : parts[3].split(","),
+            })
+    return result
+
+def _parse_interfaces(txt):
+    """ the output of ``ip -o addr`` as ``{"eth0": {"ipv4": [...], "ipv6": [...]}}``
+    """
+    result = {}
+    for line in txt.splitlines():
+        match = re.match(r"\d+:\s+(\S+?)(@\S+)?\s+(inet6?)\s+(\S+)", line)
+        if match:
+            iface = result.setdefault(match.group(1), {"ipv4" : [], "ipv6" : []})
+            iface["ipv6" if match.group(3) == "inet6" else "ipv4"].append(match.group(4))
+    return result
+
+def _parse_uptime(txt):
+    try:
+        return float(txt.split()[0])
+    except (IndexError, ValueError):
+        return None
+
+#: install commands for :py:meth:`Device.update`; ``{image}`` is the path of
+#: the image on the :term:`target device`
+UPDATE_METHODS = {
+    "sysupgrade" : "sysupgrade -n {image}",
+    "rauc" : "rauc install {image}",
+    "swupdate" : "swupdate -i {image}",
+}
+
+#: the :py:data:`UPDATE_METHODS` that reboot the device by themselves
+REBOOTING_UPDATE_METHODS = ("sysupgrade",)
+
+# the quotes keep the echo of the command from matching INSTALL_FAILED_EXPECT
+INSTALL_FAILED_ECHO = ' || echo "<install-fail""ed>$?"'
+INSTALL_FAILED_EXPECT = r"<install-failed>\d+"
+
+#: what :py:attr:`Device.facts` contains: (name, shell command, parser)
+FACTS = [
+    ("kernel", "uname -r", str.strip),
+    ("arch", "uname -m", str.strip),
+    ("hostname", "cat /proc/sys/kernel/hostname", str.strip),
+    ("version", "cat /etc/version", str.strip),
+    ("os_release", "cat /etc/os-release", _parse_keyvalues),
+    ("meminfo", "cat /proc/meminfo", _parse_meminfo),
+    ("mounts", "cat /proc/mounts", _parse_mounts),
+    ("interfaces", "ip -o addr", _parse_interfaces),
+    ("uptime", "cat /proc/uptime", _parse_uptime),
+]
+
+def parse_facts(out):
+    """ turn the output of the facts script into typed values
+
+    Facts the :term:`target device` couldn't deliver are None. For
+    convenience ``mem_total`` and ``mem_available`` are taken from
+    ``meminfo``.
+    """
+    facts = {}
+    for name, _, parser in FACTS:
+        match = re.search("<fact:{0}>\n?(.*?)\n?</fact:{0}>".format(name), out or "", re.S)
+        raw = match.group(1) if match else ""
+        facts[name] = parser(raw) if raw.strip() else None
+    meminfo = facts["meminfo"] or {}
+    facts["mem_total"] = meminfo.get("MemTotal")
+    facts["mem_available"] = meminfo.get("MemAvailable", meminfo.get("MemFree"))
+    return facts
+
+class ConnHealth(object):
+    """ health score and latency estimate of one connection of a device
+
+    Both are exponentially weighted moving averages, so recent commands
+    count more than old ones.
+    """
+
+    # weight of the newest measurement
+    ALPHA = 0.3
+
+    def __init__(self):
+        self.latency = None
+        self.score = 1.0
+        self.failures = 0
+        self.down_until = 0
+
+    @property
+    def healthy(self):
+        return time.time() >= self.down_until
+
+    def succeeded(self, latency):
+        self.latency = latency if self.latency is None else (
+                self.ALPHA * latency + (1 - self.ALPHA) * self.latency)
+        self.score = self.ALPHA + (1 - self.ALPHA) * self.score
+        self.failures = 0
+        self.down_until = 0
+
+    def failed(self, cooldown):
+        self.score = (1 - self.ALPHA) * self.score
+        self.failures += 1
+        self.down_until = time.time() + cooldown
+
+    def __str__(self):
+        return "{}(latency={},score={:.2f},failures={})".format(
+                self.__class__.__name__,
+                self.latency,
+                self.score,
+                self.failures,
+        )
+
 class PromptReplacement(object):
     """ should be replaced by each connection's own prompt.
     """
@@ -78,20 +78,38 @@ Classes
 import os
 from os import environ
 import os.path as op
+import re
 import sys
+import fnmatch
 import logging
+import logging.handlers
+import atexit
 import collections
+import collections.abc
+import copy
 import time
 import io
+import gzip
 import traceback
 import datetime
 import json
-
-import configobj as config
+import shlex
+import shutil
+import hashlib
+import tempfile
+import threading
+import queue
 
 import monk_tf.general_purpose as gp
-import monk_tf.conn as mc
-import monk_tf.dev as md
+import monk_tf.metrics as mm
+
+# loaded when a fixture file is read or an object of theirs is created
+config = gp.lazy_import("configobj")
+mc = gp.lazy_import("monk_tf.conn")
+md = gp.lazy_import("monk_tf.dev")
+ms = gp.lazy_import("monk_tf.sim")
+mp = gp.lazy_import("monk_tf.profiling")
+ml = gp.lazy_import("monk_tf.lease")
 
 logger = logging.getLogger(__name__)
 
@@ -158,6 +176,16 @@ class UnknownTypeException(AFixtureException):
     """
     pass
 
+class DeployFailedException(AFixtureException):
+    """ is raised when a deployed file didn't arrive correctly on a device
+    """
+    pass
+
+class MissingModuleException(AFixtureException):
+    """ is raised when a feature needs a python module that isn't installed
+    """
+    pass
+
 
 ##############################################################
 #
@@ -165,6 +193,18 @@ class UnknownTypeException(AFixtureException):
 #
 ##############################################################
 
+def default_subs():
+    """ the substitutions that can be used in paths in the fixture files
+
+    e.g. ``sink=%(suitename)s-%(testcase)s.log``
+    """
+    return {
+        "testcase" : gp.find_testname(),
+        "rootlogger" : "",
+        "suitename" : environ.get("SUITE", "suite"),
+        "datetime" : datetime.datetime.now().strftime("%y%m%d-%H%M%S"),
+    }
+
 class LogManager(gp.MonkObject):
     """ managing configuration and setup of logging mechanics
 
@@ -199,7 +239,13 @@ class LogHandler(gp.MonkObject):
         self.format = format
         self.level = level
 
-    def register(self):
+    def register(self, queued=False):
+        """ attach the handler to its target logger
+
+        :param queued: if True, the logger only puts the records into a
+                       queue and a background thread formats and writes them
+                       with the actual handler. See :py:func:`flush_logging`.
+        """
         self.pre_register()
         self.log("set loglevel (to handler and logger):{}".format(self.level))
         self.handler.setLevel(self._LOGLEVELS[self.level])
@@ -208,21 +254,20 @@ class LogHandler(gp.MonkObject):
         self.handler.setFormatter(logging.Formatter(
             fmt=self.format,
         ))
-        self.log("register at logger '{}'".format(
+        self.log("register at logger '{}'{}".format(
             self.target,
+            " via queue" if queued else "",
         ))
-        logging.getLogger(self.target).addHandler(self.handler)
+        if queued:
+            _register_queued(self)
+        else:
+            logging.getLogger(self.target).addHandler(self.handler)
         self.post_register()
 
     def config_subs(self, txt, subs=None):
         """ replace the strings in the config that we have reasonable values for
         """
-        substitutes = subs or {
-                "testcase" : gp.find_testname(),
-                "rootlogger" : "",
-                "suitename" : environ.get("SUITE", "suite"),
-                "datetime" : datetime.datetime.now().strftime("%y%m%d-%H%M%S"),
-        }
+        substitutes = subs or default_subs()
         self.log("replaced subs:{}".format(substitutes))
         return txt % substitutes
 
@@ -259,7 +304,286 @@ class FileHandler(LogHandler):
     def pre_register(self):
         self.handler = logging.FileHandler(self.config_subs(self.sink))
 
+class CompressedFileHandler(LogHandler):
+    """ writes a compressed log file that is rotated by size
+
+    In a fixture file it looks like this::
+
+        [logging]
+            [[debuglog]]
+                type=CompressedFileHandler
+                sink=%(suitename)s-%(testcase)s.log.gz
+                target=monk_tf
+                format=%(asctime)s %(name)s %(message)s
+                level=DEBUG
+                compression=gzip
+                max_bytes=50000000
+                backup_count=5
+
+    ``compression`` is ``gzip`` or ``zstd`` (needs the zstandard module).
+    ``max_bytes`` limits the compressed size of a single file; 0 means no
+    rotation. The compressor writes in blocks, so a file can get some ten
+    kilobytes bigger than that. Rotated files are named like
+    ``suite-test.log.1.gz``.
+    """
+
+    def __init__(self, name, sink, target, format, level,
+            compression="gzip", max_bytes=0, backup_count=5, compresslevel=None):
+        super(CompressedFileHandler, self).__init__(name, sink, target, format, level)
+        self.compression = compression
+        self.max_bytes = int(max_bytes)
+        self.backup_count = int(backup_count)
+        self.compresslevel = int(compresslevel) if compresslevel else None
+
+    def pre_register(self):
+        self.handler = CompressedRotatingFileHandler(
+                self.config_subs(self.sink),
+                compression=self.compression,
+                maxBytes=self.max_bytes,
+                backupCount=self.backup_count,
+                compresslevel=self.compresslevel,
+        )
+
+class CompressedRotatingFileHandler(logging.handlers.RotatingFileHandler):
+    """ a :py:class:`logging.handlers.RotatingFileHandler` that compresses
+
+    The compressor is only flushed when the file is closed or rotated,
+    because every flush would end a compression block and spoil the ratio.
+    """
+
+    COMPRESSIONS = {
+        "gzip" : ".gz",
+        "zstd" : ".zst",
+    }
+
+    def __init__(self, filename, compression="gzip", maxBytes=0,
+            backupCount=0, compresslevel=None):
+        if compression not in self.COMPRESSIONS:
+            raise UnknownTypeException("compression '{}' is none of {}".format(
+                compression,
+                list(self.COMPRESSIONS.keys()),
+            ))
+        if compression == "zstd":
+            try:
+                import zstandard
+            except ImportError:
+                raise MissingModuleException("zstd compression needs the zstandard module")
+        self.compression = compression
+        self.compresslevel = compresslevel
+        self._raw = None
+        super(CompressedRotatingFileHandler, self).__init__(
+                filename,
+                mode="a",
+                maxBytes=maxBytes,
+                backupCount=backupCount,
+                encoding="utf-8",
+                delay=True,
+        )
+        self.namer = self._backup_name
+
+    def _backup_name(self, default_name):
+        """ log.gz.1 -> log.1.gz
+        """
+        ext = self.COMPRESSIONS[self.compression]
+        base, dot, number = default_name.rpartition(".")
+        if base.endswith(ext):
+            return "{}.{}{}".format(base[:-len(ext)], number, ext)
+        return default_name
+
+    def _open(self):
+        if self.compression == "zstd":
+            import zstandard
+            self._raw = open(self.baseFilename, "ab")
+            binary = zstandard.ZstdCompressor(
+                    level=self.compresslevel or 3,
+            ).stream_writer(self._raw)
+        else:
+            binary = gzip.GzipFile(self.baseFilename, "ab",
+                    compresslevel=self.compresslevel or 6)
+            self._raw = binary.fileobj
+        return io.TextIOWrapper(binary, encoding="utf-8", write_through=True)
+
+    def shouldRollover(self, record):
+        if self.stream is None:
+            self.stream = self._open()
+        return self.maxBytes > 0 and self._raw.tell() >= self.maxBytes
 
+    def flush(self):
+        pass
+
+# (target, handler type, sink): (queue handler, listener) of queued handlers
+_LISTENERS = {}
+_LISTENERS_LOCK = threading.Lock()
+
+def _register_queued(loghandler):
+    """ put a queue in front of a LogHandler's handler
+
+    A handler that is registered again for the same target and sink
+    replaces the old one.
+    """
+    key = (loghandler.target, loghandler.__class__.__name__, loghandler.sink)
+    records = queue.Queue()
+    queue_handler = logging.handlers.QueueHandler(records)
+    queue_handler.setLevel(loghandler.handler.level)
+    listener = logging.handlers.QueueListener(records, loghandler.handler,
+            respect_handler_level=True)
+    with _LISTENERS_LOCK:
+        old = _LISTENERS.pop(key, None)
+        if not _LISTENERS and not old:
+            atexit.register(stop_logging)
+        _LISTENERS[key] = (queue_handler, listener)
+    if old:
+        logging.getLogger(loghandler.target).removeHandler(old[0])
+        _stop_listener(old[1])
+    listener.start()
+    logging.getLogger(loghandler.target).addHandler(queue_handler)
+
+def _stop_listener(listener):
+    listener.stop()
+    for handler in listener.handlers:
+        handler.close()
+
+def flush_logging():
+    """ wait until all queued log records are written
+    """
+    with _LISTENERS_LOCK:
+        listeners = [l for _, l in _LISTENERS.values()]
+    for listener in listeners:
+        if listener._thread:
+            listener.queue.join()
+        for handler in listener.handlers:
+            handler.flush()
+
+def stop_logging():
+    """ write all queued log records and stop the background threads
+
+    This is called automatically when the interpreter exits.
+    """
+    with _LISTENERS_LOCK:
+        items = list(_LISTENERS.items())
+        _LISTENERS.clear()
+    for key, (queue_handler, listener) in items:
+        logging.getLogger(key[0]).removeHandler(queue_handler)
+        _stop_listener(listener)
+
+
+
+class DeviceIndex(collections.abc.Mapping):
+    """ the devices of a fixture, created only when they are used
+
+    The sections of the fixture file are indexed by name, type and tags, so
+    that ``use_devs`` can select devices without creating all the others.
+    Tags are set in a device section::
+
+        [dev1]
+            type=Device
+            tags=rack1,arm
+            [[conns]]
+                [...]
+
+    Accessing a device by name creates it. Iterating over all items creates
+    all devices; use :py:meth:`loaded` to get only those that exist already.
+    """
+
+    def __init__(self, build):
+        """
+        :param build: a function (name, section) that creates a device
+        """
+        self._build = build
+        self._sections = collections.OrderedDict()
+        self._objects = {}
+        self._lock = threading.Lock()
+
+    def add_section(self, name, sectype, section):
+        """ index a section without creating its object
+        """
+        # a deep copy, because parsing changes the section
+        section = section.dict() if hasattr(section, "dict") else copy.deepcopy(dict(section))
+        tags = section.pop("tags", [])
+        self._sections[name] = (
+            sectype,
+            [tags] if isinstance(tags, str) else list(tags),
+            section,
+        )
+        self._objects.pop(name, None)
+
+    def add(self, name, obj):
+        """ add an object that is created already
+        """
+        self._sections[name] = (obj.__class__.__name__, [], None)
+        self._objects[name] = obj
+
+    def section(self, name):
+        """ :return: the unparsed section of a device or None if it was
+                     added as an object
+        """
+        return self._sections[name][2]
+
+    def tags(self, name):
+        return self._sections[name][1]
+
+    def sectype(self, name):
+        return self._sections[name][0]
+
+    def loaded(self):
+        """ :return: a dict of the devices that are created already
+        """
+        with self._lock:
+            return dict(self._objects)
+
+    def matches(self, name, query):
+        """ :param query: ``tag:<tag>``, ``type:<type>`` or a name, which
+                          may contain shell wildcards like ``board-*``
+        """
+        if query.startswith("tag:"):
+            return query[4:] in self.tags(name)
+        if query.startswith("type:"):
+            return query[5:] == self.sectype(name)
+        return fnmatch.fnmatchcase(name, query)
+
+    def select(self, selectors):
+        """ find the devices that the selectors mean, without creating them
+
+        Each selector is a query (see :py:meth:`matches`), optionally with a
+        count in front: ``2*tag:rack1`` means the first two devices with the
+        tag rack1. Every device is chosen only once.
+
+        :return: the names of the chosen devices, in order
+        """
+        chosen = []
+        for selector in selectors:
+            match = re.match(r"^(\d+)\*(.+)$", selector)
+            count, query = (int(match.group(1)), match.group(2)) if match else (None, selector)
+            found = [n for n in self._sections
+                    if n not in chosen and self.matches(n, query)]
+            if not found or (count and len(found) < count):
+                raise NoDevsChosenException("'{}' selects {} of the devices {}".format(
+                    selector, len(found), list(self._sections)))
+            chosen.extend(found[:count])
+        return chosen
+
+    def __getitem__(self, name):
+        with self._lock:
+            try:
+                return self._objects[name]
+            except KeyError:
+                sectype, tags, section = self._sections[name]
+                # parsing pops the types of the nested sections, too
+                obj = self._objects[name] = self._build(name, copy.deepcopy(section))
+                return obj
+
+    def __iter__(self):
+        return iter(list(self._sections))
+
+    def __len__(self):
+        return len(self._sections)
+
+    def __str__(self):
+        return "{}({} indexed, loaded: {})".format(
+                self.__class__.__name__,
+                len(self._sections),
+                list(self._objects),
+        )
 
 class Fixture(gp.MonkObject):
     """ Creates :term:`MONK` objects based on dictionary like objects.
@@ -270,8 +594,14 @@ class Fixture(gp.MonkObject):
     """
 
 
+    # top level sections of these types are only parsed when they are used
+    LAZY_SECTYPES = ("Device",)
+
+    # how many bytes deploy() reads at once
+    DEPLOY_BLOCK_SIZE = 1024**2
+
     def __init__(self, call_location, name=None,
-            fixture_locations=None, parsers=None):
+            fixture_locations=None, parsers=None, shard=None):
         """
         :param call_location: the __file__ from where this is called.
 
@@ -280,6 +610,12 @@ class Fixture(gp.MonkObject):
                         based on that.
 
         :param fixture_locations: where to look for fixture files
+
+        :param shard: a tuple (index, count); only every count-th device of
+                      ``use_devs``, starting at index, is used. This way
+                      parallel test processes share a fixture file without
+                      sharing devices. A lease pool (see
+                      :py:mod:`monk_tf.lease`) doesn't need this.
         """
         super(Fixture, self).__init__(
             name=name,
@@ -287,7 +623,12 @@ class Fixture(gp.MonkObject):
         )
         self.call_location = call_location
         self.call_path = op.dirname(op.abspath(self.call_location))
-        self.devs = {}
+        self.devs = DeviceIndex(self._parse_section)
+        self._lazy_sections = {}
+        self.metrics_sink = None
+        self.profiling = None
+        self.lease = None
+        self.shard = shard
         self.ignore_exceptions = []
         self.props = config.ConfigObj()
         self.fixture_locations = fixture_locations or self.default_fixturelocations()
@@ -299,6 +640,37 @@ class Fixture(gp.MonkObject):
         self.log("devs:{}:use_dev:{}".format(self.devs, self.use_devs))
         return self.devs.get(self.use_devs[0])
 
+    @property
+    def metrics(self):
+        """ the combined :py:class:`~monk_tf.metrics.Metrics` of all devices
+        """
+        return mm.Metrics.combine(d.metrics for d in self.devs.loaded().values())
+
+    def metrics_report(self, test=None):
+        """ all metrics of this fixture, per device and connection
+
+        :param test: only report the data of this test
+
+        :return: a dictionary that can be dumped as JSON
+        """
+        def select(data):
+            return {t:v for t,v in data.items() if test is None or t == str(test)}
+        return {
+            "test" : test or gp.find_testname(),
+            "devices" : {
+                dname : {
+                    cname : select(c.metrics.to_dict()) for cname, c in d.conns.items()
+                } for dname, d in self.devs.loaded().items()
+            },
+        }
+
+    def dump_metrics(self, path):
+        """ write :py:meth:`metrics_report` as JSON to a file
+        """
+        self.log("dump metrics to '{}'".format(path))
+        with open(path, "w") as f:
+            json.dump(self.metrics_report(), f, indent=4)
+
     @property
     def parsers(self):
         try:
@@ -315,9 +687,15 @@ class Fixture(gp.MonkObject):
             "conns" : self.parse_conns,
             "SshConnection" : self.parse_sshconn,
             "SerialConnection" : self.parse_serialconn,
+            "SimConnection" : self.parse_simconn,
+            "EchoConnection" : self.parse_simconn,
             "logging" : self.parse_logging,
+            "metrics" : self.parse_metrics,
+            "lease" : self.parse_lease,
+            "profiling" : self.parse_profiling,
             "StreamHandler" : self.parse_streamhandler,
             "FileHandler" : self.parse_filehandler,
+            "CompressedFileHandler" : self.parse_compressedfilehandler,
         }
 
     @parsers.setter
@@ -360,19 +738,101 @@ class Fixture(gp.MonkObject):
         if not self.props:
             raise NoPropsException("have you created and added any fixture files?")
         parsed = {}
+        self._lazy_sections = collections.OrderedDict()
         for name, value in self.props.items():
-            parsed[name] = self._parse_section(name, value)
+            sectype = self._peek_sectype(name, value)
+            if sectype in self.LAZY_SECTYPES:
+                self._lazy_sections[name] = (sectype, value)
+            else:
+                parsed[name] = self._parse_section(name, value)
         self.update(**parsed)
 
     def update(self, **kwargs):
         """ update the externally manageable data of this fixture object
+
+        The entries of ``use_devs`` are selectors for
+        :py:meth:`DeviceIndex.select`, e.g. ``dev1``, ``board-*``,
+        ``tag:rack1``, ``type:Device`` or ``2*tag:arm``. Only the chosen
+        devices are created, when they are used first.
         """
         self.testlogger = kwargs.pop("logging", self._logger)
+        self.metrics_sink = kwargs.pop("metrics", {}).get("sink")
+        self.profiling = kwargs.pop("profiling", None)
+        lease = kwargs.pop("lease", None)
         use_devs = kwargs.pop("use_devs", [])
-        self.use_devs = [use_devs] if isinstance(use_devs, str) else [devname.strip() for devname in use_devs if devname]
-        if not self.use_devs:
+        use_devs = [use_devs] if isinstance(use_devs, str) else [devname.strip() for devname in use_devs if devname]
+        self.devs = DeviceIndex(self._parse_section)
+        for name, (sectype, section) in self._lazy_sections.items():
+            self.devs.add_section(name, sectype, section)
+        for name, obj in kwargs.items():
+            self.devs.add(name, obj)
+        self.use_devs = self.devs.select(use_devs)
+        if self.shard and not (lease and lease.get("pool")):
+            index, count = self.shard
+            self.log("use shard {} of {}".format(index, count))
+            all_devs, self.use_devs = self.use_devs, self.use_devs[index::count]
+            if all_devs and not self.use_devs:
+                raise NoDevsChosenException("shard {} of {} gets none of {}".format(
+                    index, count, all_devs))
+        if not self.use_devs and not (lease and lease.get("pool")):
             raise NoDevsChosenException("You need to set a use_devs property to your config file which contains a list of comma separated device names that are defined in your [[conns]] block")
-        self.devs = {n:d for n,d in kwargs.items()}
+        if lease:
+            self._take_lease(lease)
+
+    def _take_lease(self, lease):
+        """ lock the devices of this fixture against other processes
+
+        :param lease: the parsed ``[lease]`` section, see :py:mod:`monk_tf.lease`
+        """
+        lease = dict(lease)
+        pool = lease.pop("pool", None)
+        count = lease.pop("count", 1)
+        pool = self.devs.select([pool] if isinstance(pool, str) else pool) if pool else None
+        self.lease = ml.Lease(name="lease", **lease)
+        if pool:
+            self.use_devs = self.lease.acquire_any(pool, count,
+                    resources=self._lease_resources)
+        else:
+            self.lease.acquire([r for name in self.use_devs
+                for r in [name] + self._lease_resources(name)])
+        self.log("leased {}".format(list(self.lease.held)))
+
+    def _lease_resources(self, name):
+        """ a device shares its serial ports and ssh hosts with every
+            other device definition that uses them
+        """
+        section = self.devs.section(name)
+        if section is not None:
+            # don't create the devices that only might be leased
+            return self._section_resources(section)
+        resources = []
+        for c in self.devs[name].conns.values():
+            if isinstance(c, ms.SimConn):
+                continue
+            elif isinstance(c, mc.SerialConn):
+                resources.append(c.port)
+            elif isinstance(c, mc.SshConn):
+                resources.append("ssh:{}".format(c.host))
+        return resources
+
+    def _section_resources(self, section):
+        resources = []
+        for cname, conn in section.get("conns", {}).items():
+            ctype = self._peek_sectype(cname, conn)
+            if ctype == "SerialConnection":
+                resources.append(conn["port"])
+            elif ctype == "SshConnection":
+                resources.append("ssh:{}".format(conn["host"]))
+        return resources
+
+    def _peek_sectype(self, name, section):
+        """ like :py:meth:`_find_sectype`, but without changing the section
+
+        :return: the section type or None
+        """
+        if name in self.parsers:
+            return name
+        return section.get("type") if hasattr(section, "get") else None
 
     def _find_sectype(self, name, section):
         """ try to retrieve the section type, preferably by name
@@ -425,6 +885,10 @@ class Fixture(gp.MonkObject):
         section["name"] = name
         return mc.SshConn(**section)
 
+    def parse_simconn(self, name, sectype, section):
+        section["name"] = name
+        return ms.SimConn(**section)
+
     def parse_device(self, name, sectype, section):
         section["name"] = name
         return md.Device(**section)
@@ -433,11 +897,29 @@ class Fixture(gp.MonkObject):
         return {k:v for k,v in section.items()}
 
     def parse_logging(self, name, sectype, section):
-        self.log("register all handlers")
+        """ register the handlers of the logging section
+
+        With ``mode=async`` in the section the handlers don't write on the
+        thread that logs, but in a background thread each.
+        """
+        mode = section.pop("mode", "sync")
+        self.log("register all handlers ({})".format(mode))
         for handler in section.values():
-            handler.register()
+            handler.register(queued=(mode == "async"))
         return self.testlogger
 
+    def parse_metrics(self, name, sectype, section):
+        return dict(section)
+
+    def parse_lease(self, name, sectype, section):
+        return dict(section)
+
+    def parse_profiling(self, name, sectype, section):
+        section["name"] = name
+        if section.get("summary"):
+            section["summary"] = section["summary"] % default_subs()
+        return mp.Profiling(**section)
+
     def parse_streamhandler(self, name, sectype, section):
         section["name"] = name
         return StreamHandler(**section)
@@ -446,6 +928,194 @@ class Fixture(gp.MonkObject):
         section["name"] = name
         return FileHandler(**section)
 
+    def parse_compressedfilehandler(self, name, sectype, section):
+        section["name"] = name
+        return CompressedFileHandler(**section)
+
+    def reboot_all(self, devs=None, timeout=300, **kwargs):
+        """ reboot several devices at once and wait for all of them
+
+        All devices share the same deadline, so this takes about as long as
+        the slowest device needs.
+
+        :param devs: names of the devices to reboot; default is use_devs
+
+        :param timeout: seconds until all devices must be back
+
+        :param kwargs: are handed to :py:meth:`~monk_tf.dev.Device.reboot`
+
+        :return: two dicts: name:seconds of the successful reboots and
+                 name:exception of the failed ones
+        """
+        self.log("reboot_all({},{})".format(devs, timeout))
+        deadline = time.time() + timeout
+        return self._for_all_devs(
+            lambda dev: dev.reboot(timeout=deadline - time.time(), **kwargs),
+            devs,
+        )
+
+    def deploy(self, src_path, trgt_path, devs=None, workers=8, bwlimit=None,
+            compress=True, verify=True, timeout=600):
+        """ copy a file to several devices at once
+
+        The file is compressed only once, then up to ``workers`` devices
+        receive it at the same time, see :py:meth:`~monk_tf.dev.Device.cp`.
+        Afterwards each device unpacks it and compares its checksum. The
+        file is read in blocks, so it doesn't need to fit into memory.
+
+        :param src_path: the path to the file on the host machine
+
+        :param trgt_path: the path of the file on the target devices
+
+        :param devs: names of the devices; default is use_devs
+
+        :param workers: how many transfers run at the same time
+
+        :param bwlimit: the bandwidth in Kbit/s that all transfers on this
+                        host together may use, including those of other
+                        deploy() calls and processes, see
+                        :py:class:`~monk_tf.lease.BandwidthPool`. A
+                        transfer gets its share when it starts: what the
+                        running ones leave, split among the workers that are
+                        about to start. A running transfer keeps its limit,
+                        so the share of a transfer that finishes goes to the
+                        next one that starts, not to those that are still
+                        running.
+
+        :param compress: send the file gzipped, if that makes it smaller;
+                         the devices need ``gzip``
+
+        :param verify: compare the ``sha256sum`` on the devices
+
+        :param timeout: how long a single transfer may take
+
+        :return: a dict of name:report, where each report is a dict with
+                 "ok", "seconds", "bytes" and "error"
+        """
+        devs = devs or self.use_devs
+        self.log("deploy({},{},{})".format(src_path, trgt_path, devs))
+        upload_path, upload_size, tmp_dir = src_path, op.getsize(src_path), None
+        sha = hashlib.sha256()
+        packed = None
+        if compress:
+            tmp_dir = tempfile.mkdtemp(prefix="monk-deploy-")
+            packed = op.join(tmp_dir, op.basename(src_path) + ".gz")
+        with open(src_path, "rb") as f, \
+                (gzip.open(packed, "wb") if packed else open(os.devnull, "wb")) as out:
+            for block in iter(lambda: f.read(self.DEPLOY_BLOCK_SIZE), b""):
+                sha.update(block)
+                out.write(block)
+        checksum = sha.hexdigest()
+        if packed and op.getsize(packed) < upload_size:
+            upload_path, upload_size = packed, op.getsize(packed)
+        workers = max(min(int(workers), len(devs)), 1)
+        lock = threading.Lock()
+        transfers = {"running" : 0, "waiting" : len(devs)}
+        pool = ml.BandwidthPool(bwlimit) if bwlimit else None
+        def take_share():
+            # the share is taken inside the lock, so that the other workers
+            # see it; a finished transfer gives back without the lock
+            with lock:
+                # the transfers that start about now, including this one
+                starting = max(min(workers, transfers["waiting"]) - transfers["running"], 1)
+                taken = pool.take(starting, timeout=timeout)
+                transfers["running"] += 1
+                transfers["waiting"] -= 1
+                return taken
+        def give_back(ticket):
+            pool.give_back(ticket)
+            with lock:
+                transfers["running"] -= 1
+        def deploy_one(dev):
+            start = time.time()
+            target = trgt_path + ".gz" if upload_path != src_path else trgt_path
+            share, ticket = take_share() if pool else (None, None)
+            try:
+                dev.cp(upload_path, target, bwlimit=share, timeout=timeout)
+            finally:
+                if ticket:
+                    give_back(ticket)
+            if target != trgt_path:
+                self._deploy_cmd(dev, "gzip -dc {0} > {1}; rc=$?; rm -f {0}; (exit $rc)".format(
+                    shlex.quote(target), shlex.quote(trgt_path)))
+            if verify:
+                out = self._deploy_cmd(dev, "sha256sum {}".format(shlex.quote(trgt_path)))
+                if out.split()[:1] != [checksum]:
+                    raise DeployFailedException("checksum of '{}' is '{}' instead of '{}'".format(
+                        trgt_path, out, checksum))
+            return time.time() - start
+        try:
+            results, failures = self._for_all_devs(deploy_one, devs, workers=workers)
+        finally:
+            if tmp_dir:
+                shutil.rmtree(tmp_dir, ignore_errors=True)
+        report = {}
+        for name in devs:
+            report[name] = {
+                "ok" : name in results,
+                "seconds" : results.get(name),
+                "bytes" : upload_size,
+                "error" : str(failures[name]) if name in failures else None,
+            }
+        return report
+
+    def update_all(self, image, method, devs=None, workers=None, **kwargs):
+        """ update several devices at once, see
+            :py:meth:`~monk_tf.dev.Device.update`
+
+        :param devs: names of the devices; default is use_devs
+
+        :param workers: how many devices are updated at the same time; by
+                        default all of them
+
+        :return: two dicts: name:phases of the successful updates and
+                 name:exception of the failed ones
+        """
+        self.log("update_all({},{},{})".format(image, method, devs))
+        return self._for_all_devs(
+            lambda dev: dev.update(image, method, **kwargs),
+            devs,
+            workers=workers,
+        )
+
+    def _deploy_cmd(self, dev, cmd):
+        rc, out = dev.cmd(cmd, do_retcode=True, cache=False)
+        if rc != 0:
+            raise DeployFailedException("'{}' failed with {}: {}".format(cmd, rc, out))
+        return out
+
+    def _for_all_devs(self, func, devs=None, workers=None):
+        """ call func(device) for all devices in parallel
+
+        :param workers: how many threads call func; by default one per device
+
+        :return: two dicts: name:result and name:exception
+        """
+        devs = devs or self.use_devs
+        results, failures = {}, {}
+        todo = queue.Queue()
+        for name in devs:
+            todo.put(name)
+        def run():
+            while True:
+                try:
+                    name = todo.get_nowait()
+                except queue.Empty:
+                    return
+                threading.current_thread().name = "monk-{}".format(name)
+                try:
+                    results[name] = func(self.devs[name])
+                except Exception as e:
+                    self._logger.warning("{} failed: {}".format(name, e))
+                    failures[name] = e
+        threads = [threading.Thread(target=run)
+                for _ in range(min(int(workers or len(devs)), len(devs)))]
+        for t in threads:
+            t.start()
+        for t in threads:
+            t.join()
+        return results, failures
+
     def tear_down(self):
         """ Can be used for explicit destruction of managed objects.
 
@@ -453,8 +1123,10 @@ class Fixture(gp.MonkObject):
 
         """
         self.log("teardown")
-        for name, device in self.devs.items():
+        for name, device in self.devs.loaded().items():
             device.close_all()
+        if self.lease:
+            self.lease.release()
 
     def __str__(self):
         if hasattr(self, "devs") and self.devs:
@@ -464,10 +1136,14 @@ class Fixture(gp.MonkObject):
 
     def __enter__(self):
         self.log("__enter__ ")
+        if self.profiling:
+            self.profiling.start()
         return [self, self.firstdev, self.testlogger]
 
     def __exit__(self, exception_type, exception_val, tb):
         self.log("__exit__ ")
+        if self.profiling:
+            self.profiling.stop(default_subs())
         if exception_type and exception_type not in self.ignore_exceptions:
             buff = io.StringIO()
             traceback.print_tb(tb, file=buff)
@@ -477,4 +1153,7 @@ class Fixture(gp.MonkObject):
                 exception_val,
                 buff.getvalue(),
             ))
+        if self.metrics_sink:
+            self.dump_metrics(self.metrics_sink % default_subs())
         self.tear_down()
+        flush_logging()
@@ -15,8 +15,10 @@
 This module contains the base classes and possibly other useful stuff
 """
 
+import sys
+import types
 import logging
-import inspect
+import importlib
 
 class MonkException(Exception):
     """ base class for all monk_tf exceptions
@@ -27,41 +29,50 @@ class MonkObject(object):
     """ base class for all Monkery
 
     mostly handles name setting and the object specific logging
+
+    Creating a MonkObject must be cheap, because a fixture may contain
+    hundreds of them. So the loggers are cached and the logger of the
+    current test is only looked up when it is used.
     """
 
     def __init__(self, name=None, module=None):
         # must be set first, because it is used later on
         self.module = module
         self.name = name
-        self.testlogger = logging.getLogger(find_testname())
-        self.log = self.logger.debug
-        self.log("hi.")
+        self._testlogger = None
 
     @property
     def name(self):
-        try:
-            return self._logger.name
-        except:
-            self.name = None
-            return self._logger.name
+        return self.logger.name
+
+    @name.setter
+    def name(self, name):
+        self._logger = get_logger(self.module, name or self.__class__.__name__)
 
     @property
     def logger(self):
         try:
             return self._logger
         except AttributeError as e:
-            self._logger = logging.getLogger("{}.{}".format(
-                self.module,
-                name or self.__class__.__name__,
-            ))
+            self.name = None
             return self._logger
 
-    @name.setter
-    def name(self, name):
-        self._logger = logging.getLogger("{}.{}".format(
-            self.module,
-            name or self.__class__.__name__,
-        ))
+    @property
+    def testlogger(self):
+        """ the logger of the test that uses this object
+        """
+        if getattr(self, "_testlogger", None) is None:
+            self._testlogger = logging.getLogger(find_testname())
+        return self._testlogger
+
+    @testlogger.setter
+    def testlogger(self, testlogger):
+        self._testlogger = testlogger
+
+    def log(self, msg):
+        """ sends a debug-level message to the object's logger
+        """
+        self.logger.debug(msg)
 
     def testlog(self, msg):
         """ sends a info-level message to the logger
@@ -71,14 +82,69 @@ class MonkObject(object):
         """
         self.testlogger.info(msg)
 
+_LOGGERS = {}
+
+def get_logger(module, name):
+    """ a cached :py:func:`logging.getLogger` for the logger "module.name"
+    """
+    try:
+        return _LOGGERS[module, name]
+    except KeyError:
+        logger = _LOGGERS[module, name] = logging.getLogger("{}.{}".format(
+            module,
+            name,
+        ))
+        return logger
+
 _LOGFINDERS = ["test_", "setup"]
 
 # note that this is a function not a method
 def find_testname(grab_txts=None):
     grab_txts = grab_txts or _LOGFINDERS
+    # walking the frames is much cheaper than inspect.stack(), which also
+    # reads the source code of each frame
+    names = []
+    frame = sys._getframe(1)
+    while frame is not None:
+        names.append(frame.f_code.co_name)
+        frame = frame.f_back
     for txt in grab_txts:
-        for caller in inspect.stack():
-            name = caller[3]
+        for name in names:
             if name.startswith(txt):
                 return name
     return grab_txts[0]
+
+def lazy_import(name):
+    """ import a module only when one of its attributes is used
+
+    Use it instead of an import statement for modules that are expensive to
+    import and not always needed::
+
+        pexpect = gp.lazy_import("pexpect")
+
+    :param name: the full name of the module
+
+    :return: the module, if it's already imported, otherwise a stand-in that
+             imports it on first use
+    """
+    try:
+        return sys.modules[name]
+    except KeyError:
+        return _LazyModule(name)
+
+class _LazyModule(types.ModuleType):
+    """ forwards all attribute lookups to the module of the same name
+
+    The import happens through the normal import machinery and its lock, so
+    it's safe when several threads use the module first at the same time:
+    they all wait until the module is completely initialized.
+    """
+
+    def __getattr__(self, attr):
+        module = self.__dict__.get("_module")
+        if module is None:
+            module = self.__dict__["_module"] = importlib.import_module(self.__name__)
+        return getattr(module, attr)
+
+    def __repr__(self):
+        return "<lazy module '{}'>".format(self.__name__)
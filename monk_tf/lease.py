@@ -0,0 +1,458 @@
+# -*- coding: utf-8 -*-
+#
+# MONK automated test framework
+#
+# Copyright (C) 2015 DResearch Fahrzeugelektronik GmbH
+# Written and maintained by MONK Developers <project-monk@dresearch-fe.de>
+#
+# This program is free software; you can redistribute it and/or
+# modify it under the terms of the GNU General Public License
+# as published by the Free Software Foundation; either version
+# 3 of the License, or (at your option) any later version.
+#
+
+"""
+This module makes sure that only one process at a time works with a
+:term:`target device`, e.g. when several CI jobs on the same machine share
+one fixture file and one device lab.
+
+Every resource, like a device name or a serial port, is represented by a
+lock file. The locks are taken with :py:func:`fcntl.flock`, so the kernel
+releases them when the process ends, even if it crashes. Example::
+
+    import monk_tf.lease as ml
+    with ml.Lease(lock_dir="/var/lock/monk") as lease:
+        lease.acquire(["dev1", "/dev/ttyUSB0"], timeout=600)
+        [...]
+
+A :py:class:`BandwidthPool` shares a bandwidth among the transfers of all
+processes on a machine in a similar way.
+
+In a ``fixture.cfg`` the ``[lease]`` section does the same for the devices
+in ``use_devs``. With a ``pool``, any ``count`` free devices of it are taken
+and become the ``use_devs``::
+
+    [lease]
+        lock_dir=/var/lock/monk
+        timeout=1800
+        pool=dev1,dev2,dev3
+        count=1
+"""
+
+import os
+import re
+import time
+import json
+import fcntl
+import socket
+import threading
+import contextlib
+import collections
+
+import monk_tf.general_purpose as gp
+
+############
+#
+# Exceptions
+#
+############
+
+class ALeaseException(gp.MonkException):
+    """ Base class for exceptions of the lease manager.
+    """
+    pass
+
+class LeaseTimeoutException(ALeaseException):
+    """ is raised when the wanted resources didn't become free in time.
+    """
+    pass
+
+#######
+#
+# Lease
+#
+#######
+
+class Lease(gp.MonkObject):
+    """ holds exclusive locks on a set of resources
+
+    Resources are taken all or nothing: if one of them is busy, none are
+    kept, so two processes that want overlapping sets can't deadlock.
+
+    Requests that have to wait are served in order: a waiting request takes
+    a ticket in the ``queue`` directory of :py:attr:`lock_dir`, and a later
+    request that wants one of the same resources waits behind it, even if
+    its own resources are free. So a request for several devices isn't
+    starved by requests for single ones. The ticket is a locked file, too;
+    the tickets of crashed processes are removed by the next one that
+    looks at the queue.
+    """
+
+    def __init__(self, name=None, lock_dir="/tmp/monk-leases", timeout=600,
+            poll=1.0):
+        """
+        :param lock_dir: where the lock files are; all processes that should
+                         exclude each other must use the same directory
+
+        :param timeout: default seconds to wait for busy resources
+
+        :param poll: seconds between two tries to get busy resources
+        """
+        super(Lease, self).__init__(
+                name=name,
+                module=__name__,
+        )
+        self.lock_dir = lock_dir
+        self.timeout = float(timeout)
+        self.poll = float(poll)
+        self.held = {}
+        # how often each held resource was acquired
+        self.holds = collections.Counter()
+
+    def acquire(self, resources, timeout=None):
+        """ wait until all resources are free and lock them
+
+        A resource this lease holds already is not locked again, but needs
+        one more :py:meth:`release` until it is free.
+
+        :param resources: names of the resources, e.g. device names and
+                          serial ports
+        :param timeout: seconds to wait; the default is :py:attr:`timeout`
+
+        :return: self
+        """
+        self.log("acquire({})".format(resources))
+        self._wait(timeout, lambda: self._try_all(resources),
+                "{} are busy".format(resources), resources)
+        return self
+
+    def acquire_any(self, candidates, count=1, timeout=None, resources=None):
+        """ wait until ``count`` of the candidates are free and lock them
+
+        Candidates that share a resource with a chosen one or with something
+        this lease holds already are not chosen.
+
+        :param candidates: the names to choose from, in order of preference
+
+        :param count: how many are needed
+
+        :param timeout: seconds to wait; the default is :py:attr:`timeout`
+
+        :param resources: a function that returns further resources which
+                          belong to a candidate, e.g. its serial ports
+
+        :return: the chosen candidates
+        """
+        count = int(count)
+        self.log("acquire_any({},{})".format(candidates, count))
+        resources = resources or (lambda candidate: [])
+        if count > len(candidates):
+            raise LeaseTimeoutException("want {} of only {} candidates".format(
+                count, len(candidates)))
+        chosen = []
+        def try_some():
+            for candidate in candidates:
+                if self._try_all([candidate] + list(resources(candidate)),
+                        exclusive=True):
+                    chosen.append(candidate)
+                    if len(chosen) == count:
+                        return True
+            for candidate in chosen:
+                self.release([candidate] + list(resources(candidate)))
+            del chosen[:]
+            return False
+        wanted = list(candidates) + [r for c in candidates for r in resources(c)]
+        self._wait(timeout, try_some, "not {} of {} free".format(count, candidates),
+                wanted)
+        return chosen
+
+    def _wait(self, timeout, attempt, msg, wanted):
+        timeout = self.timeout if timeout is None else float(timeout)
+        end_time = time.time() + timeout
+        tries = 0
+        ticket = None
+        # what this lease holds already must not wait behind others
+        wanted = [r for r in wanted if r not in self.held]
+        try:
+            while self._queued_before(ticket, wanted) or not attempt():
+                tries += 1
+                if time.time() >= end_time:
+                    raise LeaseTimeoutException("{} after {:g}s, held by {}".format(
+                        msg, timeout, self.holders()))
+                if tries == 1:
+                    self._logger.info("waiting: {}".format(msg))
+                    ticket = self._enqueue(wanted)
+                time.sleep(max(min(self.poll, end_time - time.time()), 0))
+        finally:
+            if ticket:
+                self._dequeue(ticket)
+        self.log("acquired after {} retries".format(tries))
+
+    def _enqueue(self, wanted):
+        """ take a ticket, so later requests for the same resources wait
+            behind this one
+
+        :return: the locked ticket file and its path
+        """
+        queue_dir = os.path.join(self.lock_dir, "queue")
+        os.makedirs(queue_dir, exist_ok=True)
+        path = os.path.join(queue_dir, "{:020d}-{}-{}-{}.ticket".format(
+            time.time_ns(), socket.gethostname(), os.getpid(), id(self)))
+        f = open(path + ".new", "w")
+        fcntl.flock(f, fcntl.LOCK_EX)
+        f.write(json.dumps([str(r) for r in wanted]))
+        f.flush()
+        # others only see complete tickets
+        os.rename(path + ".new", path)
+        return f, path
+
+    def _dequeue(self, ticket):
+        f, path = ticket
+        try:
+            os.remove(path)
+        except OSError:
+            pass
+        f.close()
+
+    def _queued_before(self, ticket, wanted):
+        """ :return: whether an earlier waiting request wants one of the
+                     resources
+        """
+        queue_dir = os.path.join(self.lock_dir, "queue")
+        own = os.path.basename(ticket[1]) if ticket else None
+        wanted = set(str(r) for r in wanted)
+        names = sorted(os.listdir(queue_dir)) if os.path.isdir(queue_dir) else []
+        for name in names:
+            if not name.endswith(".ticket"):
+                continue
+            if own is not None and name >= own:
+                break
+            path = os.path.join(queue_dir, name)
+            try:
+                with open(path) as f:
+                    try:
+                        fcntl.flock(f, fcntl.LOCK_SH | fcntl.LOCK_NB)
+                    except (IOError, OSError):
+                        others = json.loads(f.read() or "[]")
+                    else:
+                        # the process that waited is gone
+                        os.remove(path)
+                        continue
+            except (IOError, OSError, ValueError):
+                continue
+            if wanted.intersection(others):
+                return True
+        return False
+
+    def _try_all(self, resources, exclusive=False):
+        """ lock all resources or none of them
+
+        :param exclusive: fail if one of them is held already
+        """
+        resources = list(resources)
+        if exclusive and (any(r in self.held for r in resources)
+                or len(set(resources)) < len(resources)):
+            return False
+        got = []
+        for resource in resources:
+            if resource not in self.held:
+                f = self._try_one(resource)
+                if f is None:
+                    self.release(got)
+                    return False
+                self.held[resource] = f
+            self.holds[resource] += 1
+            got.append(resource)
+        return True
+
+    def _try_one(self, resource):
+        if not os.path.isdir(self.lock_dir):
+            os.makedirs(self.lock_dir, exist_ok=True)
+        f = open(self.path(resource), "a+")
+        try:
+            fcntl.flock(f, fcntl.LOCK_EX | fcntl.LOCK_NB)
+        except (IOError, OSError):
+            f.close()
+            return None
+        # who holds the lock, for the error messages of others
+        f.seek(0)
+        f.truncate()
+        f.write(json.dumps({
+            "resource" : resource,
+            "host" : socket.gethostname(),
+            "pid" : os.getpid(),
+            "test" : str(gp.find_testname()),
+            "since" : time.strftime("%Y-%m-%d %H:%M:%S"),
+        }))
+        f.flush()
+        return f
+
+    def path(self, resource):
+        """ :return: the lock file of a resource
+        """
+        return os.path.join(self.lock_dir,
+                re.sub(r"[^\w.-]", "_", str(resource)) + ".lock")
+
+    def holders(self, resources=None):
+        """ :return: dict of resource:description of the current holder
+        """
+        result = {}
+        for name in os.listdir(self.lock_dir) if os.path.isdir(self.lock_dir) else []:
+            if not name.endswith(".lock"):
+                continue
+            try:
+                with open(os.path.join(self.lock_dir, name)) as f:
+                    try:
+                        fcntl.flock(f, fcntl.LOCK_SH | fcntl.LOCK_NB)
+                        # nobody holds it, the content is from the past
+                        continue
+                    except (IOError, OSError):
+                        holder = json.loads(f.read() or "{}")
+            except (IOError, ValueError):
+                continue
+            resource = holder.get("resource", name)
+            if resource not in self.held and (resources is None or resource in resources):
+                result[resource] = holder
+        return result
+
+    def release(self, resources=None):
+        """ unlock some or all held resources
+
+        :param resources: give back one hold of each of them; a resource is
+                          unlocked when it isn't held anymore. By default
+                          all resources are unlocked.
+        """
+        if resources is None:
+            resources = [r for r in self.held for i in range(self.holds[r])]
+        for resource in list(resources):
+            if resource not in self.held:
+                continue
+            self.holds[resource] -= 1
+            if self.holds[resource] > 0:
+                continue
+            del self.holds[resource]
+            f = self.held.pop(resource)
+            self.log("release {}".format(resource))
+            fcntl.flock(f, fcntl.LOCK_UN)
+            f.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exception_type, exception_val, tb):
+        self.release()
+
+    def __del__(self):
+        if getattr(self, "held", None):
+            self.release()
+
+class BandwidthPool(gp.MonkObject):
+    """ splits a bandwidth among the transfers of all processes on this host
+
+    Every running transfer holds a locked file with its share in
+    :py:attr:`lock_dir`. A new transfer gets what the running ones leave,
+    split among the transfers that start about now, and waits while
+    nothing is left. The share of a crashed process is freed by the next
+    one that looks. Example::
+
+        pool = ml.BandwidthPool(1000)
+        share, ticket = pool.take()
+        try:
+            [...] # send with at most share Kbit/s
+        finally:
+            pool.give_back(ticket)
+    """
+
+    def __init__(self, limit, name=None, lock_dir="/tmp/monk-bandwidth",
+            poll=0.5):
+        """
+        :param limit: the bandwidth in Kbit/s that all transfers together
+                      may use
+
+        :param lock_dir: where the shares are; all processes that share the
+                         bandwidth must use the same directory
+
+        :param poll: seconds between two looks for free bandwidth
+        """
+        super(BandwidthPool, self).__init__(
+                name=name,
+                module=__name__,
+        )
+        self.limit = int(limit)
+        self.lock_dir = lock_dir
+        self.poll = float(poll)
+
+    def take(self, starting=1, timeout=600):
+        """ wait for free bandwidth and take a share of it
+
+        :param starting: how many transfers, including this one, start about
+                         now and will split what is free
+
+        :param timeout: seconds to wait for free bandwidth
+
+        :return: the share in Kbit/s and a ticket for :py:meth:`give_back`
+        """
+        end_time = time.time() + float(timeout)
+        while True:
+            with self._locked():
+                free = self.limit - self.used()
+                if free >= 1:
+                    share = max(free // max(int(starting), 1), 1)
+                    self.log("take {} of {} free Kbit/s".format(share, free))
+                    return share, self._register(share)
+            if time.time() >= end_time:
+                raise LeaseTimeoutException("no bandwidth of {} Kbit/s free after {:g}s".format(
+                    self.limit, float(timeout)))
+            time.sleep(max(min(self.poll, end_time - time.time()), 0))
+
+    def give_back(self, ticket):
+        """ free the share of a finished transfer
+        """
+        f, path = ticket
+        try:
+            os.remove(path)
+        except OSError:
+            pass
+        f.close()
+
+    def used(self):
+        """ :return: the Kbit/s of the running transfers on this host
+        """
+        used = 0
+        names = os.listdir(self.lock_dir) if os.path.isdir(self.lock_dir) else []
+        for name in names:
+            if not name.endswith(".share"):
+                continue
+            path = os.path.join(self.lock_dir, name)
+            try:
+                with open(path) as f:
+                    try:
+                        fcntl.flock(f, fcntl.LOCK_SH | fcntl.LOCK_NB)
+                    except (IOError, OSError):
+                        used += int(f.read() or 0)
+                    else:
+                        # the transfer's process is gone
+                        os.remove(path)
+            except (IOError, OSError, ValueError):
+                continue
+        return used
+
+    @contextlib.contextmanager
+    def _locked(self):
+        """ only one process at a time computes a share
+        """
+        os.makedirs(self.lock_dir, exist_ok=True)
+        with open(os.path.join(self.lock_dir, "pool.lock"), "a") as f:
+            fcntl.flock(f, fcntl.LOCK_EX)
+            yield
+
+    def _register(self, share):
+        path = os.path.join(self.lock_dir, "{}-{}-{}.share".format(
+            os.getpid(), threading.get_ident(), time.time_ns()))
+        f = open(path + ".new", "w")
+        fcntl.flock(f, fcntl.LOCK_EX)
+        f.write(str(share))
+        f.flush()
+        # others only see complete shares
+        os.rename(path + ".new", path)
+        return f, path
@@ -0,0 +1,236 @@
+# -*- coding: utf-8 -*-
+#
+# MONK automated test framework
+#
+# Copyright (C) 2015 DResearch Fahrzeugelektronik GmbH
+# Written and maintained by MONK Developers <project-monk@dresearch-fe.de>
+#
+# This program is free software; you can redistribute it and/or
+# modify it under the terms of the GNU General Public License
+# as published by the Free Software Foundation; either version
+# 3 of the License, or (at your option) any later version.
+#
+
+"""
+This module contains the data structures that collect measurements about
+what MONK is doing, e.g. how long each phase of a
+:py:meth:`~monk_tf.conn.ConnectionBase.cmd` took or how many bytes were sent.
+
+Every connection owns a :py:class:`Metrics` object. Devices and fixtures
+combine the metrics of their connections on request. Example::
+
+    rc, out = dev.cmd("ls -al")
+    hists = dev.metrics.histograms()
+    print(hists["total"].mean, hists["total"].percentile(95))
+    print(dev.metrics.counters()["bytes_in"])
+"""
+
+import threading
+import collections
+
+############
+#
+# Histograms
+#
+############
+
+class Histogram(object):
+    """ a histogram with exponentially growing buckets
+
+    The default buckets are meant for durations in seconds and reach from
+    1ms to a bit more than 2 minutes. Values above the last bound go to an
+    overflow bucket.
+    """
+
+    DEFAULT_BOUNDS = tuple(0.001 * 2**i for i in range(18))
+
+    def __init__(self, bounds=None):
+        """
+        :param bounds: the ascending upper bounds of the buckets
+        """
+        self.bounds = tuple(bounds or self.DEFAULT_BOUNDS)
+        self.buckets = [0] * (len(self.bounds) + 1)
+        self.count = 0
+        self.total = 0.0
+        self.min = None
+        self.max = None
+
+    def add(self, value):
+        """ add a single observation
+        """
+        for i, bound in enumerate(self.bounds):
+            if value <= bound:
+                break
+        else:
+            i = len(self.bounds)
+        self.buckets[i] += 1
+        self.count += 1
+        self.total += value
+        self.min = value if self.min is None else min(self.min, value)
+        self.max = value if self.max is None else max(self.max, value)
+
+    def merge(self, other):
+        """ add all observations of another histogram with the same bounds
+
+        :return: self
+        """
+        if other.bounds != self.bounds:
+            raise ValueError("can't merge histograms with different bounds")
+        self.buckets = [a + b for a, b in zip(self.buckets, other.buckets)]
+        self.count += other.count
+        self.total += other.total
+        for value in (other.min, other.max):
+            if value is not None:
+                self.min = value if self.min is None else min(self.min, value)
+                self.max = value if self.max is None else max(self.max, value)
+        return self
+
+    @property
+    def mean(self):
+        return self.total / self.count if self.count else None
+
+    def percentile(self, p):
+        """ estimate the p-th percentile
+
+        :param p: a number between 0 and 100
+
+        :return: the upper bound of the bucket that contains the percentile,
+                 but never more than the biggest observed value
+        """
+        if not self.count:
+            return None
+        wanted = self.count * p / 100.0
+        seen = 0
+        for i, n in enumerate(self.buckets):
+            seen += n
+            if n and seen >= wanted:
+                bound = self.bounds[i] if i < len(self.bounds) else self.max
+                return min(bound, self.max)
+        return self.max
+
+    def to_dict(self):
+        return {
+            "count" : self.count,
+            "total" : self.total,
+            "min" : self.min,
+            "max" : self.max,
+            "mean" : self.mean,
+            "p50" : self.percentile(50),
+            "p95" : self.percentile(95),
+            "bounds" : list(self.bounds),
+            "buckets" : list(self.buckets),
+        }
+
+    def __str__(self):
+        return "{}(count={},mean={},max={})".format(
+                self.__class__.__name__,
+                self.count,
+                self.mean,
+                self.max,
+        )
+
+#########
+#
+# Metrics
+#
+#########
+
+class Metrics(object):
+    """ histograms and counters, grouped by the test that produced them
+    """
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._tests = collections.OrderedDict()
+
+    def _entry(self, test):
+        try:
+            return self._tests[test]
+        except KeyError:
+            entry = self._tests[test] = ({}, collections.Counter())
+            return entry
+
+    def observe(self, name, value, test=None, bounds=None):
+        """ add a value to the histogram with the given name
+
+        :param name: e.g. the phase of a command like "connect" or "parse"
+        :param value: the measured value, usually a duration in seconds
+        :param test: the name of the test that is currently running
+        :param bounds: bucket bounds, if the histogram doesn't exist yet
+        """
+        with self._lock:
+            hists, _ = self._entry(test)
+            if name not in hists:
+                hists[name] = Histogram(bounds)
+            hists[name].add(value)
+
+    def count(self, name, n=1, test=None):
+        """ increase the counter with the given name
+        """
+        with self._lock:
+            self._entry(test)[1][name] += n
+
+    def tests(self):
+        """ the names of all tests that produced data
+        """
+        return list(self._tests.keys())
+
+    def histograms(self, test=None):
+        """ :return: a dict of name:Histogram, either of one test or
+                     combined over all of them
+        """
+        result = {}
+        with self._lock:
+            for t, (hists, _) in self._tests.items():
+                if test is not None and t != test:
+                    continue
+                for name, hist in hists.items():
+                    result.setdefault(name, Histogram(hist.bounds)).merge(hist)
+        return result
+
+    def counters(self, test=None):
+        """ :return: a dict of name:int, either of one test or combined over
+                     all of them
+        """
+        result = collections.Counter()
+        with self._lock:
+            for t, (_, counts) in self._tests.items():
+                if test is None or t == test:
+                    result.update(counts)
+        return dict(result)
+
+    def merge(self, other):
+        """ add all data of another Metrics object
+
+        :return: self
+        """
+        for test, (hists, counts) in list(other._tests.items()):
+            with self._lock:
+                own_hists, own_counts = self._entry(test)
+                for name, hist in hists.items():
+                    own_hists.setdefault(name, Histogram(hist.bounds)).merge(hist)
+                own_counts.update(counts)
+        return self
+
+    @classmethod
+    def combine(cls, all_metrics):
+        """ create a new Metrics object that contains the data of all given
+            Metrics objects.
+        """
+        result = cls()
+        for m in all_metrics:
+            result.merge(m)
+        return result
+
+    def reset(self):
+        with self._lock:
+            self._tests.clear()
+
+    def to_dict(self):
+        with self._lock:
+            return {
+                str(test) : {
+                    "histograms" : {n:h.to_dict() for n, h in hists.items()},
+                    "counters" : dict(counts),
+                } for test, (hists, counts) in self._tests.items()
+            }
@@ -0,0 +1,329 @@
+# -*- coding: utf-8 -*-
+#
+# MONK automated test framework
+#
+# Copyright (C) 2015 DResearch Fahrzeugelektronik GmbH
+# Written and maintained by MONK Developers <project-monk@dresearch-fe.de>
+#
+# This program is free software; you can redistribute it and/or
+# modify it under the terms of the GNU General Public License
+# as published by the Free Software Foundation; either version
+# 3 of the License, or (at your option) any later version.
+#
+
+"""
+This module implements the profiling hooks that can be switched on in a
+``fixture.cfg``. They show how much time the host side Python code needs,
+compared to the time spent waiting for the :term:`target device`.
+
+Add a ``[profiling]`` section to your fixture file and every
+``with Fixture(...)`` block is profiled::
+
+    [profiling]
+        profiler=cprofile
+        sink=%(testcase)s-%(datetime)s.prof
+        summary=%(suitename)s-profile.txt
+
+``profiler`` is either ``cprofile`` (exact, but slows everything down) or
+``sampling`` (looks at the call stack every ``interval`` seconds, nearly no
+overhead). cProfile files can be read with :py:mod:`pstats`; the sampling
+profiler writes folded stacks that can be fed to the usual flame graph tools.
+
+``summary`` is written when the interpreter exits and contains the hottest
+``monk_tf`` functions of all profiled tests.
+"""
+
+import os
+import abc
+import sys
+import time
+import atexit
+import pstats
+import cProfile
+import threading
+import collections
+
+import monk_tf.general_purpose as gp
+
+_PACKAGE_DIR = os.path.dirname(os.path.abspath(__file__))
+
+############
+#
+# Exceptions
+#
+############
+
+class AProfilingException(gp.MonkException):
+    """ Base class for exceptions of the profiling hooks.
+    """
+    pass
+
+class UnknownProfilerException(AProfilingException):
+    """ is raised when a profiler type is requested that doesn't exist
+    """
+    pass
+
+###########
+#
+# Profilers
+#
+###########
+
+class AProfiler(gp.MonkObject, metaclass=abc.ABCMeta):
+    """ base class for profilers; don't instantiate this class directly.
+
+    Extending this class requires to implement start(), stop(), write() and
+    functions().
+    """
+
+    def __init__(self, name=None):
+        super(AProfiler, self).__init__(
+                name=name,
+                module=__name__,
+        )
+
+    @abc.abstractmethod
+    def start(self):
+        pass
+
+    @abc.abstractmethod
+    def stop(self):
+        pass
+
+    @abc.abstractmethod
+    def write(self, path):
+        pass
+
+    @abc.abstractmethod
+    def functions(self):
+        """ :return: dict of (file, line, function):(calls, own, cumulative),
+                     the times in seconds
+        """
+        pass
+
+
+class CProfiler(AProfiler):
+    """ deterministic profiling with :py:mod:`cProfile`
+    """
+
+    def start(self):
+        self.log("start cProfile")
+        self.profile = cProfile.Profile()
+        self.profile.enable()
+
+    def stop(self):
+        self.log("stop cProfile")
+        self.profile.disable()
+
+    def write(self, path):
+        self.log("write profile to '{}'".format(path))
+        self.profile.dump_stats(path)
+
+    def functions(self):
+        return {
+            func : (nc, tt, ct)
+            for func, (cc, nc, tt, ct, callers) in pstats.Stats(self.profile).stats.items()
+        }
+
+
+class SamplingProfiler(AProfiler):
+    """ a statistical profiler that samples the profiled thread's stack
+
+    The written stacks count samples; :py:meth:`functions` estimates seconds
+    by multiplying them with the interval. Calls are not counted.
+    """
+
+    def __init__(self, name=None, interval=0.005):
+        super(SamplingProfiler, self).__init__(name=name)
+        self.interval = float(interval)
+        self.stacks = collections.Counter()
+        self._running = False
+
+    def start(self):
+        self.log("start sampling every {}s".format(self.interval))
+        self._target = threading.current_thread().ident
+        self._running = True
+        self._thread = threading.Thread(
+                target=self._sample,
+                name="monk-sampling-profiler",
+        )
+        self._thread.daemon = True
+        self._thread.start()
+
+    def stop(self):
+        self.log("stop sampling")
+        self._running = False
+        self._thread.join()
+
+    def _sample(self):
+        while self._running:
+            frame = sys._current_frames().get(self._target)
+            stack = []
+            while frame is not None:
+                code = frame.f_code
+                stack.append((code.co_filename, code.co_firstlineno, code.co_name))
+                frame = frame.f_back
+            if stack:
+                self.stacks[tuple(reversed(stack))] += 1
+            time.sleep(self.interval)
+
+    def write(self, path):
+        """ write the samples as folded stacks, one stack per line
+        """
+        self.log("write samples to '{}'".format(path))
+        with open(path, "w") as f:
+            for stack, n in self.stacks.most_common():
+                f.write("{} {}\n".format(
+                    ";".join("{}:{}".format(short_path(fn), func) for fn, line, func in stack),
+                    n,
+                ))
+
+    def functions(self):
+        result = {}
+        for stack, n in self.stacks.items():
+            seconds = n * self.interval
+            for i, func in enumerate(stack):
+                calls, own, cumulative = result.get(func, (0, 0, 0))
+                result[func] = (
+                    calls,
+                    own + (seconds if i == len(stack) - 1 else 0),
+                    # recursion must not count twice
+                    cumulative + (seconds if func not in stack[i+1:] else 0),
+                )
+        return result
+
+
+PROFILERS = {
+    "cprofile" : CProfiler,
+    "sampling" : SamplingProfiler,
+}
+
+##############
+#
+# Fixture hook
+#
+##############
+
+class Profiling(gp.MonkObject):
+    """ the object behind a ``[profiling]`` section of a fixture file
+
+    :py:class:`~monk_tf.fixture.Fixture` calls :py:meth:`start` when entering
+    and :py:meth:`stop` when leaving its context.
+    """
+
+    def __init__(self, name=None, profiler="cprofile", sink=None,
+            summary=None, interval=0.005, limit=30):
+        """
+        :param profiler: either "cprofile" or "sampling"
+
+        :param sink: where to write the profile of each test; accepts the
+                     same substitutions as the log handlers
+
+        :param summary: where to write the summary of the hottest
+                        ``monk_tf`` functions when the interpreter exits;
+                        substitutions must already be applied
+
+        :param interval: seconds between two samples of the sampling profiler
+
+        :param limit: how many functions the summary should show
+        """
+        super(Profiling, self).__init__(
+                name=name,
+                module=__name__,
+        )
+        if profiler not in PROFILERS:
+            raise UnknownProfilerException("'{}' is none of {}".format(
+                profiler,
+                list(PROFILERS.keys()),
+            ))
+        self.profiler_type = profiler
+        self.sink = sink
+        self.interval = interval
+        self.profiler = None
+        if summary:
+            SUITE_SUMMARY.write_at_exit(summary, int(limit))
+
+    def start(self):
+        if self.profiler_type == "sampling":
+            self.profiler = SamplingProfiler(interval=self.interval)
+        else:
+            self.profiler = CProfiler()
+        self.profiler.start()
+
+    def stop(self, subs):
+        """ stop profiling, write the profile and add it to the summary
+
+        :param subs: the substitutions for the sink path
+        """
+        if not self.profiler:
+            return
+        self.profiler.stop()
+        if self.sink:
+            self.profiler.write(self.sink % subs)
+        SUITE_SUMMARY.add(self.profiler)
+        self.profiler = None
+
+#########
+#
+# Summary
+#
+#########
+
+class Summary(object):
+    """ collects the function statistics of all profiled tests
+    """
+
+    def __init__(self):
+        self.functions = {}
+        self.profiles = 0
+        self._sinks = {}
+
+    def add(self, profiler):
+        self.profiles += 1
+        for func, values in profiler.functions().items():
+            old = self.functions.get(func, (0, 0, 0))
+            self.functions[func] = tuple(a + b for a, b in zip(old, values))
+
+    def hottest(self, limit=30, only_monk=True):
+        """ :return: list of (file, line, function, calls, own, cumulative)
+                     sorted by the time spent in the function itself
+        """
+        rows = [
+            func + values for func, values in self.functions.items()
+            if not only_monk or func[0].startswith(_PACKAGE_DIR)
+        ]
+        rows.sort(key=lambda row: (row[4], row[5]), reverse=True)
+        return rows[:limit]
+
+    def format(self, limit=30):
+        lines = ["hottest monk_tf functions in {} profiled tests".format(self.profiles),
+                 "{:>10} {:>12} {:>12}  function".format("calls", "own[s]", "cumulative[s]")]
+        for fn, line, func, calls, own, cumulative in self.hottest(limit):
+            lines.append("{:>10} {:>12.6g} {:>12.6g}  {}:{}({})".format(
+                calls, own, cumulative, short_path(fn), line, func))
+        return "\n".join(lines) + "\n"
+
+    def write_at_exit(self, path, limit=30):
+        if not self._sinks:
+            atexit.register(self._write_all)
+        self._sinks[path] = limit
+
+    def _write_all(self):
+        for path, limit in self._sinks.items():
+            with open(path, "w") as f:
+                f.write(self.format(limit))
+
+SUITE_SUMMARY = Summary()
+
+#########
+#
+# Helpers
+#
+#########
+
+def short_path(path):
+    """ shorten paths inside of monk_tf for better readability
+    """
+    if path.startswith(_PACKAGE_DIR):
+        return "monk_tf" + path[len(_PACKAGE_DIR):]
+    return path
@@ -0,0 +1,113 @@
+# -*- coding: utf-8 -*-
+#
+# MONK automated test framework
+#
+# Copyright (C) 2015 DResearch Fahrzeugelektronik GmbH
+# Written and maintained by MONK Developers <project-monk@dresearch-fe.de>
+#
+# This program is free software; you can redistribute it and/or
+# modify it under the terms of the GNU General Public License
+# as published by the Free Software Foundation; either version
+# 3 of the License, or (at your option) any later version.
+#
+
+"""
+This module is a plugin for `pytest <https://pytest.org>`_. It is registered
+when ``monk_tf`` is installed and offers the objects of a ``fixture.cfg`` as
+pytest fixtures, so a test doesn't need its own ``with Fixture(...)``
+block::
+
+    def test_hello(monk_dev):
+        rc, out = monk_dev.cmd("echo hello")
+        assert out == "hello"
+
+The fixtures are:
+
+``monk_fixture``
+    the :py:class:`~monk_tf.fixture.Fixture`; it is entered before the
+    first test that uses it and left after the last one, which tears down
+    the connections and writes metrics and profiles
+
+``monk_dev``
+    the first device of the fixture
+
+``monk_devs``
+    all devices the fixture uses, as a list
+
+The command line options are:
+
+``--monk-fixture``
+    the fixture file; also settable as ``monk_fixture`` in the ini file.
+    By default ``fixture.cfg`` in pytest's root directory.
+
+``--monk-scope``
+    ``session`` (default), ``module`` or ``function``; how long a fixture
+    and its connections live
+
+With `pytest-xdist <https://pypi.python.org/pypi/pytest-xdist>`_ each
+worker uses its own share of the devices in ``use_devs``: worker ``gw0``
+the 1st, n+1st, ... device, ``gw1`` the 2nd, n+2nd, ... device, and so on.
+So ``pytest -n 4`` needs at least 4 devices in ``use_devs``. Alternatively
+a ``[lease]`` section with a ``pool`` (see :py:mod:`monk_tf.lease`) lets the
+workers pick free devices themselves.
+"""
+
+import os
+
+import pytest
+
+import monk_tf.fixture as mf
+
+SCOPES = ("session", "module", "function")
+
+def pytest_addoption(parser):
+    group = parser.getgroup("monk", "MONK test fixtures")
+    group.addoption("--monk-fixture", dest="monk_fixture", default=None,
+            help="the fixture file (default: fixture.cfg in the rootdir)")
+    group.addoption("--monk-scope", dest="monk_scope", default="session",
+            choices=SCOPES,
+            help="how long a fixture and its connections live")
+    parser.addini("monk_fixture", "the fixture file for monk_tf")
+
+def _scope(fixture_name, config):
+    return config.getoption("monk_scope")
+
+def fixture_path(config):
+    """ :return: the fixture file given on the command line, in the ini file
+                 or the default
+    """
+    path = config.getoption("monk_fixture") or config.getini("monk_fixture")
+    if path:
+        return os.path.join(str(config.rootpath), os.path.expanduser(path))
+    return os.path.join(str(config.rootpath), "fixture.cfg")
+
+def worker_shard():
+    """ the part of the devices this process should use
+
+    :return: a tuple (index, count) for
+             :py:class:`~monk_tf.fixture.Fixture` or None if this is no
+             pytest-xdist worker
+    """
+    worker = os.environ.get("PYTEST_XDIST_WORKER")
+    count = int(os.environ.get("PYTEST_XDIST_WORKER_COUNT", 1))
+    if not worker or count < 2:
+        return None
+    return (int(worker.lstrip("gw")), count)
+
+@pytest.fixture(scope=_scope)
+def monk_fixture(request):
+    path = fixture_path(request.config)
+    fixture = mf.Fixture(path, fixture_locations=[path], shard=worker_shard())
+    fixture.__enter__()
+    try:
+        yield fixture
+    finally:
+        fixture.__exit__(None, None, None)
+
+@pytest.fixture(scope=_scope)
+def monk_dev(monk_fixture):
+    return monk_fixture.firstdev
+
+@pytest.fixture(scope=_scope)
+def monk_devs(monk_fixture):
+    return [monk_fixture.devs[name] for name in monk_fixture.use_devs]
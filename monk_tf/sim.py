@@ -0,0 +1,614 @@
+# -*- coding: utf-8 -*-
+#
+# MONK automated test framework
+#
+# Copyright (C) 2015 DResearch Fahrzeugelektronik GmbH
+# Written and maintained by MONK Developers <project-monk@dresearch-fe.de>
+#
+# This program is free software; you can redistribute it and/or
+# modify it under the terms of the GNU General Public License
+# as published by the Free Software Foundation; either version
+# 3 of the License, or (at your option) any later version.
+#
+
+"""
+This module implements a local :term:`target device` simulator. It opens a
+pseudo terminal that behaves like the serial console of a board: it boots,
+asks for a login, shows a prompt and executes shell commands on the host.
+On the way back it can inject the faults you would expect from real hardware,
+like per byte latency, a slow baud rate, dropped or garbled bytes and random
+disconnects.
+
+This makes it possible to exercise the connect, retry and reconnect paths of
+:py:mod:`monk_tf.conn` on any Linux box. Example::
+
+    import monk_tf.sim as ms
+    import monk_tf.conn as mc
+    sim = ms.Simulator(name="sim1", user="root", pw="secret", baud=9600,
+                       drop_rate=0.001)
+    sim.start()
+    serial = mc.SerialConn(name="ser1", port=sim.port, user="root", pw="secret")
+    print(serial.cmd("uname -a"))
+    [...]
+    sim.stop()
+
+In a ``fixture.cfg`` a simulated serial connection looks like this::
+
+    [dev1]
+        type=Device
+        use_conns=serial1
+        [[conns]]
+            [[[serial1]]]
+                type=SimConnection
+                user=root
+                pw=secret
+                boot_delay=2
+                byte_latency=0.0005
+
+The simulator only offers the serial side. For ssh there is no server
+implementation in the standard library, so point a
+:py:class:`~monk_tf.conn.SshConn` at a local sshd if you need one.
+"""
+
+import os
+import re
+import pty
+import tty
+import time
+import random
+import inspect
+import signal
+import select
+import threading
+import subprocess
+
+import monk_tf.general_purpose as gp
+import monk_tf.conn as mc
+
+############
+#
+# Exceptions
+#
+############
+
+class ASimException(gp.MonkException):
+    """ Base class for exceptions of the simulator.
+    """
+    pass
+
+class SimNotRunningException(ASimException):
+    """ is raised when the simulator is asked for something that requires it
+        to be started first.
+    """
+    pass
+
+###########
+#
+# Simulator
+#
+###########
+
+class Simulator(gp.MonkObject):
+    """ simulates the serial console of a :term:`target device` on a pty.
+
+    The simulator runs in its own thread. Everything that is sent to
+    :py:attr:`port` is interpreted like a serial getty followed by a shell
+    would do it. Shell commands are executed with ``/bin/sh`` on the host.
+
+    All fault rates are probabilities between 0 and 1. Drop and garble rates
+    are applied per byte, the disconnect rate per command.
+    """
+
+    BOOT_MESSAGES = [
+        "U-Boot SPL (simulated)",
+        "Starting kernel ...",
+        "[    0.000000] Booting Linux on physical CPU 0x0",
+        "[    1.234567] Freeing unused kernel memory",
+        "Starting system message bus: done",
+    ]
+
+    # a command that ends with a here-document waits for more lines
+    HEREDOC = re.compile(r"<<-?\s*['\"]?(\w+)['\"]?$")
+
+    # only commands with these might be continued on the next line
+    OPENERS = re.compile(r"[{(\"'\\|&]|\b(if|then|else|do|case|while|until|for)\b")
+
+    # the continuation prompt of the shell
+    PS2 = "> "
+
+    # separates a command's output from the shell state after it
+    STATE_MARK = b"\0<sim-state>\0"
+
+    def __init__(self, name=None, user="root", pw="root",
+            prompt="root@monk-sim:~# ",
+            login_prompt="login: ",
+            pw_prompt="Password: ",
+            motd="Welcome to the MONK target simulator",
+            boot_delay=0,
+            byte_latency=0,
+            baud=0,
+            drop_rate=0,
+            garble_rate=0,
+            disconnect_rate=0,
+            disconnect_time=0,
+            rx_buffer=0,
+            cwd=None,
+            seed=None,
+        ):
+        """
+        :param name: the name of the simulator and its logger
+
+        :param user: the user name that is accepted at the login; if it is
+                     empty, the simulator starts directly with a shell
+
+        :param pw: the password that is accepted at the login; if it is empty
+                   no password is asked for
+
+        :param prompt: the shell prompt that is shown after every command
+
+        :param login_prompt: the string asking for the user name
+
+        :param pw_prompt: the string asking for the password
+
+        :param motd: message shown after a successful login
+
+        :param boot_delay: how many seconds the simulated device stays silent
+                           after start or reboot before it shows the login
+
+        :param byte_latency: additional seconds of delay per sent byte
+
+        :param baud: simulated line speed; 0 means unlimited
+
+        :param drop_rate: probability that a byte is lost on its way back
+
+        :param garble_rate: probability that a byte is replaced by garbage
+
+        :param disconnect_rate: probability that a command leads to a lost
+                                session instead of its output
+
+        :param disconnect_time: how many seconds the device stays silent
+                                after a disconnect
+
+        :param rx_buffer: how many bytes the simulated tty takes in one go;
+                          the rest of a bigger burst is lost like in an
+                          overrun input buffer. 0 means unlimited.
+
+        :param cwd: the working directory a shell session starts in
+
+        :param seed: seed for the fault generator to get reproducible runs
+        """
+        super(Simulator, self).__init__(
+                name=name,
+                module=__name__,
+        )
+        self.user = user
+        self.pw = pw
+        self.prompt = prompt
+        self.login_prompt = login_prompt
+        self.pw_prompt = pw_prompt
+        self.motd = motd
+        self.boot_delay = float(boot_delay)
+        self.byte_latency = float(byte_latency)
+        self.baud = int(baud)
+        self.drop_rate = float(drop_rate)
+        self.garble_rate = float(garble_rate)
+        self.disconnect_rate = float(disconnect_rate)
+        self.disconnect_time = float(disconnect_time)
+        self.rx_buffer = int(rx_buffer)
+        self.home = cwd
+        self.random = random.Random(seed)
+        self.echo = True
+        self.stats = {
+            "boots" : 0,
+            "logins" : 0,
+            "commands" : 0,
+            "bytes_in" : 0,
+            "bytes_out" : 0,
+            "dropped" : 0,
+            "garbled" : 0,
+            "disconnects" : 0,
+            "overruns" : 0,
+        }
+        self._master = None
+        self._slave = None
+        self._thread = None
+        self._running = False
+        self._state = "off"
+        self._silent_until = 0
+        self._job = None
+        self._new_session()
+
+    @property
+    def port(self):
+        """ the device file of the pty; use it like a serial port
+        """
+        if not self._slave:
+            raise SimNotRunningException("start() the simulator first")
+        return os.ttyname(self._slave)
+
+    @property
+    def running(self):
+        return self._running
+
+    def start(self):
+        """ open the pty and boot the simulated device
+
+        :return: self
+        """
+        self.log("start()")
+        if self._running:
+            return self
+        self._master, self._slave = pty.openpty()
+        # no line discipline, we want to see every byte like a real UART
+        tty.setraw(self._slave)
+        self._running = True
+        self._boot()
+        self._thread = threading.Thread(
+                target=self._run,
+                name="monk-sim-{}".format(self.name),
+        )
+        self._thread.daemon = True
+        self._thread.start()
+        return self
+
+    def stop(self):
+        """ shut the simulated device down and close the pty
+        """
+        self.log("stop()")
+        self._running = False
+        if self._thread:
+            self._thread.join(2)
+            self._thread = None
+        self._kill_job()
+        for fd in (self._master, self._slave):
+            if fd:
+                try:
+                    os.close(fd)
+                except OSError:
+                    pass
+        self._master = self._slave = None
+        self._state = "off"
+
+    def reboot(self):
+        """ simulate a reboot: the current session is lost and the device
+            boots again, including the configured boot delay.
+        """
+        self.log("reboot()")
+        self._boot()
+
+    def disconnect(self, silent_for=None):
+        """ simulate a lost session
+
+        The shell is gone and the device shows a fresh login after
+        ``silent_for`` seconds.
+        """
+        self.log("disconnect()")
+        self.stats["disconnects"] += 1
+        self._silence(self.disconnect_time if silent_for is None else silent_for)
+        self._state = "user" if self.user else "shell"
+        self._new_session()
+        self._pending_login = True
+
+    def _boot(self):
+        self.stats["boots"] += 1
+        self.echo = True
+        self._state = "booting"
+        self._new_session()
+        self._boot_done = time.time() + self.boot_delay
+        self._pending_login = True
+
+    def _new_session(self):
+        """ forget everything the last shell session changed
+        """
+        self._kill_job()
+        self.cwd = self.home
+        self.env = None
+        self._heredoc = None
+
+    def _silence(self, seconds):
+        self._silent_until = max(self._silent_until, time.time() + seconds)
+
+    def _run(self):
+        buf = b""
+        while self._running:
+            job = self._job
+            try:
+                readable, _, _ = select.select(
+                        [self._master] + ([job.stdout] if job else []), [], [], 0.05)
+            except (OSError, ValueError):
+                break
+            if job and job.stdout in readable:
+                self._job_output()
+            now = time.time()
+            if self._state == "booting" and now >= self._boot_done:
+                self._write("\r\n".join(self.BOOT_MESSAGES) + "\r\n", faults=False)
+                self._state = "user" if self.user else "shell"
+            if self._pending_login and self._state != "booting" and now >= self._silent_until:
+                self._pending_login = False
+                # like a getty; a shell without login waits for an enter
+                if self._state == "user":
+                    self._show_prompt()
+            if self._master in readable:
+                try:
+                    data = os.read(self._master, 4096)
+                except OSError:
+                    break
+                self.stats["bytes_in"] += len(data)
+                if self._state == "booting" or now < self._silent_until:
+                    # a booting or disconnected device doesn't listen
+                    continue
+                if self.rx_buffer and len(data) > self.rx_buffer:
+                    self.stats["overruns"] += len(data) - self.rx_buffer
+                    data = data[:self.rx_buffer]
+                if self._job and b"\x03" in data:
+                    # Ctrl-C; what was typed before it is gone, too
+                    self._kill_job(signal.SIGINT)
+                    self._write("^C\r\n")
+                    data = data.rsplit(b"\x03", 1)[1]
+                buf += data
+            # a running command gets its input first, the shell reads the
+            # lines after it
+            while not self._job:
+                match = re.search(b"\r\n|\r|\n", buf)
+                if not match:
+                    break
+                line, buf = buf[:match.start()], buf[match.end():]
+                self._handle_line(line.decode("utf-8", "replace"))
+
+    def _show_prompt(self):
+        if self._state == "user":
+            self._write("\r\n" + self.login_prompt)
+        elif self._state == "pw":
+            self._write(self.pw_prompt)
+        else:
+            self._write(self.prompt)
+
+    def _handle_line(self, line):
+        if self._state == "user":
+            self._write(line + "\r\n")
+            if not line.strip():
+                # like getty, just ask again
+                self._show_prompt()
+                return
+            self._login_user = line
+            if self.pw:
+                self._state = "pw"
+                self._show_prompt()
+            else:
+                self._login()
+        elif self._state == "pw":
+            self._write("\r\n")
+            if self._login_user == self.user and line == self.pw:
+                self._login()
+            else:
+                self._write("Login incorrect\r\n")
+                self._state = "user"
+                self._show_prompt()
+        elif self._state == "shell":
+            if self.echo:
+                self._write(line + "\r\n")
+            if self._heredoc:
+                self._continue_heredoc(line)
+            else:
+                self._execute(line)
+
+    def _login(self):
+        self.stats["logins"] += 1
+        self._state = "shell"
+        if self.motd:
+            self._write(self.motd + "\r\n")
+        self._show_prompt()
+
+    def _execute(self, line):
+        self.stats["commands"] += 1
+        stripped = line.strip()
+        if self.disconnect_rate and self.random.random() < self.disconnect_rate:
+            self.disconnect()
+            return
+        if stripped in ("stty -echo", "stty echo"):
+            self.echo = stripped == "stty echo"
+        elif re.match(r"reboot( -f)?\s*($|;|&&|\|\|)", stripped):
+            self._write("The system is going down for reboot NOW!\r\n")
+            self.reboot()
+            return
+        elif stripped in ("exit", "logout"):
+            self._state = "user" if self.user else "shell"
+            self._new_session()
+            self._show_prompt()
+            return
+        elif re.search(self.HEREDOC, stripped):
+            # the shell needs more lines before it can run the command
+            self._heredoc = (re.search(self.HEREDOC, stripped).group(1), [line])
+            self._write(self.PS2)
+            return
+        elif self._incomplete(stripped):
+            # like an open { ... } group
+            self._heredoc = (None, [line])
+            self._write(self.PS2)
+            return
+        elif stripped:
+            self._start_job(stripped)
+            return
+        self._show_prompt()
+
+    def _continue_heredoc(self, line):
+        delimiter, lines = self._heredoc
+        lines.append(line)
+        if delimiter is None:
+            done = not self._incomplete("\n".join(lines))
+        else:
+            done = line == delimiter
+        if not done:
+            self._write(self.PS2)
+            return
+        self._heredoc = None
+        self._start_job("\n".join(lines))
+
+    def _incomplete(self, cmd):
+        """ :return: whether the shell needs more lines to run cmd
+        """
+        if not self.OPENERS.search(cmd):
+            return False
+        check = subprocess.run(["/bin/sh", "-n", "-c", cmd],
+                stdin=subprocess.DEVNULL,
+                stdout=subprocess.DEVNULL,
+                stderr=subprocess.PIPE,
+        )
+        return check.returncode != 0 and bool(
+                re.search(rb"end of file|EOF|Unterminated", check.stderr))
+
+    def _start_job(self, cmd):
+        """ run a command on the host; its output is streamed to the console
+            while it runs and the prompt follows when it's done
+        """
+        # like in a real session, cd and export last beyond the command
+        trailer = '\n__rc=$?; printf "{}"; pwd; env -0; exit $__rc'.format(
+                self.STATE_MARK.decode().replace("\0", "\\0"))
+        try:
+            self._job = subprocess.Popen(
+                    ["/bin/sh", "-c", cmd + trailer],
+                    stdin=subprocess.DEVNULL,
+                    stdout=subprocess.PIPE,
+                    stderr=subprocess.STDOUT,
+                    cwd=self.cwd,
+                    env=self.env,
+                    # for Ctrl-C to the whole pipeline
+                    start_new_session=True,
+            )
+        except OSError as e:
+            self._write("sh: {}\r\n".format(e))
+            self._show_prompt()
+            return
+        self._job_out = b""
+        self._job_state = None
+
+    def _job_output(self):
+        job = self._job
+        data = os.read(job.stdout.fileno(), 4096)
+        if self._job_state is not None:
+            self._job_state += data
+        else:
+            out, mark, state = (self._job_out + data).partition(self.STATE_MARK)
+            if mark:
+                self._job_state = state
+            else:
+                # the beginning of the mark might be at the end
+                keep = next((n for n in range(len(self.STATE_MARK) - 1, 0, -1)
+                        if out.endswith(self.STATE_MARK[:n])), 0)
+                out, self._job_out = out[:len(out) - keep], out[len(out) - keep:]
+            self._write(out.replace(b"\n", b"\r\n"))
+        if data:
+            return
+        # the command is done
+        job.stdout.close()
+        job.wait()
+        self._job = None
+        if self._job_state is None:
+            self._write(self._job_out.replace(b"\n", b"\r\n"))
+        else:
+            cwd, _, env = self._job_state.partition(b"\n")
+            self.cwd = cwd.decode("utf-8", "replace")
+            self.env = dict(v.decode("utf-8", "replace").split("=", 1)
+                    for v in env.split(b"\0") if b"=" in v)
+        self._show_prompt()
+
+    def _kill_job(self, sig=signal.SIGKILL):
+        job, self._job = self._job, None
+        if not job:
+            return
+        try:
+            os.killpg(job.pid, sig)
+        except OSError:
+            pass
+        if sig != signal.SIGKILL:
+            # let it finish, the output until then still counts
+            self._job = job
+            return
+        job.stdout.close()
+        job.wait()
+
+    def _write(self, data, faults=True):
+        if isinstance(data, str):
+            data = data.encode("utf-8")
+        if not self._master:
+            return
+        delay = self.byte_latency + (10.0 / self.baud if self.baud else 0)
+        if not faults or not (delay or self.drop_rate or self.garble_rate):
+            self._write_raw(data)
+            return
+        out = bytearray()
+        due = time.time()
+        for byte in bytearray(data):
+            if self.drop_rate and self.random.random() < self.drop_rate:
+                self.stats["dropped"] += 1
+                continue
+            if self.garble_rate and self.random.random() < self.garble_rate:
+                self.stats["garbled"] += 1
+                byte = self.random.randint(0, 255)
+            out.append(byte)
+            if delay:
+                due += delay
+                ahead = due - time.time()
+                # sleeping per byte would be far too coarse for high rates
+                if ahead > 0.002:
+                    self._write_raw(bytes(out))
+                    out = bytearray()
+                    time.sleep(ahead)
+        self._write_raw(bytes(out))
+
+    def _write_raw(self, data):
+        if not data:
+            return
+        try:
+            os.write(self._master, data)
+            self.stats["bytes_out"] += len(data)
+        except OSError as e:
+            self.log("write failed: {}".format(e))
+
+    def __del__(self):
+        if getattr(self, "_running", False):
+            self.stop()
+
+#############
+#
+# Connections
+#
+#############
+
+class SimConn(mc.SerialConn):
+    """ a :py:class:`~monk_tf.conn.SerialConn` to its own :py:class:`Simulator`
+
+    Keyword arguments that are parameters of :py:class:`Simulator` are
+    handed over to the simulator, all others to the serial connection.
+    """
+
+    def __init__(self, name, user="root", pw="root",
+            prompt="\r?\n?[^\n]*#",
+            **kwargs
+        ):
+        sim_params = inspect.signature(Simulator.__init__).parameters
+        self.sim_args = {k:kwargs.pop(k) for k in list(kwargs) if k in sim_params}
+        self.sim = Simulator(name=name, user=user, pw=pw, **self.sim_args).start()
+        super(SimConn, self).__init__(
+                name=name,
+                port=self.sim.port,
+                user=user,
+                pw=pw,
+                prompt=prompt,
+                **kwargs
+        )
+
+    def clone(self, name=None):
+        """ a connection to a second simulator with the same configuration
+        """
+        new = mc.ConnectionBase.clone(self, name)
+        new.sim = Simulator(name=name, user=self.user, pw=self.pw,
+                **self.sim_args).start()
+        new.target = new.sim.port
+        return new
+
+    def __del__(self):
+        try:
+            super(SimConn, self).__del__()
+        finally:
+            self.sim.stop()
@@ -0,0 +1,114 @@
+# -*- coding: utf-8 -*-
+#
+# MONK automated test framework
+#
+# Copyright (C) 2015 DResearch Fahrzeugelektronik GmbH
+# Written and maintained by MONK Developers <project-monk@dresearch-fe.de>
+#
+# This program is free software; you can redistribute it and/or
+# modify it under the terms of the GNU General Public License
+# as published by the Free Software Foundation; either version
+# 3 of the License, or (at your option) any later version.
+#
+
+"""
+This module contains the classes that extend :py:mod:`pexpect`. They are
+separate from :py:mod:`monk_tf.conn`, because defining them needs pexpect,
+and :py:mod:`monk_tf.conn` imports pexpect only when the first session of a
+connection starts. Normally you don't use them directly.
+"""
+
+import pexpect
+from pexpect import pxssh
+from pexpect import spawn
+from pexpect.spawnbase import SpawnBase
+
+import monk_tf.conn as mc
+
+# compiles expect patterns the way every spawn of a connection would: for
+# bytes, without ignorecase
+PATTERN_COMPILER = SpawnBase()
+
+class pxsshWorkaround(pxssh.pxssh):
+    """ just to add that echo=False """
+
+    def __init__(self, timeout=30, maxread=2000,
+        searchwindowsize=None,logfile=None, cwd=None, env=None, echo=True):
+        spawn.__init__(self, None, timeout=timeout, maxread=maxread,
+                searchwindowsize=searchwindowsize, logfile=logfile, cwd=cwd,
+                env=env, echo=echo)
+        self.name = '<pxssh>'
+        self.UNIQUE_PROMPT = "\[PEXPECT\][\$\#] "
+        self.PROMPT = self.UNIQUE_PROMPT
+        self.PROMPT_SET_SH = "PS1='[PEXPECT]\$ '"
+        self.PROMPT_SET_CSH = "set prompt='[PEXPECT]\$ '"
+        self.SSH_OPTS = ("-o'RSAAuthentication=no'"
+                + " -o 'PubkeyAuthentication=no'")
+
+class ReplaySpawn(SpawnBase):
+    """ a pexpect object that plays a recorded session instead of talking to
+        a :term:`target device`
+
+    Sent data must be the same as in the recording, otherwise a
+    :py:class:`~monk_tf.conn.ReplayMismatchException` is raised. Waiting for output that
+    wasn't recorded fails immediately with :pexpect:class:`TIMEOUT`.
+    """
+
+    def __init__(self, replay, timeout=30):
+        super(ReplaySpawn, self).__init__(timeout=timeout)
+        self.replay = replay
+        self.PROMPT = replay.next_session()
+        self.closed = False
+        self.delaybeforesend = None
+        self.delayafterread = None
+        self._inbox = b""
+        self._outbox = b""
+
+    def read_nonblocking(self, size=1, timeout=None):
+        if not self._inbox:
+            event = self.replay.peek()
+            if event is None:
+                raise pexpect.EOF("end of the recorded session")
+            if event[1] != "i":
+                raise pexpect.TIMEOUT("the recording expects a send next")
+            self._inbox = self.replay.pop()[2]
+        data, self._inbox = self._inbox[:size], self._inbox[size:]
+        return data
+
+    def send(self, s):
+        data = s.encode("utf-8") if isinstance(s, str) else s
+        self._log(data, "send")
+        rest = data
+        while rest:
+            if not self._outbox:
+                # everything that arrived before this send can be read later
+                while self.replay.peek() and self.replay.peek()[1] == "i":
+                    self._inbox += self.replay.pop()[2]
+                event = self.replay.peek()
+                if event is None:
+                    raise mc.ReplayMismatchException("sent '{}' after the end of the recording".format(rest))
+                self._outbox = self.replay.pop()[2]
+            n = min(len(rest), len(self._outbox))
+            if rest[:n] != self._outbox[:n]:
+                raise mc.ReplayMismatchException("sent '{}', but the recording has '{}'".format(
+                    rest, self._outbox))
+            rest, self._outbox = rest[n:], self._outbox[n:]
+        return len(data)
+
+    def sendline(self, s=""):
+        return self.send(s + self.linesep.decode() if isinstance(s, str) else s + self.linesep)
+
+    def prompt(self, timeout=-1):
+        """ like :pexpect:meth:`pxssh.prompt` """
+        return self.expect([self.PROMPT, pexpect.TIMEOUT], timeout=timeout) == 0
+
+    def logout(self):
+        self.close()
+
+    def isalive(self):
+        return not self.closed
+
+    def close(self, force=True):
+        if not self.closed:
+            self.replay.skip_session()
+            self.closed = True
@@ -43,12 +43,19 @@ setup(
     packages=[monk_tf.__title__],
     license=read("LICENSE.txt"),
     zip_safe=False,
+    python_requires=">=3.7",
     install_requires = [
-        "pexpect >= 3.3",
+        "pexpect >= 4.0",
         "requests >= 2.2.1",
         "pyte >= 0.4.8",
         "configobj >=4.7.2",
-    ],provides = [
+    ],
+    entry_points = {
+        "pytest11" : [
+            "monk_tf = monk_tf.pytest_plugin",
+        ],
+    },
+    provides = [
         "{} ({})".format(monk_tf.__title__, monk_tf.__version__)
     ],
     test_suite = "nose.collector",
@@ -63,7 +70,13 @@ setup(
         "License :: OSI Approved :: GNU General Public License v3 or later (GPLv3+)",
         "Natural Language :: English",
         "Operating System :: Unix",
-        "Programming Language :: Python :: 2.7",
+        "Programming Language :: Python :: 3",
+        "Programming Language :: Python :: 3 :: Only",
+        "Programming Language :: Python :: 3.7",
+        "Programming Language :: Python :: 3.8",
+        "Programming Language :: Python :: 3.9",
+        "Programming Language :: Python :: 3.10",
+        "Programming Language :: Python :: 3.11",
         "Topic :: Software Development",
         "Topic :: Software Development :: Testing",
         "Topic :: Terminals :: Serial",
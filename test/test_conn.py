@@ -10,10 +10,16 @@
 # 3 of the License, or (at your option) any later version.
 #
 
+import os
 import collections
+import os.path as op
+import tempfile
+import time
 
+import pexpect
 from nose import tools as nt
 from monk_tf import conn
+from monk_tf import sim
 
 
 def test_simplest():
@@ -78,3 +84,332 @@ class MockConn(conn.ConnectionBase):
 class Exp(object):
     def close(self):
         pass
+
+def test_cache_lru_and_ttl():
+    """ conn: the command cache drops old and expired entries
+    """
+    # setup
+    sut = conn.CmdCache(size=2, ttl=60)
+    sut.put("a", 1)
+    sut.put("b", 2)
+    # execute
+    sut.get("a")
+    sut.put("c", 3)
+    sut.put("d", 4)
+    sut.ttl = -1
+    sut.put("e", 5)
+    # verify
+    nt.eq_(sut.get("c"), None)
+    nt.eq_(sut.get("d"), 4)
+    nt.eq_(sut.get("e"), None)
+
+def test_cache_idempotent_cmds():
+    """ conn: idempotent commands are answered from the cache until close()
+    """
+    # setup
+    sut = sim.SimConn("cache1", cache_patterns=["cat .*"],
+            cwd=tempfile.mkdtemp(), first_prompt_timeout=10, default_timeout=5)
+    sut.cmd("echo 1 > counter")
+    # execute
+    first = sut.cmd("cat counter")
+    sut.cmd("echo 2 > counter")
+    cached = sut.cmd("cat counter")
+    sut.close()
+    fresh = sut.cmd("cat counter")
+    # verify
+    nt.eq_(first, (0, "1"))
+    nt.eq_(cached, (0, "1"))
+    nt.eq_(fresh, (0, "2"))
+    nt.eq_(sut.metrics.counters()["cache_hits"], 1)
+    nt.eq_(sut.metrics.counters()["cache_misses"], 2)
+
+def test_cache_hit_has_no_timing():
+    """ conn: a cache hit doesn't report the timing of the previous cmd()
+    """
+    # setup
+    sut = sim.SimConn("cache2", cache_patterns=["uname.*"],
+            first_prompt_timeout=10, default_timeout=5)
+    sut.cmd("uname")
+    # execute
+    sut.cmd("uname")
+    # verify
+    nt.eq_(dict(sut.last_timing), {})
+
+def test_result_rc_without_parsing():
+    """ conn: the returncode of a CmdResult is found without parsing the output
+    """
+    # setup; without a connection parsing would fail
+    sut = conn.CmdResult(None, b"\xff\xfe binary\r\n<retcode>3</retcode>\r")
+    # execute
+    retcode = sut.rc
+    # verify
+    nt.eq_(retcode, 3)
+    nt.eq_(sut[0], 3)
+    nt.ok_(sut.raw.startswith(b"\xff"))
+
+def test_result_is_a_tuple():
+    """ conn: a CmdResult can be unpacked and compared like (rc, out)
+    """
+    # setup
+    sut = conn.CmdResult(sim.SimConn("result1"), b"line1\r\nline2\r\n<retcode>0</retcode>\r")
+    # execute
+    retcode, out = sut
+    # verify
+    nt.eq_(retcode, 0)
+    nt.eq_(out, "line1\nline2")
+    nt.eq_(sut, (0, "line1\nline2"))
+    nt.eq_(sut.lines, ["line1", "line2"])
+
+@nt.raises(conn.OutputParseException)
+def test_result_binary_out():
+    """ conn: binary output can't be decoded
+    """
+    conn.CmdResult(None, b"\xff\xfe", do_retcode=False).out
+
+def test_compressed_cmd():
+    """ conn: a compressed cmd() returns the same as an uncompressed one
+    """
+    # setup
+    sut = sim.SimConn("compress1", first_prompt_timeout=10, default_timeout=10)
+    msg = "seq 1 500; echo error >&2; false"
+    expected = sut.cmd(msg)
+    # execute
+    result = sut.cmd(msg, compress=True)
+    # verify
+    nt.eq_(result, expected)
+    nt.eq_(result.rc, 1)
+    nt.ok_(sut.can_compress())
+
+def test_compressed_multiline_cmd():
+    """ conn: compressed output survives the continuation prompts of a shell
+    """
+    # setup
+    sut = conn.ConnectionBase("compress2", "sh", "root", "root")
+    shell = pexpect.spawn("/bin/sh", env={"PS1" : "$ ", "PS2" : "> ",
+        "PATH" : os.environ["PATH"]})
+    shell.expect_exact("$ ")
+    # execute
+    shell.sendline(sut._prep_cmdcompressed("echo one\nfor i in 2 3; do\necho $i\ndone"))
+    shell.expect_exact("$ ")
+    out = sut._decompress(shell.before)
+    shell.close()
+    # verify
+    nt.eq_(out, b"one\n2\n3\n<retcode>0</retcode>\n")
+
+def test_compressed_background_cmd():
+    """ conn: a compressed command may end with "&"
+    """
+    # setup
+    sut = conn.ConnectionBase("compress3", "sh", "root", "root")
+    shell = pexpect.spawn("/bin/sh", env={"PS1" : "$ ", "PS2" : "> ",
+        "PATH" : os.environ["PATH"]})
+    shell.expect_exact("$ ")
+    # execute
+    shell.sendline(sut._prep_cmdcompressed("echo one; true &"))
+    shell.expect_exact("$ ")
+    out = sut._decompress(shell.before)
+    shell.close()
+    # verify
+    nt.eq_(out, b"one\n<retcode>0</retcode>\n")
+
+def test_compressed_falls_back_to_plain_cmd():
+    """ conn: undecodable compressed output leads to an uncompressed cmd()
+    """
+    # setup
+    sut = sim.SimConn("compress4", first_prompt_timeout=10, default_timeout=10)
+    def broken(received):
+        raise conn.OutputParseException("garbled")
+    sut._decompress = broken
+    # execute
+    result = sut.cmd("echo plain", compress=True)
+    # verify
+    nt.eq_(result, (0, "plain"))
+    nt.eq_(sut.metrics.counters()["compress_failures"], 1)
+    sut.sim.stop()
+
+def test_cmd_script_survives_small_input_buffer():
+    """ conn: cmd_script() sends a long script without overrunning the target
+    """
+    # setup
+    script = "".join("echo line{}\n".format(i) for i in range(200)) + "exit 3\n"
+    sut = sim.SimConn("script1", rx_buffer=128, chunk_size=64, chunk_delay=0,
+            first_prompt_timeout=10, default_timeout=10)
+    # execute
+    rc, out = sut.cmd_script(script)
+    # verify
+    nt.eq_(rc, 3)
+    nt.eq_(out.split("\n"), ["line{}".format(i) for i in range(200)])
+    nt.eq_(sut.sim.stats["overruns"], 0)
+    sut.sim.stop()
+
+def test_long_line_is_chunked():
+    """ conn: a line longer than chunk_size is sent in pieces
+    """
+    # setup
+    sut = sim.SimConn("chunk1", rx_buffer=128, chunk_size=64,
+            first_prompt_timeout=10, default_timeout=10)
+    # execute
+    rc, out = sut.cmd("echo " + "x" * 1000)
+    # verify
+    nt.eq_(out, "x" * 1000)
+    nt.ok_(sut.metrics.counters()["chunks"] > 15)
+    sut.sim.stop()
+
+def test_put_file_keeps_bwlimit():
+    """ conn: put_file() through the shell stays below its bandwidth limit
+    """
+    # setup
+    tmp = tempfile.mkdtemp()
+    src = op.join(tmp, "payload.bin")
+    with open(src, "wb") as f:
+        f.write(os.urandom(6000))
+    sut = sim.SimConn("putfile1", cwd=tmp, first_prompt_timeout=10,
+            default_timeout=10)
+    sut.cmd("true")
+    start = time.time()
+    # execute; about 8100 bytes base64 at 32 Kbit/s
+    sut.put_file(src, "copy.bin", bwlimit=32)
+    duration = time.time() - start
+    # verify
+    nt.ok_(duration > 1.5, duration)
+    with open(op.join(tmp, "copy.bin"), "rb") as f, open(src, "rb") as g:
+        nt.eq_(f.read(), g.read())
+    sut.sim.stop()
+
+def test_run_script_uploads_once():
+    """ conn: run_script() uploads a script only on a cache miss
+    """
+    # setup
+    script = 'echo "got $# args: $1"\n' * 20
+    sut = sim.SimConn("runscript1", first_prompt_timeout=10, default_timeout=10)
+    sut.SCRIPT_CACHE_DIR = tempfile.mkdtemp()
+    # execute
+    results = [sut.run_script(script, ["a b", "c"]) for i in range(3)]
+    # verify
+    nt.eq_([r.rc for r in results], [0, 0, 0])
+    nt.eq_(results[0].out, results[2].out)
+    nt.eq_(results[0].lines[0], "got 2 args: a b")
+    counters = sut.metrics.counters()
+    nt.eq_(counters["script_cache_misses"], 1)
+    nt.eq_(counters["script_cache_hits"], 2)
+    sut.sim.stop()
+
+def test_run_script_exit_status_and_shebang():
+    """ conn: run_script() honors the #! line and any exit status of a script
+    """
+    # setup
+    script = "#!/bin/sh -e\necho '<monk-cache-miss>'\nfalse\necho after\n"
+    sut = sim.SimConn("runscript2", first_prompt_timeout=10, default_timeout=10)
+    sut.SCRIPT_CACHE_DIR = tempfile.mkdtemp()
+    reserved = "exit {}\n".format(sut.SCRIPT_CACHE_MISS_RC)
+    # execute
+    results = [sut.run_script(script) for i in range(2)]
+    exits = [sut.run_script(reserved) for i in range(2)]
+    # verify
+    nt.eq_(results[1], (1, "<monk-cache-miss>"))
+    nt.eq_([r.rc for r in exits], [sut.SCRIPT_CACHE_MISS_RC] * 2)
+    nt.eq_(sut.metrics.counters()["script_cache_misses"], 2)
+    sut.sim.stop()
+
+def test_reconnect_replays_shell_state():
+    """ conn: cd and export survive a lost session
+    """
+    # setup
+    sut = sim.SimConn("replay1", first_prompt_timeout=10, default_timeout=1)
+    sut.cmd("cd /usr")
+    sut.cmd("export MONK_VAR=first")
+    sut.cmd("export MONK_VAR=second")
+    sut.sim.disconnect(silent_for=0.5)
+    # execute
+    start = time.time()
+    rc, out = sut.cmd("pwd; echo $MONK_VAR")
+    duration = time.time() - start
+    # verify
+    nt.eq_(out, "/usr\nsecond")
+    nt.ok_(duration < 2, duration)
+    nt.eq_(list(sut.shell_state.values()), ["cd /usr", "export MONK_VAR=second"])
+    counters = sut.metrics.counters()
+    nt.eq_((counters["reconnects"], counters["state_replays"]), (1, 1))
+    nt.eq_(sut.metrics.histograms()["reconnect"].count, 1)
+    sut.sim.stop()
+
+def test_reconnect_replays_relative_cd():
+    """ conn: a relative cd and an export that extends a variable survive a
+        lost session
+    """
+    # setup
+    sut = sim.SimConn("replay2", first_prompt_timeout=10, default_timeout=1)
+    sut.cmd("cd /usr")
+    sut.cmd("cd lib")
+    sut.cmd("export MONK_VAR=a")
+    sut.cmd("export MONK_VAR=$MONK_VAR:b")
+    sut.sim.disconnect(silent_for=0.5)
+    # execute
+    rc, out = sut.cmd("pwd; echo $MONK_VAR")
+    # verify
+    nt.eq_(out, "/usr/lib\na:b")
+    nt.eq_(list(sut.shell_state.values()), ["cd /usr/lib", "export MONK_VAR=a",
+        "export MONK_VAR=$MONK_VAR:b"])
+    sut.sim.stop()
+
+def test_reconnect_replays_source_in_its_dir():
+    """ conn: a file sourced by a relative path is found again after a lost
+        session, although the session changed its directory afterwards
+    """
+    # setup
+    app = tempfile.mkdtemp()
+    with open(op.join(app, "env.sh"), "w") as f:
+        f.write("export MONK_ENV=loaded\n")
+    sut = sim.SimConn("replay3", first_prompt_timeout=10, default_timeout=1)
+    sut.cmd("cd {}".format(app))
+    sut.cmd(". ./env.sh")
+    sut.cmd("cd ..")
+    sent = sut.metrics.counters()["cmds"]
+    sut.sim.disconnect(silent_for=0.5)
+    # execute
+    rc, out = sut.cmd("pwd; echo $MONK_ENV")
+    # verify
+    nt.eq_(out, "{}\nloaded".format(op.dirname(app)))
+    # the relative cd needed no extra pwd
+    nt.eq_(sent, 3)
+    sut.sim.stop()
+
+def test_record_and_replay():
+    """ conn: a recorded session can be replayed without the device
+    """
+    # setup
+    path = op.join(tempfile.mkdtemp(), "session.jsonl.gz")
+    live = sim.SimConn("record1", baud=9600, first_prompt_timeout=10,
+            default_timeout=3, record=path)
+    cmds = ["uname -s", "cd /usr", "seq 1 100 | tail -2", "pwd"]
+    expected = [live.cmd(c) for c in cmds]
+    live.recording.close()
+    live.sim.stop()
+    sut = conn.SerialConn("replay1", port="/nonexistent", user="root",
+            pw="root", replay=path)
+    # execute
+    start = time.time()
+    results = [sut.cmd(c) for c in cmds]
+    duration = time.time() - start
+    # verify
+    nt.eq_(results, expected)
+    nt.ok_(duration < 0.5, duration)
+    nt.assert_raises(conn.ReplayMismatchException, sut.cmd, "not recorded")
+
+def test_compile_patterns_cached():
+    """ conn: expect patterns are compiled once per connection
+    """
+    # setup
+    sut = sim.SimConn("patterns1", baud=115200, first_prompt_timeout=10,
+            default_timeout=3)
+    sut.cmd("true")
+    compiled = sut.metrics.counters()["patterns_compiled"]
+    # execute
+    first = sut.compile_patterns([sut.prompt, "login: "])
+    second = sut.compile_patterns([sut.prompt, "login: "])
+    results = [sut.cmd("echo {}".format(i)) for i in range(3)]
+    sut.sim.stop()
+    # verify
+    nt.ok_(first is second)
+    nt.eq_(results, [(0, str(i)) for i in range(3)])
+    nt.eq_(sut.metrics.counters()["patterns_compiled"], compiled + 1)
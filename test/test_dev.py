@@ -11,6 +11,11 @@
 # 3 of the License, or (at your option) any later version.
 #
 
+import os
+import time
+import hashlib
+import tempfile
+
 from nose import tools as nt
 from monk_tf import dev
 from monk_tf import conn
@@ -29,7 +34,8 @@ def test_send_cmd():
     # prepare
     test_input = "just some text"
     expected_out = test_input
-    sut = dev.Device(EchoConn())
+    sut = dev.Device(conns={"echo" : EchoConn()}, use_conns=["echo"],
+            conn_policy="pin")
     # execute
     out = sut.cmd(test_input)
     # assert
@@ -42,7 +48,10 @@ def test_no_conn():
     # prepare
     test_input = "no connection will succeed here"
     expected_out = test_input
-    sut = dev.Device(DefectiveConn(), DefectiveConn())
+    sut = dev.Device(conns={
+        "a" : DefectiveConn("a", "nowhere", "root", "root"),
+        "b" : DefectiveConn("b", "nowhere", "root", "root"),
+    }, use_conns=["a", "b"])
     # execute
     out = sut.cmd(test_input)
     # catch exception
@@ -51,6 +60,367 @@ class EchoConn(object):
     def cmd(*args, **kwargs):
         return kwargs.pop("msg", "NOTHING")
 
-class DefectiveConn(object):
+class DefectiveConn(conn.ConnectionBase):
     def cmd(*args, **kwargs):
-        raise Exception("can't handle that")
+        raise conn.CantCreateConnException("can't handle that")
+
+def test_parse_facts():
+    """ dev: parse the output of the facts script into typed values
+    """
+    # prepare
+    out = "\n".join([
+        "<fact:kernel>", "4.1.0", "</fact:kernel>",
+        "<fact:meminfo>", "MemTotal:  1024 kB", "MemFree:  512 kB", "</fact:meminfo>",
+        "<fact:mounts>", "/dev/root / ext4 rw,relatime 0 0", "</fact:mounts>",
+        "<fact:interfaces>",
+        "2: eth0    inet 192.168.2.100/24 brd 192.168.2.255 scope global eth0",
+        "</fact:interfaces>",
+        "<fact:version>", "</fact:version>",
+    ])
+    # execute
+    facts = dev.parse_facts(out)
+    # assert
+    nt.eq_(facts["kernel"], "4.1.0")
+    nt.eq_(facts["mem_total"], 1024 * 1024)
+    nt.eq_(facts["mem_available"], 512 * 1024)
+    nt.eq_(facts["mounts"][0]["fstype"], "ext4")
+    nt.eq_(facts["interfaces"]["eth0"]["ipv4"], ["192.168.2.100/24"])
+    nt.eq_(facts["version"], None)
+
+def test_reboot():
+    """ dev: reboot a simulated device and wait for it
+    """
+    # prepare
+    from monk_tf import sim
+    serial = sim.SimConn("serial1", boot_delay=1, first_prompt_timeout=10,
+            default_timeout=5)
+    sut = dev.Device(name="dev1", conns={"serial1" : serial},
+            use_conns=["serial1"])
+    sut.cmd("true")
+    # execute
+    duration = sut.reboot(timeout=10)
+    # assert
+    nt.ok_(1 <= duration < 10)
+    nt.eq_(serial.sim.stats["boots"], 2)
+    nt.eq_(sut.cmd("echo back"), (0, "back"))
+
+def test_prefer_fast_conn_and_failover():
+    """ dev: use the fastest healthy connection and switch if it fails
+    """
+    # prepare
+    from monk_tf import sim
+    slow = sim.SimConn("slow", user="", baud=2400, first_prompt_timeout=1,
+            default_timeout=5)
+    fast = sim.SimConn("fast", user="", first_prompt_timeout=1,
+            default_timeout=5)
+    sut = dev.Device(name="dev1", conns={"slow" : slow, "fast" : fast},
+            use_conns=["slow", "fast"], conn_policy="prefer")
+    for i in range(3):
+        sut.cmd("true")
+    # execute
+    before = sut.cmd("echo before")
+    fast.sim.disconnect(silent_for=60)
+    after = sut.cmd("echo after")
+    # assert
+    nt.eq_(sut._conn_order()[0], "slow")
+    nt.ok_(sut.health["fast"].failures == 1)
+    nt.ok_(sut.health["slow"].latency > sut.health["fast"].latency)
+    nt.eq_((before, after), ((0, "before"), (0, "after")))
+    nt.eq_(fast.metrics.counters()["failovers"], 1)
+    slow.sim.stop()
+    fast.sim.stop()
+
+def test_failover_after_short_probe():
+    """ dev: a silent connection is given up after probe_timeout, not after
+        its whole first_prompt_timeout
+    """
+    # prepare
+    from monk_tf import sim
+    first = sim.SimConn("first", user="", first_prompt_timeout=60,
+            default_timeout=1)
+    second = sim.SimConn("second", user="", first_prompt_timeout=60,
+            default_timeout=1)
+    sut = dev.Device(name="dev1", conns={"first" : first, "second" : second},
+            use_conns=["first", "second"], probe_timeout=2)
+    sut.cmd("true")
+    first.sim.disconnect(silent_for=60)
+    start = time.time()
+    # execute
+    out = sut.cmd("echo other")
+    # assert
+    nt.eq_(out, (0, "other"))
+    nt.ok_(time.time() - start < 10)
+    nt.eq_(first.metrics.counters()["failovers"], 1)
+    first.sim.stop()
+    second.sim.stop()
+
+def test_timed_out_cmd_runs_once():
+    """ dev: a command that times out is not repeated on the next connection
+    """
+    # prepare
+    from monk_tf import sim
+    log = os.path.join(tempfile.mkdtemp(), "log")
+    a = sim.SimConn("a", user="", first_prompt_timeout=5, default_timeout=5)
+    b = sim.SimConn("b", user="", first_prompt_timeout=5, default_timeout=5)
+    sut = dev.Device(name="dev1", conns={"a" : a, "b" : b},
+            use_conns=["a", "b"])
+    # execute
+    nt.assert_raises(conn.pexpect.TIMEOUT, sut.cmd,
+            "echo ran >> {}; sleep 2".format(log), timeout=1)
+    # assert
+    time.sleep(1.5)
+    with open(log) as f:
+        nt.eq_(f.read(), "ran\n")
+    nt.eq_(sut.health["a"].failures, 0)
+    nt.ok_("failovers" not in a.metrics.counters())
+    a.sim.stop()
+    b.sim.stop()
+
+def test_pool_runs_cmds_in_parallel():
+    """ dev: concurrent cmd() calls use several sessions of a pool
+    """
+    # prepare
+    import threading
+    from monk_tf import sim
+    ssh = sim.SimConn("ssh1", user="", first_prompt_timeout=5, default_timeout=5)
+    sut = dev.Device(name="dev1", conns={"ssh1" : ssh}, use_conns=["ssh1"],
+            pool_size=3)
+    results = []
+    threads = [threading.Thread(target=lambda: results.append(
+        sut.cmd("sleep 1; echo done"))) for i in range(3)]
+    # execute
+    start = time.time()
+    for t in threads:
+        t.start()
+    for t in threads:
+        t.join()
+    duration = time.time() - start
+    # assert
+    nt.eq_(results, [(0, "done")] * 3)
+    nt.ok_(duration < 2.5, duration)
+    nt.eq_(len(sut._pool_members), 3)
+    nt.eq_(sut.metrics.counters()["cmds"], 3)
+    for c in sut._pool_members:
+        c.sim.stop()
+
+def test_cmd_inside_lease():
+    """ dev: cmd() in a lease of the same thread uses the leased session
+    """
+    # prepare
+    import threading
+    from monk_tf import sim
+    serial = sim.SimConn("serial1", user="", first_prompt_timeout=5, default_timeout=5)
+    sut = dev.Device(name="dev1", conns={"serial1" : serial},
+            use_conns=["serial1"])
+    results = []
+    def leased():
+        with sut.lease() as c:
+            c.cmd("cd /tmp")
+            results.append(sut.cmd("pwd"))
+    # execute
+    t = threading.Thread(target=leased)
+    t.daemon = True
+    t.start()
+    t.join(10)
+    # assert
+    nt.ok_(not t.is_alive(), "cmd() in a lease deadlocked")
+    nt.eq_(results, [(0, "/tmp")])
+    serial.sim.stop()
+
+def test_session_methods_share_leases():
+    """ dev: cmd(), eval_cmd() and run_script() from several threads don't
+        mix up their outputs
+    """
+    # prepare
+    import threading
+    from monk_tf import sim
+    serial = sim.SimConn("serial1", user="", first_prompt_timeout=5, default_timeout=5)
+    serial.SCRIPT_CACHE_DIR = tempfile.mkdtemp()
+    sut = dev.Device(name="dev1", conns={"serial1" : serial},
+            use_conns=["serial1"])
+    calls = {
+        "cmd" : lambda i: sut.cmd("echo cmd{}".format(i)).out,
+        "eval" : lambda i: sut.eval_cmd("echo eval{}".format(i)),
+        "script" : lambda i: sut.run_script('echo "script$1"\n', [i]).out,
+    }
+    results = {name : [] for name in calls}
+    def run(name):
+        for i in range(5):
+            results[name].append(calls[name](i))
+    threads = [threading.Thread(target=run, args=(name,)) for name in calls]
+    # execute
+    for t in threads:
+        t.start()
+    for t in threads:
+        t.join(60)
+    # assert
+    for name in calls:
+        nt.eq_(results[name], ["{}{}".format(name, i) for i in range(5)])
+    serial.sim.stop()
+
+def test_update_resumes_upload():
+    """ dev: an update only sends missing chunks and confirms the version
+    """
+    # prepare
+    from monk_tf import sim
+    tmp = tempfile.mkdtemp()
+    image = os.path.join(tmp, "image.bin")
+    data = os.urandom(3000)
+    with open(image, "wb") as f:
+        f.write(data)
+    # the first chunk is there already, the second one broke off
+    remote = os.path.join(tmp, "monk-update-" + hashlib.sha256(data).hexdigest()[:12])
+    os.mkdir(remote)
+    with open(os.path.join(remote, "image.bin"), "wb") as f:
+        f.write(data[:1024])
+    with open(os.path.join(remote, "image.bin.part"), "wb") as f:
+        f.write(b"broken")
+    serial = sim.SimConn("serial1", boot_delay=0, first_prompt_timeout=10,
+            default_timeout=5)
+    sut = dev.Device(name="dev1", conns={"serial1" : serial},
+            use_conns=["serial1"])
+    install = "cp {{image}} {0}/installed.bin && echo 2.0 > {0}/version".format(tmp)
+    # execute
+    phases = sut.update(image, install, version="2.0",
+            version_cmd="cat {}/version".format(tmp), trgt_dir=tmp,
+            chunk_size=1024, timeout=10)
+    # assert
+    nt.eq_(list(phases), ["upload", "verify", "install", "reboot", "confirm"])
+    counters = sut.metrics.counters()
+    nt.eq_((counters["update_chunks_sent"], counters["update_chunks_skipped"]), (2, 1))
+    with open(os.path.join(tmp, "installed.bin"), "rb") as f:
+        nt.eq_(f.read(), data)
+    nt.eq_(serial.sim.stats["boots"], 2)
+    nt.ok_(not os.path.exists(remote))
+    nt.assert_raises(dev.UpdateFailedException, sut.update, image, install,
+            version="3.0", version_cmd="cat {}/version".format(tmp),
+            trgt_dir=tmp, chunk_size=1024, reboot=False)
+
+def test_update_keeps_image_until_installed():
+    """ dev: a failed install keeps the image, a rebooting one is no error
+    """
+    # prepare
+    from monk_tf import sim
+    tmp = tempfile.mkdtemp()
+    image = os.path.join(tmp, "image.bin")
+    data = os.urandom(2048)
+    with open(image, "wb") as f:
+        f.write(data)
+    remote = os.path.join(tmp, "monk-update-" + hashlib.sha256(data).hexdigest()[:12])
+    serial = sim.SimConn("serial1", boot_delay=0, first_prompt_timeout=10,
+            default_timeout=5)
+    sut = dev.Device(name="dev1", conns={"serial1" : serial},
+            use_conns=["serial1"])
+    # execute
+    nt.assert_raises(dev.UpdateFailedException, sut.update, image, "false",
+            trgt_dir=tmp, chunk_size=1024, timeout=10)
+    kept = os.listdir(remote)
+    phases = sut.update(image, "reboot", reboots=True, trgt_dir=tmp,
+            chunk_size=1024, timeout=10)
+    # assert
+    nt.eq_(kept, ["image.bin"])
+    nt.eq_(list(phases), ["upload", "verify", "install", "confirm"])
+    nt.eq_(sut.metrics.counters()["update_chunks_skipped"], 2)
+    nt.eq_(serial.sim.stats["boots"], 2)
+    nt.ok_(not os.path.exists(remote))
+    sut.close_all()
+
+def test_update_fails_before_reboot_wait():
+    """ dev: a rebooting install that fails right away fails the update fast
+    """
+    # prepare
+    from monk_tf import sim
+    tmp = tempfile.mkdtemp()
+    image = os.path.join(tmp, "image.bin")
+    data = os.urandom(2048)
+    with open(image, "wb") as f:
+        f.write(data)
+    # a partial image with the wrong content is started over
+    remote = os.path.join(tmp, "monk-update-" + hashlib.sha256(data).hexdigest()[:12])
+    os.mkdir(remote)
+    with open(os.path.join(remote, "image.bin"), "wb") as f:
+        f.write(b"broken")
+    serial = sim.SimConn("serial1", boot_delay=0, first_prompt_timeout=10,
+            default_timeout=5)
+    sut = dev.Device(name="dev1", conns={"serial1" : serial},
+            use_conns=["serial1"])
+    # execute
+    start = time.time()
+    with nt.assert_raises(dev.UpdateFailedException) as raised:
+        sut.update(image, "echo bad image >&2; false", reboots=True,
+                trgt_dir=tmp, chunk_size=1024, timeout=120)
+    # assert
+    nt.ok_(time.time() - start < 30)
+    nt.ok_("phase install" in str(raised.exception))
+    nt.ok_("<install-failed>1" in str(raised.exception))
+    counters = sut.metrics.counters()
+    nt.eq_((counters["update_chunks_sent"], counters["update_chunks_skipped"]), (2, 0))
+    nt.eq_(serial.sim.stats["boots"], 1)
+    with open(os.path.join(remote, "image.bin"), "rb") as f:
+        nt.eq_(f.read(), data)
+    sut.close_all()
+
+def test_tail_filters_on_target():
+    """ dev: tail delivers only the matching new lines of a file
+    """
+    # prepare
+    from monk_tf import sim
+    path = os.path.join(tempfile.mkdtemp(), "messages")
+    with open(path, "w") as f:
+        f.write("ERROR old\n")
+    serial = sim.SimConn("serial1", boot_delay=0, first_prompt_timeout=10,
+            default_timeout=5)
+    sut = dev.Device(name="dev1", conns={"serial1" : serial},
+            use_conns=["serial1"])
+    got = []
+    # execute
+    tail = sut.tail(path, "ERROR", callback=got.append)
+    # give tail a moment to open the file
+    time.sleep(0.2)
+    with open(path, "a") as f:
+        f.write("INFO 1\nERROR 1\nINFO 2\nERROR 2\n")
+    end_time = time.time() + 10
+    while len(got) < 2 and time.time() < end_time:
+        time.sleep(0.05)
+    tail.stop()
+    # assert
+    nt.eq_(got, ["ERROR 1", "ERROR 2"])
+    nt.eq_(sut.wait_for_line(path, "ERROR [0-9]", timeout=5, lines=1), "ERROR 2")
+    # a POSIX class, unknown to Python's re
+    nt.eq_(sut.wait_for_line(path, "ERROR [[:digit:]]", timeout=5, lines=1), "ERROR 2")
+    nt.assert_raises(dev.TailTimeoutException, sut.wait_for_line, path,
+            "FATAL", timeout=0.5)
+    sut.close_all()
+
+def test_tail_on_single_session_conn():
+    """ dev: tail borrows a connection that can't be cloned, like a serial one
+    """
+    # prepare
+    from monk_tf import sim
+    class SerialOnlyConn(sim.SimConn):
+        def clone(self, name=None):
+            raise conn.CantCloneException("a serial line has only one session")
+    path = os.path.join(tempfile.mkdtemp(), "messages")
+    open(path, "w").close()
+    serial = SerialOnlyConn("serial1", boot_delay=0, first_prompt_timeout=10,
+            default_timeout=5)
+    sut = dev.Device(name="dev1", conns={"serial1" : serial},
+            use_conns=["serial1"])
+    got = []
+    # execute
+    tail = sut.tail(path, "ERROR", callback=got.append)
+    time.sleep(0.2)
+    with open(path, "a") as f:
+        f.write("INFO 1\nERROR 1\n")
+    line = tail.wait_for_line("ERROR", timeout=5)
+    nt.assert_raises(dev.CantHandleException, sut.cmd, "true")
+    nt.assert_raises(dev.ConnBusyException, sut.cmd, "true", conn="serial1")
+    leased_while_tailing = sut._conn_locks["serial1"].locked()
+    tail.stop()
+    # assert
+    nt.eq_((line, got), ("ERROR 1", ["ERROR 1"]))
+    nt.ok_(leased_while_tailing)
+    nt.ok_(not sut._conn_locks["serial1"].locked())
+    nt.eq_(sut._tails, [])
+    nt.eq_(sut.cmd("echo free"), (0, "free"))
+    sut.close_all()
@@ -12,8 +12,13 @@
 #
 
 from os.path import dirname, abspath
+import os
+import os.path as op
+import gzip
 import inspect
 import logging
+import tempfile
+import time
 
 from nose import tools as nt
 
@@ -53,3 +58,183 @@ def test_simple_parse():
 class LoadedMock(object):
     def __init__(self, name="wrong", *args, **kwargs):
         self.name = name
+
+def test_queued_filehandler():
+    """ log records of a queued handler are written after flush_logging()
+    """
+    # set up
+    sink = op.join(tempfile.mkdtemp(), "queued.log")
+    sut = fixture.FileHandler("queued", sink, "test_queued", "%(message)s", "INFO")
+    sut.register(queued=True)
+    # execute
+    logging.getLogger("test_queued").info("written in background")
+    fixture.flush_logging()
+    # verify
+    with open(sink) as f:
+        nt.assert_equals(f.read(), "written in background\n")
+    fixture.stop_logging()
+
+def test_compressed_rotation():
+    """ compressed log files are rotated by their compressed size
+    """
+    # set up
+    sink = op.join(tempfile.mkdtemp(), "rotated.log.gz")
+    handler = fixture.CompressedRotatingFileHandler(sink, maxBytes=20000,
+            backupCount=2)
+    log = logging.getLogger("test_compressed_rotation")
+    log.addHandler(handler)
+    log.setLevel(logging.INFO)
+    # execute
+    for i in range(20000):
+        log.info("line %d with some payload %s", i, os.urandom(4).hex())
+    handler.close()
+    # verify
+    nt.assert_true(op.isfile(sink.replace(".log.gz", ".log.2.gz")))
+    # the compressor writes in blocks, so a file may grow a bit larger
+    nt.assert_true(op.getsize(sink.replace(".log.gz", ".log.1.gz")) < 20000 + 32768)
+    with gzip.open(sink.replace(".log.gz", ".log.1.gz"), "rt") as f:
+        nt.assert_true(f.readline().startswith("line "))
+
+def test_select_devs_lazily():
+    """ use_devs selects devices by query and only those are created
+    """
+    # set up
+    path = op.join(tempfile.mkdtemp(), "fixture.cfg")
+    with open(path, "w") as f:
+        f.write("use_devs=2*tag:rack2,board-0\n")
+        for i in range(50):
+            f.write("\n".join([
+                "[board-{}]".format(i),
+                "    type=Device",
+                "    tags=rack{},arm".format(i % 3),
+                "    use_conns=ssh1",
+                "    [[conns]]",
+                "        [[[ssh1]]]",
+                "            type=SshConnection",
+                "            host=10.0.0.{}".format(i),
+                "            user=root",
+                "            pw=root",
+                "",
+            ]))
+    # execute
+    sut = fixture.Fixture(path, fixture_locations=[path])
+    before = sut.devs.loaded()
+    first = sut.firstdev
+    # verify
+    nt.assert_equals(sut.use_devs, ["board-2", "board-5", "board-0"])
+    nt.assert_equals(before, {})
+    nt.assert_equals(list(sut.devs.loaded()), ["board-2"])
+    nt.assert_equals(first.conns["ssh1"].host, "10.0.0.2")
+    nt.assert_equals(len(sut.devs), 50)
+    nt.assert_raises(fixture.NoDevsChosenException, sut.devs.select, ["4*tag:nope"])
+
+def test_building_keeps_the_index():
+    """ creating a device leaves its indexed section as it was
+    """
+    # set up
+    path = op.join(tempfile.mkdtemp(), "fixture.cfg")
+    with open(path, "w") as f:
+        f.write("\n".join([
+            "use_devs=dev1",
+            "[dev1]",
+            "    type=Device",
+            "    use_conns=ssh1",
+            "    [[conns]]",
+            "        [[[ssh1]]]",
+            "            type=SshConnection",
+            "            host=10.0.0.1",
+            "            user=root",
+            "            pw=root",
+            "",
+        ]))
+    sut = fixture.Fixture(path, fixture_locations=[path])
+    before = sut._lease_resources("dev1")
+    # execute
+    sut.devs["dev1"]
+    # verify
+    nt.assert_equals(sut.devs.section("dev1")["conns"]["ssh1"]["type"], "SshConnection")
+    nt.assert_equals(sut._section_resources(sut.devs.section("dev1")), before)
+    nt.assert_equals(before, ["ssh:10.0.0.1"])
+
+def test_deploy_to_all_devs():
+    """ deploy() sends a file to all devices and verifies it
+    """
+    # set up
+    tmp = tempfile.mkdtemp()
+    path = op.join(tmp, "fixture.cfg")
+    with open(path, "w") as f:
+        f.write("use_devs=dev*\n")
+        for name in ("dev1", "dev2", "dev3"):
+            os.mkdir(op.join(tmp, name))
+            f.write("\n".join([
+                "[{}]".format(name),
+                "    type=Device",
+                "    use_conns=serial1",
+                "    [[conns]]",
+                "        [[[serial1]]]",
+                "            type=SimConnection",
+                "            baud=115200",
+                "",
+            ]))
+    payload = op.join(tmp, "payload.bin")
+    with open(payload, "wb") as f:
+        f.write(os.urandom(512) + b"compressible " * 400)
+    sut = fixture.Fixture(path, fixture_locations=[path])
+    limits = []
+    for name in sut.use_devs:
+        device = sut.devs[name]
+        device.cmd("cd {}".format(op.join(tmp, name)))
+        def cp(src, trgt, bwlimit=None, timeout=None, cp=device.cp):
+            limits.append(bwlimit)
+            return cp(src, trgt, bwlimit=bwlimit, timeout=timeout)
+        device.cp = cp
+    # execute
+    report = sut.deploy(payload, "payload.bin", workers=2, bwlimit=1000)
+    sut.tear_down()
+    # verify
+    nt.assert_equals(sorted(report), ["dev1", "dev2", "dev3"])
+    # the third transfer gets at least the share of one that finished
+    nt.assert_equals(limits[:2], [500, 500])
+    nt.assert_true(limits[2] in (500, 1000), limits)
+    for name, result in report.items():
+        nt.assert_true(result["ok"], result)
+        nt.assert_true(result["bytes"] < 5000, result)
+        with open(op.join(tmp, name, "payload.bin"), "rb") as f:
+            with open(payload, "rb") as g:
+                nt.assert_equals(f.read(), g.read())
+
+def test_reboot_all_shares_deadline():
+    """ reboot_all() waits for all devices until one common deadline
+    """
+    # set up
+    path = op.join(tempfile.mkdtemp(), "fixture.cfg")
+    with open(path, "w") as f:
+        f.write("use_devs=dev*\n")
+        for name in ("dev1", "dev2", "dev3"):
+            f.write("\n".join([
+                "[{}]".format(name),
+                "    type=Device",
+                "    use_conns=serial1",
+                "    [[conns]]",
+                "        [[[serial1]]]",
+                "            type=SimConnection",
+                "",
+            ]))
+    sut = fixture.Fixture(path, fixture_locations=[path])
+    for name in sut.use_devs:
+        sut.devs[name].cmd("true")
+        sut.devs[name].conns["serial1"].sim.boot_delay = 1
+    # dev3 doesn't come back in time
+    sut.devs["dev3"].conns["serial1"].sim.boot_delay = 30
+    start = time.time()
+    # execute
+    durations, failures = sut.reboot_all(timeout=4)
+    elapsed = time.time() - start
+    # verify
+    nt.assert_equals(sorted(durations), ["dev1", "dev2"])
+    nt.assert_equals(list(failures), ["dev3"])
+    nt.assert_true(isinstance(failures["dev3"], dev.RebootFailedException))
+    # all devices waited in parallel for the same 4 seconds
+    nt.assert_true(elapsed < 8, elapsed)
+    nt.assert_equals(sut.devs["dev1"].cmd("echo back"), (0, "back"))
+    sut.tear_down()
@@ -0,0 +1,38 @@
+# -*- coding: utf-8 -*-
+#
+# MONK automated test framework
+#
+# Copyright (C) 2015 DResearch Fahrzeugelektronik GmbH
+# Written and maintained by MONK Developers <project-monk@dresearch-fe.de>
+#
+# This program is free software; you can redistribute it and/or
+# modify it under the terms of the GNU General Public License
+# as published by the Free Software Foundation; either version
+# 3 of the License, or (at your option) any later version.
+#
+
+from nose import tools as nt
+from monk_tf import general_purpose as gp
+
+def make_object(name):
+    return gp.MonkObject(name=name, module="test")
+
+def test_loggers_cached():
+    """ general_purpose: objects with the same name share a logger
+    """
+    # execute
+    first = gp.MonkObject(name="same", module="test")
+    second = gp.MonkObject(name="same", module="test")
+    # verify
+    nt.ok_(first.logger is second.logger)
+    nt.eq_(first.name, "test.same")
+
+def test_testlogger_found_on_use():
+    """ general_purpose: the test logger belongs to the test that uses it
+    """
+    # setup
+    sut = make_object("lazy")
+    # execute
+    testlogger = sut.testlogger
+    # verify
+    nt.eq_(testlogger.name, "test_testlogger_found_on_use")
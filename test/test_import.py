@@ -0,0 +1,79 @@
+# -*- coding: utf-8 -*-
+#
+# MONK automated test framework
+#
+# Copyright (C) 2015 DResearch Fahrzeugelektronik GmbH
+# Written and maintained by MONK Developers <project-monk@dresearch-fe.de>
+#
+# This program is free software; you can redistribute it and/or
+# modify it under the terms of the GNU General Public License
+# as published by the Free Software Foundation; either version
+# 3 of the License, or (at your option) any later version.
+#
+
+import os
+import sys
+import subprocess
+
+from nose import tools as nt
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)),
+    os.pardir, "tools"))
+from importtime import import_times
+
+# seconds that an import may take in a fresh interpreter, including
+# everything it imports
+STARTUP_BUDGETS = {
+    "monk_tf" : 0.02,
+    "monk_tf.fixture" : 0.1,
+}
+
+# expensive modules that are only needed when a connection is used
+LAZY_MODULES = ("configobj", "pexpect", "pyte", "monk_tf.conn", "monk_tf.dev",
+        "monk_tf.sim")
+
+def test_lazy_backends():
+    """ import: importing the fixture module doesn't import the backends
+    """
+    # execute
+    imported = import_times("monk_tf.fixture")
+    # verify
+    nt.eq_([m for m in LAZY_MODULES if m in imported], [])
+
+def test_startup_within_budget():
+    """ import: monk_tf and the fixture module load within their budgets
+    """
+    for module, budget in sorted(STARTUP_BUDGETS.items()):
+        # execute; the fastest of a few runs, against a busy machine
+        cumulative = min(import_times(module)[module][1] for _ in range(3))
+        # verify
+        nt.ok_(cumulative < budget * 1e6, "import {} took {}us, budget is {}us".format(
+            module, cumulative, int(budget * 1e6)))
+
+def test_startup_faster_than_eager():
+    """ import: the fixture module loads faster than with all backends
+    """
+    # execute
+    lazy, eager = [], []
+    # alternating, so both see the same load on the machine
+    for _ in range(3):
+        lazy.append(sum(own for own, _ in import_times("monk_tf.fixture").values()))
+        eager.append(sum(own for own, _ in import_times(
+            "monk_tf.fixture, " + ", ".join(LAZY_MODULES)).values()))
+    # verify
+    nt.ok_(min(lazy) < min(eager), "{}us vs. {}us".format(min(lazy), min(eager)))
+
+def test_lazy_import():
+    """ import: a lazily imported module loads on first use
+    """
+    # setup
+    code = ("import sys, monk_tf.general_purpose as gp;"
+            "m = gp.lazy_import('colorsys');"
+            "before = 'colorsys' in sys.modules;"
+            "m.rgb_to_hsv(0, 0, 0);"
+            "print(before, 'colorsys' in sys.modules)")
+    # execute
+    out = subprocess.check_output([sys.executable, "-c", code],
+            universal_newlines=True)
+    # verify
+    nt.eq_(out.split(), ["False", "True"])
@@ -0,0 +1,153 @@
+# -*- coding: utf-8 -*-
+#
+# MONK automated test framework
+#
+# Copyright (C) 2015 DResearch Fahrzeugelektronik GmbH
+# Written and maintained by MONK Developers <project-monk@dresearch-fe.de>
+#
+# This program is free software; you can redistribute it and/or
+# modify it under the terms of the GNU General Public License
+# as published by the Free Software Foundation; either version
+# 3 of the License, or (at your option) any later version.
+#
+
+import os
+import sys
+import time
+import tempfile
+import subprocess
+
+from nose import tools as nt
+from monk_tf import lease
+
+def test_all_or_nothing():
+    """ lease: a partly busy set of resources is not taken at all
+    """
+    # setup
+    lock_dir = tempfile.mkdtemp()
+    first = lease.Lease(lock_dir=lock_dir).acquire(["dev1"])
+    second = lease.Lease(lock_dir=lock_dir, poll=0.05)
+    # execute
+    nt.assert_raises(lease.LeaseTimeoutException,
+            second.acquire, ["dev2", "dev1"], timeout=0.2)
+    # verify
+    nt.eq_(second.held, {})
+    nt.eq_(first.holders(), {})
+    nt.eq_(second.holders()["dev1"]["pid"], os.getpid())
+    lease.Lease(lock_dir=lock_dir).acquire(["dev2"], timeout=0).release()
+    first.release()
+
+def test_acquire_any_of_pool():
+    """ lease: acquire_any() takes free candidates and their resources
+    """
+    # setup
+    lock_dir = tempfile.mkdtemp()
+    busy = lease.Lease(lock_dir=lock_dir).acquire(["/dev/ttyUSB0"])
+    ports = {"dev1" : ["/dev/ttyUSB0"], "dev2" : ["/dev/ttyUSB1"], "dev3" : []}
+    sut = lease.Lease(lock_dir=lock_dir)
+    # execute
+    chosen = sut.acquire_any(["dev1", "dev2", "dev3"], 2, timeout=0,
+            resources=ports.get)
+    # verify
+    nt.eq_(chosen, ["dev2", "dev3"])
+    nt.eq_(sorted(sut.held), ["/dev/ttyUSB1", "dev2", "dev3"])
+    busy.release()
+    sut.release()
+
+def test_acquire_any_shared_resource():
+    """ lease: candidates that share a resource are not chosen together
+    """
+    # setup
+    lock_dir = tempfile.mkdtemp()
+    ports = {"dev1" : ["/dev/ttyUSB0"], "dev2" : ["/dev/ttyUSB0"], "dev3" : []}
+    sut = lease.Lease(lock_dir=lock_dir, poll=0.05)
+    busy = lease.Lease(lock_dir=lock_dir).acquire(["dev3"])
+    # execute
+    nt.assert_raises(lease.LeaseTimeoutException, sut.acquire_any,
+            ["dev1", "dev2", "dev3"], 2, timeout=0.1, resources=ports.get)
+    sut.acquire(["/dev/ttyUSB0"])
+    nt.assert_raises(lease.LeaseTimeoutException, sut.acquire_any,
+            ["dev1", "dev2"], 1, timeout=0.1, resources=ports.get)
+    busy.release()
+    chosen = sut.acquire_any(["dev2", "dev3"], 1, timeout=0,
+            resources=ports.get)
+    # verify
+    nt.eq_(chosen, ["dev3"])
+    sut.release(["dev3"])
+    nt.eq_(sorted(sut.held), ["/dev/ttyUSB0"])
+    nt.assert_raises(lease.LeaseTimeoutException,
+            lease.Lease(lock_dir=lock_dir).acquire, ["/dev/ttyUSB0"], timeout=0)
+    sut.release()
+    nt.eq_(sut.held, {})
+
+def test_crashed_holder_releases():
+    """ lease: the locks of a killed process are free again
+    """
+    # setup
+    lock_dir = tempfile.mkdtemp()
+    holder = subprocess.Popen([sys.executable, "-c",
+        "import sys, time; from monk_tf import lease; "
+        "l = lease.Lease(lock_dir=sys.argv[1]).acquire(['dev1']); "
+        "print('locked', flush=True); time.sleep(60)", lock_dir],
+        stdout=subprocess.PIPE, cwd=os.path.dirname(os.path.dirname(
+            os.path.abspath(__file__))))
+    holder.stdout.readline()
+    sut = lease.Lease(lock_dir=lock_dir, poll=0.05)
+    nt.assert_raises(lease.LeaseTimeoutException, sut.acquire, ["dev1"],
+            timeout=0.1)
+    # execute
+    holder.kill()
+    holder.wait()
+    # verify
+    sut.acquire(["dev1"], timeout=1)
+    nt.eq_(list(sut.held), ["dev1"])
+    sut.release()
+
+def test_waiting_requests_are_served_in_order():
+    """ lease: a request doesn't overtake an earlier one that waits for the
+        same resources
+    """
+    # setup
+    import threading
+    lock_dir = tempfile.mkdtemp()
+    busy = lease.Lease(lock_dir=lock_dir).acquire(["dev1"])
+    first = lease.Lease(lock_dir=lock_dir, poll=0.05)
+    waiting = threading.Thread(target=first.acquire, args=(["dev1", "dev2"], 10))
+    waiting.start()
+    queue_dir = os.path.join(lock_dir, "queue")
+    while not (os.path.isdir(queue_dir) and os.listdir(queue_dir)):
+        time.sleep(0.01)
+    later = lease.Lease(lock_dir=lock_dir, poll=0.05)
+    # execute
+    nt.assert_raises(lease.LeaseTimeoutException, later.acquire, ["dev2"],
+            timeout=0.2)
+    busy.release()
+    waiting.join(10)
+    # verify
+    nt.eq_(sorted(first.held), ["dev1", "dev2"])
+    nt.eq_(os.listdir(queue_dir), [])
+    first.release()
+    later.acquire(["dev2"], timeout=0).release()
+
+def test_bandwidth_shared_between_pools():
+    """ lease: pools in the same directory split one bandwidth
+    """
+    # setup
+    lock_dir = tempfile.mkdtemp()
+    first = lease.BandwidthPool(1000, lock_dir=lock_dir, poll=0.05)
+    second = lease.BandwidthPool(1000, lock_dir=lock_dir, poll=0.05)
+    # execute
+    big, big_ticket = first.take(starting=1)
+    nt.assert_raises(lease.LeaseTimeoutException, second.take, timeout=0.1)
+    first.give_back(big_ticket)
+    half, half_ticket = first.take(starting=2)
+    rest, rest_ticket = second.take()
+    # a crashed process doesn't give back its share
+    rest_ticket[0].close()
+    again, again_ticket = second.take()
+    # verify
+    nt.eq_((big, half, rest, again), (1000, 500, 500, 500))
+    nt.eq_(second.used(), 1000)
+    first.give_back(half_ticket)
+    second.give_back(again_ticket)
+    nt.eq_(first.used(), 0)
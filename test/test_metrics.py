@@ -0,0 +1,46 @@
+# -*- coding: utf-8 -*-
+#
+# MONK automated test framework
+#
+# Copyright (C) 2015 DResearch Fahrzeugelektronik GmbH
+# Written and maintained by MONK Developers <project-monk@dresearch-fe.de>
+#
+# This program is free software; you can redistribute it and/or
+# modify it under the terms of the GNU General Public License
+# as published by the Free Software Foundation; either version
+# 3 of the License, or (at your option) any later version.
+#
+
+from nose import tools as nt
+from monk_tf import metrics
+
+def test_histogram_stats():
+    """ metrics: a histogram knows count, mean and percentiles
+    """
+    # setup
+    sut = metrics.Histogram()
+    # execute
+    for value in (0.001, 0.002, 0.003, 0.004, 1.0):
+        sut.add(value)
+    # verify
+    nt.eq_(sut.count, 5)
+    nt.assert_almost_equal(sut.mean, 0.202)
+    nt.eq_(sut.percentile(50), 0.004)
+    nt.eq_(sut.percentile(100), 1.0)
+
+def test_combine_per_test():
+    """ metrics: combined metrics keep the data of each test apart
+    """
+    # setup
+    first, second = metrics.Metrics(), metrics.Metrics()
+    first.observe("total", 0.5, test="test_a")
+    first.count("bytes_in", 10, test="test_a")
+    second.observe("total", 1.5, test="test_b")
+    second.count("bytes_in", 5, test="test_b")
+    # execute
+    sut = metrics.Metrics.combine([first, second])
+    # verify
+    nt.eq_(sut.histograms()["total"].count, 2)
+    nt.eq_(sut.histograms(test="test_b")["total"].total, 1.5)
+    nt.eq_(sut.counters(), {"bytes_in" : 15})
+    nt.eq_(sut.counters(test="test_a"), {"bytes_in" : 10})
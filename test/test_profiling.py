@@ -0,0 +1,87 @@
+# -*- coding: utf-8 -*-
+#
+# MONK automated test framework
+#
+# Copyright (C) 2015 DResearch Fahrzeugelektronik GmbH
+# Written and maintained by MONK Developers <project-monk@dresearch-fe.de>
+#
+# This program is free software; you can redistribute it and/or
+# modify it under the terms of the GNU General Public License
+# as published by the Free Software Foundation; either version
+# 3 of the License, or (at your option) any later version.
+#
+
+import os
+import time
+import pstats
+import tempfile
+
+from nose import tools as nt
+from monk_tf import profiling
+from monk_tf import metrics
+
+def test_cprofile_writes_profile():
+    """ profiling: a cProfile run is written and added to the summary
+    """
+    # setup
+    sink = os.path.join(tempfile.mkdtemp(), "%(testcase)s.prof")
+    sut = profiling.Profiling(profiler="cprofile", sink=sink)
+    summary = profiling.SUITE_SUMMARY.profiles
+    # execute
+    sut.start()
+    metrics.Histogram().add(1)
+    sut.stop({"testcase" : "test_cprofile"})
+    # verify
+    stats = pstats.Stats(sink % {"testcase" : "test_cprofile"})
+    nt.ok_(any(func == "add" for _, _, func in stats.stats))
+    nt.eq_(profiling.SUITE_SUMMARY.profiles, summary + 1)
+
+@nt.raises(profiling.UnknownProfilerException)
+def test_unknown_profiler():
+    """ profiling: a wrong profiler type is refused
+    """
+    profiling.Profiling(profiler="magic")
+
+def test_summary_only_monk():
+    """ profiling: the summary only shows monk_tf functions
+    """
+    # setup
+    sut = profiling.Summary()
+    prof = profiling.CProfiler()
+    # execute
+    prof.start()
+    metrics.Histogram().add(1)
+    sorted(range(10))
+    prof.stop()
+    sut.add(prof)
+    # verify
+    funcs = [func for _, _, func, _, _, _ in sut.hottest()]
+    nt.ok_("add" in funcs)
+    nt.ok_("sorted" not in funcs)
+
+def test_sampling_profiler():
+    """ profiling: the sampling profiler estimates seconds from its samples
+    """
+    # setup
+    sut = profiling.SamplingProfiler(interval=0.001)
+    sink = os.path.join(tempfile.mkdtemp(), "samples.folded")
+    # execute
+    sut.start()
+    end_time = time.time() + 0.2
+    while time.time() < end_time:
+        metrics.Histogram().add(1)
+    sut.stop()
+    sut.write(sink)
+    # verify
+    funcs = sut.functions()
+    own = sum(own for _, own, _ in funcs.values())
+    nt.assert_almost_equal(own, sum(sut.stacks.values()) * 0.001)
+    nt.ok_(0 < own < 1)
+    nt.ok_(any(func == "test_sampling_profiler" for _, _, func in funcs))
+    with open(sink) as f:
+        nt.ok_(f.readline().rsplit(" ", 1)[1].strip().isdigit())
+
+def test_profiler_is_abstract():
+    """ profiling: a profiler must implement the whole interface
+    """
+    nt.assert_raises(TypeError, profiling.AProfiler)
@@ -0,0 +1,74 @@
+# -*- coding: utf-8 -*-
+#
+# MONK automated test framework
+#
+# Copyright (C) 2015 DResearch Fahrzeugelektronik GmbH
+# Written and maintained by MONK Developers <project-monk@dresearch-fe.de>
+#
+# This program is free software; you can redistribute it and/or
+# modify it under the terms of the GNU General Public License
+# as published by the Free Software Foundation; either version
+# 3 of the License, or (at your option) any later version.
+#
+
+import os
+import os.path as op
+import sys
+import tempfile
+import subprocess
+
+from nose import tools as nt
+
+here = op.dirname(op.abspath(__file__))
+
+FIXTURE = """
+use_devs=dev1,dev2
+[dev1]
+    type=Device
+    use_conns=serial1
+    [[conns]]
+        [[[serial1]]]
+            type=SimConnection
+            user=""
+[dev2]
+    type=Device
+    use_conns=serial1
+    [[conns]]
+        [[[serial1]]]
+            type=SimConnection
+            user=""
+"""
+
+TESTS = """
+def test_first(monk_dev, monk_devs):
+    assert monk_dev.name.endswith(".dev2")
+    assert len(monk_devs) == 1
+    monk_dev.cmd("export FROM_FIRST=yes")
+
+def test_second(monk_dev):
+    # the session scope keeps the connection
+    assert monk_dev.cmd("echo $FROM_FIRST") == (0, "yes")
+"""
+
+def test_plugin_with_worker_shard():
+    """ pytest_plugin: a xdist worker gets its own device and keeps it
+    """
+    # setup
+    tmp = tempfile.mkdtemp()
+    with open(op.join(tmp, "fixture.cfg"), "w") as f:
+        f.write(FIXTURE)
+    with open(op.join(tmp, "test_sharded.py"), "w") as f:
+        f.write(TESTS)
+    env = dict(os.environ,
+            PYTHONPATH=op.dirname(here),
+            PYTEST_XDIST_WORKER="gw1",
+            PYTEST_XDIST_WORKER_COUNT="2",
+    )
+    # execute
+    proc = subprocess.run([sys.executable, "-m", "pytest", "-q",
+        "-p", "monk_tf.pytest_plugin", "--rootdir", tmp, tmp],
+        env=env, cwd=tmp, stdout=subprocess.PIPE, stderr=subprocess.STDOUT)
+    # verify
+    out = proc.stdout.decode()
+    nt.eq_(proc.returncode, 0, out)
+    nt.ok_("2 passed" in out, out)
@@ -0,0 +1,91 @@
+# -*- coding: utf-8 -*-
+#
+# MONK automated test framework
+#
+# Copyright (C) 2015 DResearch Fahrzeugelektronik GmbH
+# Written and maintained by MONK Developers <project-monk@dresearch-fe.de>
+#
+# This program is free software; you can redistribute it and/or
+# modify it under the terms of the GNU General Public License
+# as published by the Free Software Foundation; either version
+# 3 of the License, or (at your option) any later version.
+#
+
+import os
+import time
+
+from nose import tools as nt
+from monk_tf import sim
+
+def test_login_and_cmd():
+    """ sim: log in on the simulated serial console and send a command
+    """
+    # setup
+    sut = sim.SimConn("sim1", user="tester", pw="secret",
+            first_prompt_timeout=10, default_timeout=5)
+    # execute
+    retcode, out = sut.cmd("echo 123")
+    # verify
+    nt.eq_(retcode, 0)
+    nt.eq_(out, "123")
+    nt.eq_(sut.sim.stats["logins"], 1)
+
+def test_reconnect_after_disconnect():
+    """ sim: the connection recovers when the device drops the session
+    """
+    # setup
+    sut = sim.SimConn("sim2", user="tester", pw="secret",
+            first_prompt_timeout=20, default_timeout=2)
+    sut.cmd("true")
+    # execute
+    sut.sim.disconnect(silent_for=0)
+    sut.close()
+    retcode, out = sut.cmd("echo back")
+    # verify
+    nt.eq_(out, "back")
+    nt.eq_(sut.sim.stats["logins"], 2)
+
+def test_baud_limits_throughput():
+    """ sim: a slow baud rate slows down the output
+    """
+    # setup
+    sut = sim.SimConn("sim3", user="", pw="", baud=4800,
+            first_prompt_timeout=10, default_timeout=10)
+    sut.cmd("true")
+    # execute
+    start = time.time()
+    sut.cmd("printf '%0200d\\n' 0")
+    # verify; 200 bytes at 480 bytes per second
+    nt.ok_(time.time() - start > 0.4)
+
+def test_faults_are_reproducible():
+    """ sim: the same seed drops the same bytes
+    """
+    # setup
+    sims = [sim.Simulator(drop_rate=0.5, seed=42) for _ in range(2)]
+    # execute
+    for s in sims:
+        s._master = -1
+        s._write_raw = lambda data, s=s: s.stats.__setitem__("out", data)
+        s._write("some bytes to drop")
+    # verify
+    nt.eq_(sims[0].stats["out"], sims[1].stats["out"])
+    nt.ok_(sims[0].stats["dropped"] > 0)
+
+def test_heredoc_and_overrun():
+    """ sim: here-documents get continuation prompts, big bursts overrun
+    """
+    # setup
+    sut = sim.Simulator(user="", rx_buffer=16).start()
+    fd = os.open(sut.port, os.O_RDWR)
+    # execute
+    os.write(fd, b"cat <<'E'\nfirst\n")
+    time.sleep(0.3)
+    os.write(fd, b"E\n" + b"#" * 40)
+    time.sleep(0.3)
+    out = os.read(fd, 4096)
+    # verify
+    nt.ok_(b"> first\r\n> E\r\nfirst\r\n" in out, out)
+    nt.eq_(sut.stats["overruns"], 40 + 2 - 16)
+    os.close(fd)
+    sut.stop()
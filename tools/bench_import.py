@@ -0,0 +1,36 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+#
+# MONK automated test framework
+#
+# Copyright (C) 2015 DResearch Fahrzeugelektronik GmbH
+# Written and maintained by MONK Developers <project-monk@dresearch-fe.de>
+#
+# This program is free software; you can redistribute it and/or
+# modify it under the terms of the GNU General Public License
+# as published by the Free Software Foundation; either version
+# 3 of the License, or (at your option) any later version.
+#
+
+""" measure how long importing a monk_tf module takes
+
+Runs ``python -X importtime`` a few times and shows the fastest run and the
+modules that took the most time in it. Usage::
+
+    python tools/bench_import.py [module] [runs]
+"""
+
+import sys
+
+from importtime import import_times
+
+def main(module="monk_tf.fixture", runs=5):
+    best = min((import_times(module) for _ in range(int(runs))),
+            key=lambda times: times[module][1])
+    print("import {}: {:.1f}ms".format(module, best[module][1] / 1000.0))
+    print("{:>10}  module".format("self [ms]"))
+    for name, (own, _) in sorted(best.items(), key=lambda i: i[1][0], reverse=True)[:15]:
+        print("{:>10.1f}  {}".format(own / 1000.0, name))
+
+if __name__ == "__main__":
+    main(*sys.argv[1:])
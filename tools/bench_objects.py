@@ -0,0 +1,62 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+#
+# MONK automated test framework
+#
+# Copyright (C) 2015 DResearch Fahrzeugelektronik GmbH
+# Written and maintained by MONK Developers <project-monk@dresearch-fe.de>
+#
+# This program is free software; you can redistribute it and/or
+# modify it under the terms of the GNU General Public License
+# as published by the Free Software Foundation; either version
+# 3 of the License, or (at your option) any later version.
+#
+
+""" measure how much creating and deleting MONK objects costs
+
+Builds devices with three ssh connections each, like a big fixture does,
+without connecting to anything. Usage::
+
+    python tools/bench_objects.py [devices]
+"""
+
+import gc
+import sys
+import time
+
+import monk_tf.conn as mc
+import monk_tf.dev as md
+
+def build(n):
+    devs = []
+    for i in range(n):
+        conns = {
+            "ssh{}{}".format(i, suffix) : mc.SshConn("ssh{}{}".format(i, suffix),
+                "10.{}.{}.{}".format(net, i // 250, i % 250), "root", "root")
+            for net, suffix in enumerate(("", "-b", "-c"))
+        }
+        devs.append(md.Device(conns=conns, use_conns=list(conns),
+            name="dev{}".format(i)))
+    return devs
+
+def main(devices=300):
+    devices = int(devices)
+    objects = devices * 4
+    # the first round warms up the logger cache and the imports
+    del_devs = build(devices)
+    del del_devs
+    gc.collect()
+    start = time.time()
+    devs = build(devices)
+    built = time.time()
+    del devs
+    gc.collect()
+    deleted = time.time()
+    print("{} devices, {} objects".format(devices, objects))
+    print("construction {:8.3f}s {:8.1f}us/object".format(
+        built - start, (built - start) / objects * 1e6))
+    print("teardown     {:8.3f}s {:8.1f}us/object".format(
+        deleted - built, (deleted - built) / objects * 1e6))
+
+if __name__ == "__main__":
+    main(*sys.argv[1:])
@@ -0,0 +1,60 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+#
+# MONK automated test framework
+#
+# Copyright (C) 2015 DResearch Fahrzeugelektronik GmbH
+# Written and maintained by MONK Developers <project-monk@dresearch-fe.de>
+#
+# This program is free software; you can redistribute it and/or
+# modify it under the terms of the GNU General Public License
+# as published by the Free Software Foundation; either version
+# 3 of the License, or (at your option) any later version.
+#
+
+""" compare expect() with raw patterns to expect_list() with patterns from
+    ConnectionBase.compile_patterns()
+
+Every round writes a line of output and a prompt into a pipe and waits for
+the prompt, like a cmd() does. Usage::
+
+    python tools/bench_patterns.py [rounds]
+"""
+
+import os
+import sys
+import time
+
+import pexpect
+from pexpect import fdpexpect
+
+import monk_tf.conn as mc
+
+PROMPT = r"\[\w+@\w+ [^\]]*\][#$] "
+PATTERNS = [PROMPT, "(?i)login: ", "(?i)password: ", pexpect.EOF, pexpect.TIMEOUT]
+OUTPUT = b"some output of the command\r\n<retcode>0</retcode>\r\n[root@dut ~]# "
+
+def run(rounds, expect):
+    r, w = os.pipe()
+    spawn = fdpexpect.fdspawn(r)
+    start = time.time()
+    for _ in range(rounds):
+        os.write(w, OUTPUT)
+        if expect(spawn) != 0:
+            raise Exception("prompt not found")
+    duration = time.time() - start
+    os.close(w)
+    spawn.close()
+    return duration
+
+def main(rounds=20000):
+    conn = mc.ConnectionBase("bench", None, None, None)
+    raw = run(rounds, lambda spawn: spawn.expect(PATTERNS))
+    cached = run(rounds, lambda spawn: spawn.expect_list(conn.compile_patterns(PATTERNS)))
+    for name, duration in (("expect(patterns)", raw), ("expect_list(cached)", cached)):
+        print("{:<22} {:8.3f}s {:8.2f}us/expect".format(
+            name, duration, duration / rounds * 1e6))
+    print("speedup {:.2f}x".format(raw / cached))
+
+if __name__ == "__main__":
+    main(*[int(a) for a in sys.argv[1:]])
@@ -0,0 +1,40 @@
+# -*- coding: utf-8 -*-
+#
+# MONK automated test framework
+#
+# Copyright (C) 2015 DResearch Fahrzeugelektronik GmbH
+# Written and maintained by MONK Developers <project-monk@dresearch-fe.de>
+#
+# This program is free software; you can redistribute it and/or
+# modify it under the terms of the GNU General Public License
+# as published by the Free Software Foundation; either version
+# 3 of the License, or (at your option) any later version.
+#
+
+""" measure imports with ``python -X importtime``; used by
+``bench_import.py`` and ``test/test_import.py``
+"""
+
+import os
+import sys
+import subprocess
+
+def import_times(modules):
+    """ import modules in a fresh interpreter with ``python -X importtime``
+
+    :param modules: what follows ``import``, e.g. "monk_tf.fixture"
+
+    :return: dict of module:(own, cumulative) in microseconds
+    """
+    env = dict(os.environ)
+    # without .pyc files compiling would be measured, too
+    env.pop("PYTHONDONTWRITEBYTECODE", None)
+    proc = subprocess.run([sys.executable, "-X", "importtime", "-c",
+        "import " + modules], env=env, stderr=subprocess.PIPE,
+        universal_newlines=True, check=True)
+    result = {}
+    for line in proc.stderr.splitlines():
+        if line.startswith("import time:") and "self [us]" not in line:
+            own, cumulative, name = line[len("import time:"):].split("|")
+            result[name.strip()] = (int(own), int(cumulative))
+    return result